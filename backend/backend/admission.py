@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from typing import Optional
+from util.config import (API_GUILD_BURST, API_GUILD_RATE, API_LIMITER_KEYS, API_MAX_IN_FLIGHT, API_MAX_QUEUED,
+                         API_QUEUE_TIMEOUT, API_SHED_DELIVERY_PENDING, API_SHED_SCHEDULER_LAG, API_TOKEN_BURST,
+                         API_TOKEN_RATE, API_UNVERIFIED_BURST, API_UNVERIFIED_RATE)
+
+# Monitoring stays reachable however loaded the API is
+UNLIMITED_PATHS = ("/healthcheck", "/metrics", "/metrics.json", "/admission")
+
+# Key of the one bucket every caller without a verified token shares
+UNVERIFIED = ""
+
+# Waiters for a slot are served in this order, changes to the schedule ahead of dashboard reads
+WRITE_PRIORITY = 0
+READ_PRIORITY = 1
+
+
+class KeyedLimiter:
+    # One token bucket per key, refilled at `rate` tokens a second up to `burst`. Buckets are [tokens, updated_at] in
+    # least recently used order, and the least recently used one is dropped once there are more than `max_keys`.
+    def __init__(self, rate: float, burst: float, max_keys: int = API_LIMITER_KEYS):
+        self.rate: float = rate
+        self.burst: float = burst
+        self.max_keys: int = max_keys
+        self.limited: int = 0
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, now: Optional[float] = None) -> float:
+        # Takes a token and returns 0, or returns how many seconds until the bucket has one again
+        now = now if now is not None else time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        self.limited += 1
+        return (1 - bucket[0]) / self.rate
+
+    def stats(self) -> dict[str, float]:
+        return {"keys": len(self), "rate": self.rate, "burst": self.burst, "limited": self.limited}
+
+
+class AdmissionController:
+    # Decides before a route runs whether the API takes the request: 429 once the caller's token ran out of its bucket,
+    # 503 while the bot's own work is behind (reads only) or when no slot frees up in time. At most
+    # `max_in_flight` requests run at once, the rest wait in a bounded queue where writes go before reads. Every
+    # rejection carries how long to wait before retrying. The guild's bucket is only charged by admit_guild() once the
+    # caller is authorised for the guild, so nobody else can use it up.
+    def __init__(self, scheduler, delivery, max_in_flight: int = API_MAX_IN_FLIGHT, max_queued: int = API_MAX_QUEUED,
+                 queue_timeout: float = API_QUEUE_TIMEOUT):
+        self.scheduler = scheduler
+        self.delivery = delivery
+        self.tokens: KeyedLimiter = KeyedLimiter(API_TOKEN_RATE, API_TOKEN_BURST)
+        self.unverified: KeyedLimiter = KeyedLimiter(API_UNVERIFIED_RATE, API_UNVERIFIED_BURST, 1)
+        self.guilds: KeyedLimiter = KeyedLimiter(API_GUILD_RATE, API_GUILD_BURST)
+        self.max_in_flight: int = max_in_flight
+        self.max_queued: int = max_queued
+        self.queue_timeout: float = queue_timeout
+        self.in_flight: int = 0
+        self.queued: int = 0
+        self.rejected: dict[str, int] = {"token": 0, "unverified": 0, "guild": 0, "overloaded": 0, "queue_full": 0,
+                                         "queue_timeout": 0}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    def overloaded(self) -> bool:
+        return (self.scheduler.lag() > API_SHED_SCHEDULER_LAG
+                or self.delivery.pending > API_SHED_DELIVERY_PENDING)
+
+    async def admit(self, token: Optional[str], write: bool) -> Optional[tuple[int, float, str]]:
+        # Returns None once the request holds a slot, which release() gives back, or (status, retry after, reason)
+        # for a rejected one. `token` is None for a caller whose token isn't verified, made up ones included, so they
+        # can't get a bucket each. Tokens are hashed so raw tokens aren't kept as keys.
+        if token is None:
+            retry_after = self.unverified.take(UNVERIFIED)
+            if retry_after:
+                return self._reject(429, retry_after, "unverified")
+        else:
+            retry_after = self.tokens.take(hashlib.sha256(token.encode()).hexdigest())
+            if retry_after:
+                return self._reject(429, retry_after, "token")
+        if not write and self.overloaded():
+            return self._reject(503, 1, "overloaded")
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            return None
+        if self.queued >= self.max_queued:
+            return self._reject(503, 1, "queue_full")
+        return await self._wait(WRITE_PRIORITY if write else READ_PRIORITY)
+
+    def admit_guild(self, guild_id: str) -> Optional[tuple[int, float, str]]:
+        retry_after = self.guilds.take(guild_id)
+        if retry_after:
+            return self._reject(429, retry_after, "guild")
+        return None
+
+    async def _wait(self, priority: int) -> Optional[tuple[int, float, str]]:
+        # release() hands its slot straight to the first waiter by resolving its future, so in_flight doesn't change
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self.queued += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.cancelled():
+                return self._reject(503, self.queue_timeout, "queue_timeout")
+        except asyncio.CancelledError:
+            # The client went away, a slot handed over meanwhile is passed on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self.queued -= 1
+        return None
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _reject(self, status: int, retry_after: float, reason: str) -> tuple[int, float, str]:
+        self.rejected[reason] += 1
+        return status, retry_after, reason
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight, "queued": self.queued,
+                "max_queued": self.max_queued, "overloaded": self.overloaded(), "rejected": dict(self.rejected),
+                "tokens": self.tokens.stats(), "unverified": self.unverified.stats(),
+                "guilds": self.guilds.stats()}
@@ -1,51 +1,223 @@
-from functools import wraps
+import hmac
+import math
+import re
+import time
+from functools import partial, wraps
+from typing import Optional
 import discord
-from flask import Flask, jsonify, request
-from flask_cors import CORS
+from quart import Quart, Response, current_app, g, jsonify, request
+from quart_cors import cors
+from util.cache import TTLCache
+from util.config import CHANNEL_CACHE_SIZE, CHANNEL_CACHE_TTL, INTERNAL_API_TOKEN
 from util.db import DBUtil
-from util.auth import is_auth, get_user_id, is_authorised_for_guild, get_user_guilds
-from shared.tasks import schedule_announcement, remove_scheduled_announcement
+from util.auth import is_auth, is_verified, get_user_id, is_authorised_for_guild, get_user_guilds, get_auth_cache_stats
+from util.metrics import registry, resident_memory_bytes
+from util.permissions import permissions
+from bot.guild_index import guild_index
+from backend.admission import UNLIMITED_PATHS, AdmissionController
+from backend.listing import ListingQuery, list_announcements
+from backend.bulk import MAX_BATCH_SIZE, EXPORT_FIELDS, apply_batch, parse_ndjson, parse_targets
+from backend.occurrences import (MAX_CALENDAR_OCCURRENCES, MAX_CALENDAR_RANGE, MAX_UPCOMING_RANGE, get_calendar,
+                                 get_upcoming_load, parse_range)
+from shared.outbox import outbox
+from shared.tasks import apply_announcement_change, diff_scheduler
+from shared.templates import compile_template, template_cache
+
+# Channel id -> id of its guild, "" for a channel the bot can't see
+channel_guilds = TTLCache(CHANNEL_CACHE_SIZE, CHANNEL_CACHE_TTL)
+
+request_seconds = registry.histogram("api_request_seconds", "API request handling time", ["endpoint", "method"])
+requests_total = registry.counter("api_requests_total", "API responses", ["endpoint", "method", "status"])
+
+
+def cached_json(payload: str, etag: str):
+    # Payloads from the guild index come with a precomputed ETag, so a client polling with If-None-Match gets a 304
+    if request.if_none_match.contains(etag):
+        response = Response("", status=304)
+    else:
+        response = Response(payload, content_type="application/json")
+    response.set_etag(etag)
+    return response
 
 
 def auth(f):
     @wraps(f)
-    def decorated_function(*args, **kwargs):
+    async def decorated_function(*args, **kwargs):
         token = request.headers.get('Authorization')
-        if not token or not is_auth(token):
+        if not token or not await is_auth(token):
             return jsonify({"error": "Unauthorized access"}), 401
-        return f(*args, **kwargs)
+        return await f(*args, **kwargs)
+
+    return decorated_function
+
+
+def internal(f):
+    # Operator endpoints, which span every guild, take the internal token instead of a Discord one
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if INTERNAL_API_TOKEN is None:
+            return jsonify({"error": "Not found"}), 404
+        token = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(token.encode(), f"Bearer {INTERNAL_API_TOKEN}".encode()):
+            return jsonify({"error": "Unauthorized access"}), 401
+        return await f(*args, **kwargs)
 
     return decorated_function
 
 
 def guild_auth(f):
     @wraps(f)
-    def decorated_function(*args, **kwargs):
+    async def decorated_function(*args, **kwargs):
         token = request.headers.get('Authorization')
         if not token:
             return jsonify({"error": "Unauthorized access"}), 401
         guild_id = kwargs.get("guild_id")
         if not guild_id:
             return jsonify({"error": "Bad Request"}), 400
-        if guild_id and not is_authorised_for_guild(token, guild_id):
+        if guild_id and not await is_authorised_for_guild(token, guild_id):
             return jsonify({"error": "Forbidden"}), 403
-        return f(*args, **kwargs)
+        # Charged only now, so callers without rights in the guild can't use up its bucket
+        admission = current_app.extensions.get("admission")
+        rejection = admission.admit_guild(guild_id) if admission is not None else None
+        if rejection is not None:
+            return rejected(*rejection)
+        return await f(*args, **kwargs)
 
     return decorated_function
 
 
-def create_app(bot, loop, scheduler):
-    app = Flask(__name__)
-    CORS(app, supports_credentials=True)
+def rejected(status: int, retry_after: float, reason: str):
+    error = "Too Many Requests" if status == 429 else "Service Unavailable"
+    return jsonify({"error": error, "reason": reason}), status, {"Retry-After": str(math.ceil(retry_after))}
+
+
+async def can_target_guilds(token: str, guild_id: str, targets: list[tuple[str, str]]) -> bool:
+    # Broadcast targets in other guilds need the same rights there as in the announcement's own guild
+    for target_guild_id in {target_guild_id for target_guild_id, _ in targets} - {guild_id}:
+        if not await is_authorised_for_guild(token, target_guild_id):
+            return False
+    return True
+
+
+async def get_channel_guild(bot, channel_id: str) -> Optional[str]:
+    # Answered from the gateway cache for this process's guilds and over REST for the rest, None when Discord couldn't
+    # be asked
+    channel = bot.get_channel(int(channel_id))
+    if channel is not None:
+        return str(channel.guild.id) if isinstance(channel, discord.abc.GuildChannel) else ""
+    return await channel_guilds.get_or_load(channel_id, lambda: _fetch_channel_guild(bot, channel_id))
+
+
+async def _fetch_channel_guild(bot, channel_id: str) -> Optional[str]:
+    try:
+        channel = await bot.fetch_channel(int(channel_id))
+    except (discord.NotFound, discord.Forbidden):
+        return ""
+    except discord.HTTPException as e:
+        print(f"Error fetching channel {channel_id}: {e}")
+        return None
+    return str(channel.guild.id) if isinstance(channel, discord.abc.GuildChannel) else ""
+
+
+async def check_target_channels(bot, targets: list[tuple[str, str]]) -> None:
+    # A target is only sent where it says, so its channel has to be in its guild, the one the caller's rights were
+    # checked for. Raises ValueError otherwise.
+    for target_guild_id, channel_id in targets:
+        if await get_channel_guild(bot, channel_id) != target_guild_id:
+            raise ValueError(f"Channel {channel_id} is not in guild {target_guild_id}")
+
+
+def register_gauges(db, scheduler, delivery, admission):
+    # Read off the live objects when scraped, nothing on the hot path updates these
+    def auth_cache(field):
+        return lambda: {(cache,): stats[field] for cache, stats in get_auth_cache_stats().items()}
+
+    def due_next_hour():
+        now = int(time.time())
+        return db.count_due_announcements(now, now + 3600)
+
+    registry.gauge("scheduler_jobs", "Announcements loaded into the in-memory scheduler",
+                   callback=lambda: len(scheduler.jobs))
+    registry.gauge("scheduler_horizon_timestamp", "Announcements due before this time are loaded",
+                   callback=lambda: scheduler.horizon)
+    registry.gauge("announcements_due_next_hour", "Announcements whose next fire time is within the next hour",
+                   callback=due_next_hour)
+    registry.gauge("delivery_pending", "Sends queued or in flight", callback=lambda: delivery.pending)
+    registry.gauge("delivery_buckets", "Rate limit buckets with queued sends", callback=lambda: delivery.buckets)
+    registry.counter("delivery_delivered_total", "Announcements acknowledged by Discord",
+                     callback=lambda: delivery.delivered)
+    registry.counter("delivery_failed_total", "Announcements given up on", callback=lambda: delivery.failed)
+    registry.gauge("outbox_pending", "Delivery status changes waiting to be committed", callback=lambda: outbox.pending)
+    registry.counter("outbox_flushes_total", "Outbox commits", callback=lambda: outbox.flushes)
+    registry.counter("auth_cache_hits_total", "Discord identity cache hits", ["cache"], callback=auth_cache("hits"))
+    registry.counter("auth_cache_misses_total", "Discord identity cache misses", ["cache"],
+                     callback=auth_cache("misses"))
+    registry.gauge("auth_cache_size", "Discord identity cache entries", ["cache"], callback=auth_cache("size"))
+    registry.gauge("api_in_flight", "API requests being handled", callback=lambda: admission.in_flight)
+    registry.gauge("api_queued", "API requests waiting for a slot", callback=lambda: admission.queued)
+    registry.counter("api_rejected_total", "API requests turned away by admission control", ["reason"],
+                     callback=lambda: {(reason,): count for reason, count in admission.rejected.items()})
+    registry.gauge("api_limiter_keys", "Token buckets held by the API rate limiters", ["limiter"],
+                   callback=lambda: {("token",): len(admission.tokens), ("unverified",): len(admission.unverified),
+                                     ("guild",): len(admission.guilds)})
+    registry.gauge("template_cache_size", "Compiled announcement templates in memory",
+                   callback=lambda: len(template_cache))
+    registry.counter("template_cache_hits_total", "Announcement sends that reused a compiled template",
+                     callback=lambda: template_cache.hits)
+    registry.counter("template_cache_misses_total", "Announcement sends that had to compile their template",
+                     callback=lambda: template_cache.misses)
+    registry.gauge("process_resident_memory_bytes", "Resident memory of this process",
+                   callback=resident_memory_bytes)
+    registry.gauge("guilds", "Guilds this process holds on the gateway", callback=lambda: len(guild_index.guilds))
+    registry.gauge("process_resident_memory_bytes_per_guild", "Resident memory divided by the guilds held",
+                   callback=lambda: resident_memory_bytes() / max(1, len(guild_index.guilds)))
+
+
+def create_app(bot, scheduler, delivery):
+    app = Quart(__name__)
+    # Reflect the caller's origin like flask-cors did, credentials can't be combined with a plain "*"
+    app = cors(app, allow_origin=re.compile(r".*"), allow_credentials=True)
     db = DBUtil()
+    admission = app.extensions["admission"] = AdmissionController(scheduler, delivery)
+    register_gauges(db, scheduler, delivery, admission)
+
+    @app.before_request
+    async def start_timer():
+        g.started = time.perf_counter()
+
+    @app.before_request
+    async def admit():
+        # Runs before authentication, so a flood of requests is turned away without costing Discord calls. Only a token
+        # Discord already accepted gets a bucket of its own, anything else is limited together.
+        if request.path in UNLIMITED_PATHS or request.method == "OPTIONS":
+            return None
+        token = request.headers.get('Authorization')
+        rejection = await admission.admit(token if token and is_verified(token) else None, request.method != "GET")
+        if rejection is None:
+            g.admitted = True
+            return None
+        return rejected(*rejection)
+
+    @app.teardown_request
+    async def release_slot(exception):
+        if g.get("admitted"):
+            admission.release()
+
+    @app.after_request
+    async def record_latency(response):
+        # Labelled by route pattern rather than path, so guild and announcement ids don't multiply the series
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        request_seconds.observe(time.perf_counter() - g.started, endpoint, request.method)
+        requests_total.inc(1, endpoint, request.method, response.status_code)
+        return response
 
     @app.route('/guilds', methods=['GET'])
     @auth
-    def get_guilds():
+    async def get_guilds():
         try:
             token = request.headers.get('Authorization')
             guild_ids = [guild['guild_id'] for guild in db.get_guilds()]
-            user_guilds = get_user_guilds(token)
+            user_guilds = await get_user_guilds(token)
             user_guild_ids = [guild['id'] for guild in user_guilds]
             authorized_guild_ids = list(set(guild_ids) & set(user_guild_ids))
             guilds = list(filter(lambda x: x['id'] in authorized_guild_ids, user_guilds))
@@ -59,9 +231,10 @@ def create_app(bot, loop, scheduler):
 
     @app.route('/guilds', methods=['POST'])
     @auth
-    def add_guild():
+    async def add_guild():
         try:
-            guild_id = request.json['guild_id']
+            data = await request.get_json()
+            guild_id = data['guild_id']
             db.add_guild(guild_id)
             return jsonify({"message": "success"}), 200
         except Exception as e:
@@ -69,78 +242,166 @@ def create_app(bot, loop, scheduler):
 
     @app.route('/guilds/<guild_id>', methods=['GET'])
     @guild_auth
-    def get_guild(guild_id: str):
-        if guild_id in [guild["guild_id"] for guild in db.get_guilds()]:
-            guild = [guild for guild in bot.guilds if str(guild.id) == guild_id][0]
-            name = str(guild.name)
-            guild_id = guild_id
-            icon = str(guild.icon)
-            announcements = db.get_announcements(guild_id)
-            return jsonify({"name": name, "id": guild_id, "icon": icon, "scheduledAnnouncements": announcements})
+    async def get_guild(guild_id: str):
+        guild = guild_index.get(guild_id)
+        if guild is None:
+            return jsonify({"error": "Guild not found"}), 404
+        fields = request.args.get("fields")
+        try:
+            announcements = [row for page in db.iter_announcements(guild_id, fields.split(",") if fields else None)
+                             for row in page]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"name": guild.name, "id": guild_id, "icon": guild.icon,
+                        "scheduledAnnouncements": announcements})
 
     @app.route('/guilds/<guild_id>/announcements', methods=['GET'])
     @guild_auth
-    def get_announcements(guild_id: str):
+    async def get_announcements(guild_id: str):
         try:
-            return jsonify(db.get_announcements(guild_id)), 200
+            return list_announcements(db, guild_id, ListingQuery(request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": e}), 500
 
+    @app.route('/guilds/<guild_id>/calendar', methods=['GET'])
+    @guild_auth
+    async def get_guild_calendar(guild_id: str):
+        # ?from=&to= unix timestamps, a week from now by default, and ?limit= occurrences at most
+        try:
+            start, end = parse_range(request.args, 7 * 86400, MAX_CALENDAR_RANGE)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        limit = min(max(request.args.get("limit", MAX_CALENDAR_OCCURRENCES, type=int), 1), MAX_CALENDAR_OCCURRENCES)
+        return jsonify(await get_calendar(db, guild_id, start, end, limit))
+
     @app.route('/guilds/<guild_id>/announcements/<announcement_id>', methods=['GET'])
     @guild_auth
-    def get_announcement(guild_id: str, announcement_id: int):
+    async def get_announcement(guild_id: str, announcement_id: int):
         try:
             print("TEST")
-            return jsonify(db.get_announcement(guild_id, announcement_id)), 200
+            announcement = db.get_announcement(guild_id, announcement_id)
+            targets = db.get_announcement_targets([announcement["id"]]).get(announcement["id"], [])
+            announcement["targets"] = [{"guild_id": target_guild_id, "channel_id": channel_id}
+                                       for target_guild_id, channel_id in targets]
+            return jsonify(announcement), 200
         except Exception as e:
             return jsonify({"error": e}), 500
 
     @app.route('/guilds/<guild_id>/announcements', methods=['POST'])
     @guild_auth
-    def add_announcements(guild_id: str):
-        try:
-            user_id = get_user_id(request.headers.get('Authorization'))
-            channel_id = request.json['channel_id']
-            message = request.json['message']
-            name = request.json['name']
-            timestamp = request.json['timestamp']
-            period = request.json['period']
-            announcement_id = db.add_announcement(guild_id, user_id, channel_id, name, message, timestamp, period)
-            schedule_announcement(bot, scheduler, loop, announcement_id, guild_id, channel_id, message, timestamp,
-                                  period)
+    async def add_announcements(guild_id: str):
+        try:
+            data = await request.get_json()
+            token = request.headers.get('Authorization')
+            user_id = await get_user_id(token)
+            channel_id = data['channel_id']
+            message = data['message']
+            name = data['name']
+            timestamp = data['timestamp']
+            period = data['period']
+            compile_template(message)
+            # Optional [{"channel_id": ..., "guild_id": ...}] the announcement is broadcast to besides channel_id
+            targets = parse_targets(data.get('targets', []), guild_id)
+            if not await can_target_guilds(token, guild_id, targets):
+                return jsonify({"error": "Forbidden"}), 403
+            await check_target_channels(bot, targets)
+            announcement_id = db.add_announcement(guild_id, user_id, channel_id, name, message, timestamp, period,
+                                                  targets)
+            apply_announcement_change(delivery, scheduler, announcement_id,
+                                      {**db.get_announcement(guild_id, announcement_id), "targets": targets})
             return jsonify({"message": "success"}), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": e}), 500
 
-    @app.route('/guilds/<guild_id>/announcements/<announcement_id>', methods=['PATCH'])
-    @guild_auth
-    def edit_announcement(guild_id: str, announcement_id: int):
-        try:
-            if announcement_id in [announcement["id"] for announcement in db.get_announcements(guild_id)]:
-                user_id = get_user_id(request.headers.get('Authorization'))
-                channel_id, message, timestamp, period = None, None, None, None
-                if request.json['channel_id']:
-                    channel_id = request.json['channel_id']
-                if request.json['message']:
-                    message = request.json['message']
-                if request.json['timestamp']:
-                    timestamp = request.json['timestamp']
-                if request.json['period']:
-                    period = request.json['period']
-                db.update_announcement(announcement_id, user_id, channel_id, message, timestamp, period)
+    @app.route('/guilds/<guild_id>/announcements:batch', methods=['POST'])
+    @guild_auth
+    async def batch_announcements(guild_id: str):
+        # {"create": [{...}], "update": [{"id": ..., ...}], "delete": [id, ...]}
+        data = await request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Bad Request"}), 400
+        create, update, delete = data.get("create", []), data.get("update", []), data.get("delete", [])
+        if not all(isinstance(items, list) for items in (create, update, delete)):
+            return jsonify({"error": "create, update and delete must be lists"}), 400
+        if len(create) + len(update) + len(delete) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"At most {MAX_BATCH_SIZE} items per batch"}), 413
+        try:
+            token = request.headers.get('Authorization')
+            user_id = await get_user_id(token)
+            result = await apply_batch(db, delivery, scheduler, guild_id, user_id, create, update, delete,
+                                       can_target=partial(is_authorised_for_guild, token),
+                                       channel_guild=partial(get_channel_guild, bot))
+            return jsonify(result), 207 if result["errors"] else 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/guilds/<guild_id>/announcements:import', methods=['POST'])
+    @guild_auth
+    async def import_announcements(guild_id: str):
+        # One announcement per line, in the format announcements:export writes
+        items, errors = parse_ndjson(await request.get_data(as_text=True))
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"At most {MAX_BATCH_SIZE} items per import"}), 413
+        try:
+            token = request.headers.get('Authorization')
+            user_id = await get_user_id(token)
+            result = await apply_batch(db, delivery, scheduler, guild_id, user_id, items, [], [], errors,
+                                       can_target=partial(is_authorised_for_guild, token),
+                                       channel_guild=partial(get_channel_guild, bot))
+            return jsonify(result), 207 if result["errors"] else 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/guilds/<guild_id>/announcements:export', methods=['GET'])
+    @guild_auth
+    async def export_announcements(guild_id: str):
+        try:
+            query = ListingQuery(request.args)
+            query.fields = query.fields or EXPORT_FIELDS
+            query.ndjson, query.limit, query.targets = True, None, True
+            return list_announcements(db, guild_id, query)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route('/guilds/<guild_id>/announcements/<int:announcement_id>', methods=['PATCH'])
+    @guild_auth
+    async def edit_announcement(guild_id: str, announcement_id: int):
+        try:
+            data = await request.get_json()
+            if db.get_announcements_by_ids(guild_id, [announcement_id]):
+                if data.get('message'):
+                    compile_template(data['message'])
+                token = request.headers.get('Authorization')
+                targets = parse_targets(data['targets'], guild_id) if data.get('targets') is not None else None
+                if targets is not None and not await can_target_guilds(token, guild_id, targets):
+                    return jsonify({"error": "Forbidden"}), 403
+                if targets is not None:
+                    await check_target_channels(bot, targets)
+                user_id = await get_user_id(token)
+                db.update_announcement(announcement_id, user_id, data.get('channel_id'), data.get('message'),
+                                       data.get('timestamp'), data.get('period'), targets)
+                # Goes live right away instead of on the next restart
+                apply_announcement_change(delivery, scheduler, announcement_id,
+                                          db.get_announcement(guild_id, announcement_id))
                 return jsonify({"message": "success"}), 200
             else:
                 return jsonify({"error": "Forbidden"}), 403
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": e}), 500
 
-    @app.route('/guilds/<guild_id>/announcements/<announcement_id>', methods=['DELETE'])
+    @app.route('/guilds/<guild_id>/announcements/<int:announcement_id>', methods=['DELETE'])
     @guild_auth
-    def delete_announcement(guild_id: str, announcement_id: int):
+    async def delete_announcement(guild_id: str, announcement_id: int):
         try:
-            if announcement_id in [str(announcement["id"]) for announcement in db.get_announcements(guild_id)]:
+            if db.get_announcements_by_ids(guild_id, [announcement_id]):
                 db.remove_announcement(announcement_id)
-                remove_scheduled_announcement(scheduler, announcement_id)
+                apply_announcement_change(delivery, scheduler, announcement_id)
                 return jsonify({"message": "success"}), 200
             else:
                 return jsonify({"error": "Forbidden"}), 403
@@ -149,7 +410,7 @@ def create_app(bot, loop, scheduler):
 
     @app.route('/guilds/<guild_id>/admins', methods=['GET'])
     @guild_auth
-    def get_admins(guild_id: str):
+    async def get_admins(guild_id: str):
         try:
             return jsonify(db.get_admins(guild_id)), 200
         except Exception as e:
@@ -157,26 +418,30 @@ def create_app(bot, loop, scheduler):
 
     @app.route('/guilds/<guild_id>/admins', methods=['POST'])
     @guild_auth
-    def add_admin(guild_id: str):
+    async def add_admin(guild_id: str):
         try:
-            user_id = request.json['user_id']
+            data = await request.get_json()
+            user_id = data['user_id']
             db.add_admin(guild_id, user_id)
+            permissions.invalidate_guild(guild_id)
             return jsonify({"message": "success"}), 200
         except Exception as e:
             return jsonify({"error": e}), 500
 
     @app.route('/guilds/<guild_id>/admins', methods=['PATCH'])
     @guild_auth
-    def edit_admin(guild_id: str):
+    async def edit_admin(guild_id: str):
         return
 
     @app.route('/guilds/<guild_id>/admins', methods=['DELETE'])
     @guild_auth
-    def remove_admin(guild_id: str):
+    async def remove_admin(guild_id: str):
         try:
-            user_id = request.json['user_id']
-            if user_id in [admins["user_id"] for admins in db.get_admins(guild_id)]:
+            data = await request.get_json()
+            user_id = data['user_id']
+            if str(user_id) in permissions.get_admins(guild_id):
                 db.remove_admin(guild_id, user_id)
+                permissions.invalidate_guild(guild_id)
                 return jsonify({"message": "success"}), 200
             else:
                 return jsonify({"error": "Forbidden"}), 403
@@ -185,7 +450,7 @@ def create_app(bot, loop, scheduler):
 
     @app.route('/guilds/<guild_id>/admin_roles', methods=['GET'])
     @guild_auth
-    def get_admin_roles(guild_id: str):
+    async def get_admin_roles(guild_id: str):
         try:
             return jsonify(db.get_admin_roles(guild_id)), 200
         except Exception as e:
@@ -193,26 +458,30 @@ def create_app(bot, loop, scheduler):
 
     @app.route('/guilds/<guild_id>/admin_roles', methods=['POST'])
     @guild_auth
-    def add_admin_role(guild_id: str):
+    async def add_admin_role(guild_id: str):
         try:
-            role_id = request.json['role_id']
+            data = await request.get_json()
+            role_id = data['role_id']
             db.add_admin_role(guild_id, role_id)
+            permissions.invalidate_guild(guild_id)
             return jsonify({"message": "success"}), 200
         except Exception as e:
             return jsonify({"error": e}), 500
 
     @app.route('/guilds/<guild_id>/admin_roles', methods=['PATCH'])
     @guild_auth
-    def edit_admin_role(guild_id: str):
+    async def edit_admin_role(guild_id: str):
         return
 
     @app.route('/guilds/<guild_id>/admin_roles', methods=['DELETE'])
     @guild_auth
-    def remove_admin_role(guild_id: str):
+    async def remove_admin_role(guild_id: str):
         try:
-            role_id = request.json['role_id']
-            if role_id in [admin_roles["role_id"] for admin_roles in db.get_admin_roles(guild_id)]:
-                db.remove_admin(guild_id, role_id)
+            data = await request.get_json()
+            role_id = data['role_id']
+            if str(role_id) in permissions.get_admin_roles(guild_id):
+                db.remove_admin_role(guild_id, role_id)
+                permissions.invalidate_guild(guild_id)
                 return jsonify({"message": "success"}), 200
             else:
                 return jsonify({"error": "Forbidden"}), 403
@@ -221,34 +490,62 @@ def create_app(bot, loop, scheduler):
 
     @app.route('/guilds/<guild_id>/roles', methods=['GET'])
     @guild_auth
-    def get_roles(guild_id: str):
-        for guild in bot.guilds:
-            if str(guild.id) == guild_id:
-                # Evil function to map Seq to dict as following
-                # {
-                #     "name": "@everyone",
-                #     "id": 1147839218379399208,
-                #     "color": "(0, 0, 0)"
-                # }
-                return jsonify({"roles": [
-                    {"name": role.name, "id": role.id, "color": f"{role.color.r, role.color.g, role.color.b}"} for role
-                    in guild.roles]})
-        return jsonify({"error": "Guild not found"}), 404
+    async def get_roles(guild_id: str):
+        guild = guild_index.get(guild_id)
+        if guild is None:
+            return jsonify({"error": "Guild not found"}), 404
+        return cached_json(guild.roles, guild.roles_etag)
 
     @app.route('/guilds/<guild_id>/channels', methods=['GET'])
     @guild_auth
-    def get_channels(guild_id: str):
-        for guild in bot.guilds:
-            if str(guild.id) == guild_id:
-                return jsonify([{"name": channel.name, "id": channel.id} for channel in guild.text_channels])
-        return jsonify({"error": "Guild not found"}), 404
+    async def get_channels(guild_id: str):
+        guild = guild_index.get(guild_id)
+        if guild is None:
+            return jsonify({"error": "Guild not found"}), 404
+        return cached_json(guild.channels, guild.channels_etag)
 
     @app.route('/healthcheck', methods=['GET'])
-    def healthcheck():
+    async def healthcheck():
         return jsonify({"message": "success"}), 200
 
     @app.route('/test', methods=['GET'])
-    def test_announcement():
+    async def test_announcement():
         return jsonify({"message": [item.id for item in scheduler.get_jobs()]})
 
+    @app.route('/scheduler/diff', methods=['GET'])
+    @internal
+    async def scheduler_diff():
+        return jsonify(await diff_scheduler(scheduler))
+
+    @app.route('/announcements/upcoming', methods=['GET'])
+    @internal
+    async def upcoming_load():
+        # Occurrences across all guilds per ?bucket= seconds (a minute by default) between ?from= and ?to= (an hour
+        # from now by default), with the busiest buckets listed as peaks
+        try:
+            start, end = parse_range(request.args, 3600, MAX_UPCOMING_RANGE)
+            return jsonify(await get_upcoming_load(db, start, end, request.args.get("bucket", 60, type=int)))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route('/metrics', methods=['GET'])
+    @internal
+    async def metrics():
+        return Response(registry.render(), content_type="text/plain; version=0.0.4")
+
+    @app.route('/metrics.json', methods=['GET'])
+    @internal
+    async def metrics_json():
+        return Response(registry.as_json(), content_type="application/json")
+
+    @app.route('/admission', methods=['GET'])
+    @internal
+    async def admission_stats():
+        return jsonify(admission.stats())
+
+    @app.route('/delivery', methods=['GET'])
+    @internal
+    async def delivery_stats():
+        return jsonify({**delivery.stats(), "latencies": delivery.latencies})
+
     return app
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Optional
+from util.db import DBUtil
+from util.trigger_util import PERIODS, get_next_fire_at
+from shared.tasks import apply_announcement_change
+from shared.templates import TemplateError, compile_template
+
+MAX_BATCH_SIZE = 5000
+# Broadcast targets per announcement, on top of its own channel
+MAX_TARGETS = 500
+
+# Columns written by an export, which is also exactly what an import accepts per line
+EXPORT_FIELDS = ["name", "channel_id", "content", "timestamp", "period"]
+
+
+def parse_targets(value, guild_id: str) -> list[tuple[str, str]]:
+    # Broadcast targets as [{"channel_id": ..., "guild_id": ...}] to (guild_id, channel_id) pairs, a target's guild_id
+    # defaults to the announcement's own guild. A channel listed more than once is kept once.
+    if not isinstance(value, list):
+        raise ValueError("Invalid field 'targets'")
+    if len(value) > MAX_TARGETS:
+        raise ValueError(f"At most {MAX_TARGETS} targets per announcement")
+    targets: dict[str, str] = {}
+    for target in value:
+        if not isinstance(target, dict):
+            raise ValueError("Target must be an object")
+        channel_id, target_guild_id = str(target.get("channel_id", "")), str(target.get("guild_id", guild_id))
+        if not channel_id.isdigit() or not target_guild_id.isdigit():
+            raise ValueError("Invalid target")
+        targets.setdefault(channel_id, target_guild_id)
+    return [(target_guild_id, channel_id) for channel_id, target_guild_id in targets.items()]
+
+
+def _validate(item, guild_id: str, partial: bool = False) -> dict:
+    # Returns the announcement columns of a create (or, with `partial`, update) item, plus its broadcast targets when
+    # given, or raises ValueError. Both "message" and "content" are accepted for the text so exported lines can be
+    # imported again as they are.
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
+    data = {}
+    message = item.get("message", item.get("content"))
+    for field, value in (("channel_id", item.get("channel_id")), ("name", item.get("name")), ("content", message)):
+        if value is None:
+            if not partial:
+                raise ValueError(f"Missing field '{field}'")
+        elif not isinstance(value, (str, int)) or isinstance(value, bool) or value == "":
+            raise ValueError(f"Invalid field '{field}'")
+        else:
+            data[field] = str(value)
+    if "content" in data:
+        try:
+            compile_template(data["content"])
+        except TemplateError as e:
+            raise ValueError(f"Invalid field 'content': {e}") from None
+    timestamp = item.get("timestamp")
+    if timestamp is None:
+        if not partial:
+            raise ValueError("Missing field 'timestamp'")
+    elif not isinstance(timestamp, int) or isinstance(timestamp, bool):
+        raise ValueError("Invalid field 'timestamp'")
+    else:
+        data["timestamp"] = timestamp
+    period = item.get("period")
+    if period is None:
+        if not partial:
+            raise ValueError("Missing field 'period'")
+    elif period not in PERIODS:
+        raise ValueError(f"Unknown period '{period}'")
+    else:
+        data["period"] = period
+    if item.get("targets") is not None:
+        data["targets"] = parse_targets(item["targets"], guild_id)
+    elif not partial:
+        data["targets"] = []
+    return data
+
+
+def parse_ndjson(body: str) -> tuple[list, list[dict]]:
+    # Blank lines are skipped, a line that isn't JSON is reported as an error for its item instead of failing the file
+    items, errors = [], []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            errors.append({"op": "create", "index": len(items), "error": "Invalid JSON"})
+            items.append(None)
+    return items, errors
+
+
+async def apply_batch(db: DBUtil, delivery, scheduler, guild_id: str, user_id: str, create: list, update: list,
+                      delete: list, errors: Optional[list[dict]] = None,
+                      can_target: Optional[Callable[[str], Awaitable[bool]]] = None,
+                      channel_guild: Optional[Callable[[str], Awaitable[Optional[str]]]] = None) -> dict:
+    # Validates every item up front, writes everything that passed in one transaction and then registers the result
+    # with the scheduler in one pass. Items that failed validation are reported by op and index and don't stop the
+    # rest of the batch. Broadcast targets in other guilds need `can_target` to allow the guild, it's asked once per
+    # guild, and every target channel must be in the guild it names according to `channel_guild`.
+    errors = list(errors or [])
+    failed = {(error["op"], error["index"]) for error in errors}
+    created: list[tuple[int, dict]] = []
+    for index, item in enumerate(create):
+        if ("create", index) in failed:
+            continue
+        try:
+            created.append((index, _validate(item, guild_id)))
+        except ValueError as e:
+            errors.append({"op": "create", "index": index, "error": str(e)})
+
+    ids = []
+    for index, item in enumerate(update):
+        announcement_id = item.get("id") if isinstance(item, dict) else None
+        ids.append(announcement_id if isinstance(announcement_id, int) else None)
+    for index, announcement_id in enumerate(delete):
+        ids.append(announcement_id if isinstance(announcement_id, int) else None)
+    existing = {row["id"]: row for row in db.get_announcements_by_ids(guild_id, [i for i in ids if i is not None])}
+
+    now = time.time()
+    touched: set[int] = set()
+    updated: list[tuple[int, dict]] = []
+    for index, item in enumerate(update):
+        try:
+            announcement_id = ids[index]
+            if announcement_id is None:
+                raise ValueError("Missing field 'id'")
+            if announcement_id not in existing:
+                raise ValueError("Announcement not found")
+            if announcement_id in touched:
+                raise ValueError("Announcement appears more than once in the batch")
+            row = {**existing[announcement_id], **_validate(item, guild_id, partial=True), "user_id": user_id}
+        except ValueError as e:
+            errors.append({"op": "update", "index": index, "error": str(e)})
+            continue
+        touched.add(announcement_id)
+        # Like apply_announcement_batch, a row from before templates only becomes one once its content changes
+        previous = existing[announcement_id]
+        row["templated"] = previous["templated"] or row["content"] != previous["content"]
+        row["next_fire_at"] = get_next_fire_at(row["timestamp"], row["period"], now)
+        updated.append((index, row))
+    removed: list[tuple[int, int]] = []
+    for index, announcement_id in enumerate(ids[len(update):]):
+        if announcement_id is None or announcement_id not in existing:
+            errors.append({"op": "delete", "index": index, "error": "Announcement not found"})
+        elif announcement_id in touched:
+            errors.append({"op": "delete", "index": index, "error": "Announcement appears more than once in the batch"})
+        else:
+            touched.add(announcement_id)
+            removed.append((index, announcement_id))
+
+    target_guilds = {target_guild_id for _, data in created + updated
+                     for target_guild_id, _ in data.get("targets", ()) if target_guild_id != guild_id}
+    forbidden = {target_guild_id for target_guild_id in target_guilds
+                 if can_target is None or not await can_target(target_guild_id)}
+    target_channels = {target for _, data in created + updated for target in data.get("targets", ())
+                       if target[0] not in forbidden}
+    misplaced = {(target_guild_id, channel_id) for target_guild_id, channel_id in target_channels
+                 if channel_guild is None or await channel_guild(channel_id) != target_guild_id}
+    if forbidden or misplaced:
+        for op, items in (("create", created), ("update", updated)):
+            allowed = []
+            for index, data in items:
+                error = next((f"Forbidden target guild {target_guild_id}" if target_guild_id in forbidden else
+                              f"Channel {channel_id} is not in guild {target_guild_id}"
+                              for target_guild_id, channel_id in data.get("targets", ())
+                              if target_guild_id in forbidden or (target_guild_id, channel_id) in misplaced), None)
+                if error is None:
+                    allowed.append((index, data))
+                else:
+                    errors.append({"op": op, "index": index, "error": error})
+            items[:] = allowed
+
+    columns = ("user_id", "channel_id", "name", "content", "timestamp", "period")
+    created_rows = [(user_id, *(data[column] for column in columns[1:]),
+                     get_next_fire_at(data["timestamp"], data["period"], now)) for _, data in created]
+    created_ids = await asyncio.to_thread(
+        db.apply_announcement_batch, guild_id, created_rows,
+        [(*(row[column] for column in columns), row["next_fire_at"], row["id"]) for _, row in updated],
+        [announcement_id for _, announcement_id in removed],
+        [data["targets"] for _, data in created],
+        {row["id"]: row["targets"] for _, row in updated if "targets" in row})
+
+    # Updates that kept their targets get them in one query instead of one per row
+    kept = db.get_announcement_targets([row["id"] for _, row in updated if "targets" not in row])
+    for _, row in updated:
+        row.setdefault("targets", kept.get(row["id"], []))
+
+    for _, announcement_id in removed:
+        apply_announcement_change(delivery, scheduler, announcement_id, now=now)
+    for _, row in updated:
+        apply_announcement_change(delivery, scheduler, row["id"], row, now=now)
+    for announcement_id, (_, data) in zip(created_ids, created):
+        apply_announcement_change(delivery, scheduler, announcement_id, {**data, "guild_id": guild_id}, now=now)
+
+    return {
+        "created": [{"index": index, "id": announcement_id}
+                    for announcement_id, (index, _) in zip(created_ids, created)],
+        "updated": [{"index": index, "id": row["id"]} for index, row in updated],
+        "deleted": [{"index": index, "id": announcement_id} for index, announcement_id in removed],
+        "errors": sorted(errors, key=lambda error: (error["op"], error["index"])),
+    }
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Iterator, Optional
+from quart import Response
+from util.db import DBUtil
+
+MAX_PAGE_SIZE = 1000
+
+
+class ListingQuery:
+    # Query string of an announcement listing:
+    # fields=name,period    columns to return (id and the ordering column are always included), plus "targets" for
+    #                       the broadcast targets of each announcement
+    # order=id|next_fire_at keyset order, next_fire_at skips announcements that will never fire again
+    # cursor=...            next_cursor of the previous page
+    # limit=N               page size, returns {"items": [...], "next_cursor": ...} instead of a plain list
+    # channel_id, period    exact match filters
+    # upcoming=S            only announcements firing within the next S seconds
+    # format=ndjson         stream one announcement per line
+    def __init__(self, args):
+        fields = args.get("fields")
+        self.fields: Optional[list[str]] = fields.split(",") if fields else None
+        self.targets: bool = bool(self.fields and "targets" in self.fields)
+        if self.targets:
+            self.fields = [field for field in self.fields if field != "targets"] or None
+        self.order: str = args.get("order", "id")
+        self.after: Optional[tuple[int, ...]] = self._parse_cursor(args.get("cursor"))
+        limit = args.get("limit", type=int)
+        self.limit: Optional[int] = min(max(limit, 1), MAX_PAGE_SIZE) if limit is not None else None
+        self.channel_id: Optional[str] = args.get("channel_id")
+        self.period: Optional[str] = args.get("period")
+        upcoming = args.get("upcoming", type=int)
+        self.until: Optional[int] = int(time.time()) + upcoming if upcoming is not None else None
+        self.ndjson: bool = args.get("format") == "ndjson"
+
+    def _parse_cursor(self, cursor: Optional[str]) -> Optional[tuple[int, ...]]:
+        # "id" for order=id, "next_fire_at:id" for order=next_fire_at
+        if not cursor:
+            return None
+        try:
+            after = tuple(int(key) for key in cursor.split(":"))
+        except ValueError:
+            raise ValueError(f"Invalid cursor '{cursor}'") from None
+        if len(after) != (1 if self.order == "id" else 2):
+            raise ValueError(f"Cursor '{cursor}' doesn't match order '{self.order}'")
+        return after
+
+    def pages(self, db: DBUtil, guild_id: str, limit: Optional[int] = None) -> Iterator[list[dict]]:
+        pages = db.iter_announcements(guild_id, self.fields, self.order, self.after, limit, self.channel_id,
+                                      self.period, self.until)
+        return _with_targets(db, pages) if self.targets else pages
+
+    def cursor(self, row: dict) -> str:
+        return str(row["id"]) if self.order == "id" else f"{row['next_fire_at']}:{row['id']}"
+
+
+def _with_targets(db: DBUtil, pages: Iterator[list[dict]]) -> Iterator[list[dict]]:
+    # One targets query per page
+    for page in pages:
+        targets = db.get_announcement_targets([row["id"] for row in page])
+        for row in page:
+            row["targets"] = [{"guild_id": guild_id, "channel_id": channel_id}
+                              for guild_id, channel_id in targets.get(row["id"], [])]
+        yield page
+
+
+async def _stream(pages: Iterator[list[dict]], ndjson: bool) -> AsyncIterator[bytes]:
+    # One chunk per database page, handing the loop back in between so a big guild doesn't stall other requests
+    first = True
+    if not ndjson:
+        yield b"["
+    for page in pages:
+        if ndjson:
+            yield "".join(json.dumps(row) + "\n" for row in page).encode()
+        else:
+            yield (("" if first else ",") + ",".join(json.dumps(row) for row in page)).encode()
+        first = False
+        await asyncio.sleep(0)
+    if not ndjson:
+        yield b"]"
+
+
+def list_announcements(db: DBUtil, guild_id: str, query: ListingQuery) -> Response:
+    if query.ndjson:
+        # Validate before the response starts, afterwards errors can't change the status code anymore
+        pages = query.pages(db, guild_id, query.limit)
+        first = next(pages, [])
+        return Response(_stream(_chain(first, pages), True), content_type="application/x-ndjson")
+    if query.limit is None:
+        pages = query.pages(db, guild_id)
+        first = next(pages, [])
+        return Response(_stream(_chain(first, pages), False), content_type="application/json")
+    items = [row for page in query.pages(db, guild_id, query.limit + 1) for row in page]
+    next_cursor = query.cursor(items[query.limit - 1]) if len(items) > query.limit else None
+    return Response(json.dumps({"items": items[:query.limit], "next_cursor": next_cursor}),
+                    content_type="application/json")
+
+
+def _chain(first: list[dict], pages: Iterator[list[dict]]) -> Iterator[list[dict]]:
+    if first:
+        yield first
+    yield from pages
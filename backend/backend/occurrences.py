@@ -0,0 +1,119 @@
+import asyncio
+import bisect
+import heapq
+import time
+from util.db import DBUtil
+from util.trigger_util import expand_schedule, schedule_key
+
+MAX_CALENDAR_RANGE = 31 * 86400
+MAX_CALENDAR_OCCURRENCES = 10000
+MAX_UPCOMING_RANGE = 7 * 86400
+MAX_UPCOMING_BUCKETS = 10080
+
+
+def parse_range(args, default_span: int, max_span: int) -> tuple[int, int]:
+    # from and to are unix timestamps, from defaults to now and to to `default_span` seconds after from
+    start = args.get("from", type=int)
+    start = int(time.time()) if start is None else start
+    end = args.get("to", type=int)
+    end = start + default_span if end is None else end
+    if end <= start:
+        raise ValueError("'to' must be after 'from'")
+    if end - start > max_span:
+        raise ValueError(f"At most {max_span} seconds between 'from' and 'to'")
+    return start, end
+
+
+class Schedules:
+    # Occurrences in [start, end) per schedule_key, computed once for every announcement that shares the key
+    def __init__(self, start: int, end: int):
+        self.start: int = start
+        self.end: int = end
+        self._occurrences: dict[tuple, list[int]] = {}
+
+    def get(self, row: dict) -> tuple[tuple, list[int], int]:
+        # Returns the row's schedule key, the schedule's occurrences and the index of the row's first occurrence in
+        # them. next_fire_at is the first occurrence that hasn't been sent yet, anything before it is left out.
+        key = schedule_key(row["timestamp"], row["period"])
+        occurrences = self._occurrences.get(key)
+        if occurrences is None:
+            occurrences = self._occurrences[key] = expand_schedule(row["timestamp"], row["period"], self.start,
+                                                                   self.end)
+        return key, occurrences, bisect.bisect_left(occurrences, row["next_fire_at"])
+
+    def items(self):
+        return self._occurrences.items()
+
+
+def _row_occurrences(row: dict, schedules: Schedules) -> list[int]:
+    if row["period"] == "ONCE":
+        return [row["next_fire_at"]] if schedules.start <= row["next_fire_at"] < schedules.end else []
+    _, occurrences, first = schedules.get(row)
+    return occurrences[first:]
+
+
+async def get_calendar(db: DBUtil, guild_id: str, start: int, end: int,
+                       limit: int = MAX_CALENDAR_OCCURRENCES) -> dict:
+    # The guild's first `limit` occurrences in [start, end), ordered by time. Rows come in next_fire_at order and no
+    # row fires before its next_fire_at, so reading stops as soon as the rest can't beat what is already kept.
+    schedules = Schedules(start, end)
+    # Max-heap of the earliest occurrences seen so far, as (-at, -id, row)
+    kept: list[tuple[int, int, dict]] = []
+    truncated = stopped = False
+    for page in db.iter_upcoming_announcements(end, guild_id):
+        for row in page:
+            if len(kept) >= limit and max(start, row["next_fire_at"]) > -kept[0][0]:
+                stopped = truncated = True
+                break
+            for at in _row_occurrences(row, schedules):
+                entry = (-at, -row["id"], row)
+                if len(kept) < limit:
+                    heapq.heappush(kept, entry)
+                    continue
+                truncated = True
+                if entry < kept[0]:
+                    # Later than everything kept, and so are the row's remaining occurrences
+                    break
+                heapq.heapreplace(kept, entry)
+        if stopped:
+            break
+        await asyncio.sleep(0)
+    occurrences = [{"at": -at, "id": row["id"], "name": row["name"], "channel_id": row["channel_id"],
+                    "period": row["period"]} for at, _, row in sorted(kept, reverse=True)]
+    return {"from": start, "to": end, "occurrences": occurrences, "truncated": truncated}
+
+
+async def get_upcoming_load(db: DBUtil, start: int, end: int, bucket: int, top: int = 10) -> dict:
+    # Occurrences across every guild per `bucket` seconds of [start, end). Each row only records where it enters
+    # its schedule, the schedule's occurrences are then counted once with the number of rows that have entered it
+    # by then, so the work grows with the rows plus the distinct schedules instead of rows times occurrences.
+    buckets = -(-(end - start) // bucket) if bucket > 0 else 0
+    if not 0 < buckets <= MAX_UPCOMING_BUCKETS:
+        raise ValueError(f"'bucket' must be positive and give at most {MAX_UPCOMING_BUCKETS} buckets")
+    counts = [0] * buckets
+    schedules = Schedules(start, end)
+    entries: dict[tuple, list[int]] = {}
+    for page in db.iter_upcoming_announcements(end):
+        for row in page:
+            if row["period"] == "ONCE":
+                if start <= row["next_fire_at"] < end:
+                    counts[(row["next_fire_at"] - start) // bucket] += 1
+                continue
+            key, occurrences, first = schedules.get(row)
+            if first < len(occurrences):
+                entered = entries.get(key)
+                if entered is None:
+                    entered = entries[key] = [0] * len(occurrences)
+                entered[first] += 1
+        await asyncio.sleep(0)
+    for key, occurrences in schedules.items():
+        entered = entries.get(key)
+        if entered is None:
+            continue
+        rows = 0
+        for at, count in zip(occurrences, entered):
+            rows += count
+            counts[(at - start) // bucket] += rows
+    peaks = heapq.nlargest(top, range(len(counts)), key=counts.__getitem__)
+    return {"from": start, "to": end, "bucket": bucket, "total": sum(counts), "counts": counts,
+            "peaks": [{"at": start + index * bucket, "count": counts[index]} for index in peaks if counts[index]]}
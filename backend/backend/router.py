@@ -0,0 +1,112 @@
+import re
+import time
+from typing import Optional
+import aiohttp
+from quart import Quart, Response, jsonify, request
+from quart.wrappers.response import ResponseBody
+from quart_cors import cors
+from util.config import WORKER_COUNT
+from util.db import DBUtil
+from shared.sharding import worker_for_guild
+
+# Request headers passed on to a worker, and response headers passed back
+FORWARDED_REQUEST_HEADERS = ("Authorization", "Content-Type", "If-None-Match")
+FORWARDED_RESPONSE_HEADERS = ("Content-Type", "ETag", "Retry-After")
+
+
+class UpstreamBody(ResponseBody):
+    # A worker's response streamed through as it arrives, so large listings and exports aren't buffered here. Quart
+    # enters the body whenever it sends one, and leaving it gives the connection back to the pool, whether the body was
+    # read to the end, partly, or not at all.
+    def __init__(self, upstream: aiohttp.ClientResponse):
+        self.upstream: aiohttp.ClientResponse = upstream
+
+    async def __aenter__(self):
+        return self.upstream.content.iter_any()
+
+    async def __aexit__(self, exc_type, exc_value, tb) -> None:
+        self.upstream.release()
+
+
+class WorkerDirectory:
+    # Worker index -> unix socket of the process holding its lease, read from the lease table at most once a second,
+    # with one keep-alive connection pool per socket
+    def __init__(self, db: DBUtil, refresh_interval: float = 1):
+        self.db: DBUtil = db
+        self.refresh_interval: float = refresh_interval
+        self._addresses: dict[int, str] = {}
+        self._refreshed_at: float = 0
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+
+    def address(self, worker_index: int) -> Optional[str]:
+        if time.monotonic() - self._refreshed_at > self.refresh_interval:
+            self._addresses = {lease["worker_id"]: lease["address"] for lease in self.db.get_worker_leases()}
+            self._refreshed_at = time.monotonic()
+        return self._addresses.get(worker_index)
+
+    def session(self, address: str) -> aiohttp.ClientSession:
+        session = self._sessions.get(address)
+        if session is None or session.closed:
+            session = self._sessions[address] = aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=address, limit=100), auto_decompress=False)
+        return session
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+def create_router_app():
+    # Public API in sharded mode. Guild routes go to the worker whose shards hold the guild, everything else goes to
+    # the worker picked with ?worker=N, or worker 0
+    app = Quart(__name__)
+    app = cors(app, allow_origin=re.compile(r".*"), allow_credentials=True)
+    workers = WorkerDirectory(DBUtil())
+
+    async def forward(worker_index: int):
+        address = workers.address(worker_index)
+        if address is None:
+            response = jsonify({"error": f"Worker {worker_index} is not available"})
+            return response, 503, {"Retry-After": "1"}
+        path = request.path + (f"?{request.query_string.decode()}" if request.query_string else "")
+        headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+        try:
+            upstream = await workers.session(address).request(request.method, f"http://worker{path}",
+                                                              data=await request.get_data(), headers=headers)
+        except aiohttp.ClientError as e:
+            print(f"Error forwarding to worker {worker_index}: {e}")
+            return jsonify({"error": f"Worker {worker_index} is not available"}), 503, {"Retry-After": "1"}
+
+        return Response(UpstreamBody(upstream), status=upstream.status,
+                        headers={name: upstream.headers[name] for name in FORWARDED_RESPONSE_HEADERS
+                                 if name in upstream.headers})
+
+    @app.route('/guilds/<guild_id>', methods=['GET', 'POST', 'PATCH', 'DELETE'])
+    @app.route('/guilds/<guild_id>/<path:rest>', methods=['GET', 'POST', 'PATCH', 'DELETE'])
+    async def guild_route(guild_id: str, rest: str = ""):
+        if not guild_id.isdigit():
+            return jsonify({"error": "Bad Request"}), 400
+        return await forward(worker_for_guild(guild_id))
+
+    @app.route('/healthcheck', methods=['GET'])
+    async def healthcheck():
+        return jsonify({"message": "success"}), 200
+
+    @app.route('/workers', methods=['GET'])
+    async def get_workers():
+        leases = DBUtil().get_worker_leases()
+        return jsonify({"worker_count": WORKER_COUNT, "workers": leases})
+
+    @app.route('/<path:path>', methods=['GET', 'POST', 'PATCH', 'DELETE'])
+    async def other_route(path: str):
+        worker_index = request.args.get("worker", 0, type=int)
+        if not 0 <= worker_index < WORKER_COUNT:
+            return jsonify({"error": "Unknown worker"}), 400
+        return await forward(worker_index)
+
+    @app.after_serving
+    async def close_sessions():
+        await workers.close()
+
+    return app
@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import secrets
+import socket
+import tempfile
+import time
+
+# End to end benchmark: seeds a database, starts a Discord stub in a second process and runs the backend against it
+# the way main.py does, with the API under concurrent load while a window of announcements fires. Results are printed
+# as JSON (and written to --output) so runs can be compared between commits. Run from the backend directory:
+#
+#     python -m bench.run --announcements 100000 --fires 2000 --window 120 --output results.json
+#
+# Backend settings such as DELIVERY_RATE_LIMIT or GATEWAY_PROFILE are read from the environment as usual.
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+    return {"count": len(values), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(values[-1], 4)}
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the announcement backend against a stub Discord")
+    parser.add_argument("--announcements", type=int, default=10000, help="announcements that don't fire in the run")
+    parser.add_argument("--fires", type=int, default=1000, help="announcements firing once inside the window")
+    parser.add_argument("--window", type=int, default=120, help="seconds over which the fires are spread")
+    parser.add_argument("--lead", type=int, default=30, help="seconds between seeding and the first fire")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--channels", type=int, default=5, help="text channels per guild")
+    parser.add_argument("--users", type=int, default=20, help="distinct API users, each administers some guilds")
+    parser.add_argument("--api-concurrency", type=int, default=20)
+    parser.add_argument("--api-duration", type=int, default=30, help="seconds of API load during the window")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="stub delay per message send")
+    parser.add_argument("--drain-timeout", type=int, default=300, help="seconds to wait for the sends after the window")
+    parser.add_argument("--db", help="database file, a temporary one is used by default")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+async def api_load(base_url: str, guilds: int, users: int, concurrency: int, duration: float,
+                   rng: random.Random) -> dict:
+    import aiohttp
+    from bench.stub_discord import guild_id
+
+    paths = ("/guilds/{}", "/guilds/{}/announcements?limit=100", "/guilds/{}/channels", "/guilds/{}/roles")
+    latencies: dict[str, list[float]] = {path: [] for path in paths}
+    statuses: dict[int, int] = {}
+    deadline = time.monotonic() + duration
+
+    async def worker(session):
+        while time.monotonic() < deadline:
+            user = rng.randrange(users)
+            owned = range(user, guilds, users)
+            if not owned:
+                continue
+            path = rng.choice(paths)
+            started = time.perf_counter()
+            async with session.get(base_url + path.format(guild_id(rng.choice(owned))),
+                                   headers={"Authorization": f"user-{user}"}) as response:
+                await response.read()
+            latencies[path].append(time.perf_counter() - started)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    total = [latency for values in latencies.values() for latency in values]
+    return {"requests": len(total), "requests_per_second": round(len(total) / duration, 1),
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            "latency": _percentiles(total),
+            "endpoints": {path: _percentiles(values) for path, values in latencies.items()}}
+
+
+async def run(args: argparse.Namespace, stub_url: str, api_port: int) -> dict:
+    # Imported here, util.config reads DB_NAME and DISCORD_API_BASE from the environment set up in main()
+    import aiohttp
+    import discord
+    import yarl
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    from backend.api import create_app
+    from bot.bot import get_bot_instance
+    from shared.delivery import DeliveryPipeline
+    from shared.outbox import outbox
+    from shared.recovery import recover_missed_announcements
+    from shared.scheduler import AnnouncementScheduler
+    from shared.tasks import load_announcements
+    from util.config import GATEWAY_PROFILE
+    from util.db import DBUtil
+    from util.http import discord_http
+    from util.permissions import permissions
+
+    discord.http.Route.BASE = f"{stub_url}/api/v10"
+    discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(f"{stub_url.replace('http', 'ws')}/gateway")
+
+    startup: dict[str, float] = {}
+    started = time.perf_counter()
+
+    def phase(name):
+        startup[name] = round(time.perf_counter() - started, 4)
+
+    DBUtil().db_setup()
+    phase("db_setup")
+    scheduler = AnnouncementScheduler()
+    bot = get_bot_instance()
+    permissions.bot = bot
+    delivery = DeliveryPipeline(bot)
+    scheduler.start()
+    delivery.start()
+    outbox.start()
+    started_at = time.time()
+    await recover_missed_announcements(delivery, started_at)
+    phase("recovery")
+    await discord_http.start()
+    app = create_app(bot, scheduler, delivery)
+    config = Config()
+    config.bind = [f"127.0.0.1:{api_port}"]
+    config.accesslog = None
+    # Passing a shutdown trigger stops hypercorn from taking over SIGINT/SIGTERM
+    shutdown = asyncio.Event()
+    bot_task = asyncio.create_task(bot.start("bench"))
+    tasks = [asyncio.create_task(load_announcements(delivery, scheduler, started_at)),
+             asyncio.create_task(serve(app, config, shutdown_trigger=shutdown.wait)), bot_task]
+    while not scheduler.horizon:
+        await asyncio.sleep(0.001)
+    phase("first_load")
+    await asyncio.wait([asyncio.create_task(bot.wait_until_ready()), bot_task], return_when=asyncio.FIRST_COMPLETED)
+    if bot_task.done():
+        # The bot failed to log in or connect, surface why
+        bot_task.result()
+    phase("bot_ready")
+    api_url = f"http://127.0.0.1:{api_port}"
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{api_url}/healthcheck") as response:
+                    if response.status == 200:
+                        break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.01)
+    phase("api_ready")
+    rss_after_startup = _rss_mb()
+    jobs_after_startup = len(scheduler.jobs)
+
+    api = await api_load(api_url, args.guilds, args.users, args.api_concurrency, args.api_duration,
+                         random.Random(args.seed))
+
+    # Wait until the stub received every fire or the drain timeout ran out
+    deadline = args.fire_end + args.drain_timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            async with session.get(f"{stub_url}/_bench/sends") as response:
+                sends = await response.json()
+            if len(sends) >= args.fires or time.time() > deadline:
+                break
+            await asyncio.sleep(1)
+        # The backend's own view of where the lag came from, see util/metrics
+        async with session.get(f"{api_url}/metrics.json",
+                               headers={"Authorization": f"Bearer {os.environ['INTERNAL_API_TOKEN']}"}) as response:
+            metrics = await response.json(content_type=None)
+
+    lags = [received - int(content[6:]) for received, _, content in sends if content.startswith("bench:")]
+    per_second: dict[int, int] = {}
+    for received, _, _ in sends:
+        per_second[int(received)] = per_second.get(int(received), 0) + 1
+    results = {
+        "startup_seconds": startup,
+        "scheduler": {"jobs_after_startup": jobs_after_startup, "horizon": scheduler.horizon},
+        "fire_lag_seconds": _percentiles(lags),
+        "sends": {"total": len(sends), "expected": args.fires, "peak_per_second": max(per_second.values(), default=0),
+                  "failed": delivery.failed},
+        "rss_mb": {"gateway_profile": GATEWAY_PROFILE, "after_startup": round(rss_after_startup, 1),
+                   "end": round(_rss_mb(), 1),
+                   "peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                   "kb_per_guild": round(_rss_mb() * 1024 / max(1, len(bot.guilds)), 1)},
+        "api": api,
+        "metrics": {name: metrics[name]["values"] for name in (
+            "scheduler_fire_lag_seconds", "delivery_queue_lag_seconds", "delivery_send_seconds",
+            "delivery_fire_lag_seconds", "db_query_seconds", "api_request_seconds") if name in metrics},
+    }
+
+    shutdown.set()
+    await bot.close()
+    for task in tasks:
+        task.cancel()
+    await outbox.stop()
+    await discord_http.close()
+    return results
+
+
+def main(argv=None) -> dict:
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    db_name = args.db or os.path.join(tempfile.mkdtemp(prefix="announcer-bench-"), "bench.db")
+    stub_port, api_port = _free_port(), _free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    os.environ["DB_NAME"] = db_name
+    os.environ["DISCORD_API_BASE"] = f"{stub_url}/api/v10"
+    # For reading the backend's /metrics.json
+    os.environ.setdefault("INTERNAL_API_TOKEN", secrets.token_hex(16))
+
+    from bench.seed import seed, seed_fires
+    from bench.stub_discord import serve
+
+    seed_seconds = seed(db_name, args.guilds, args.channels, args.users, args.announcements, rng)
+    args.fire_start = time.time() + args.lead
+    args.fire_end = args.fire_start + args.window
+    seed_fires(db_name, args.guilds, args.channels, args.users, args.fires, args.fire_start, args.window, rng)
+
+    stub = multiprocessing.Process(target=serve, args=(stub_port, args.guilds, args.channels, args.users,
+                                                       args.send_latency), daemon=True)
+    stub.start()
+    try:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", stub_port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        results = asyncio.run(run(args, stub_url, api_port))
+    finally:
+        stub.terminate()
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("fire_start", "fire_end")},
+        "seed_seconds": round(seed_seconds, 3),
+        **results,
+    }
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import random
+import time
+from util.db import DBUtil
+from util.trigger_util import PERIODS, get_next_fire_at, get_next_fire_time
+from bench.stub_discord import channel_id, guild_id, user_id
+
+# Periods of a fixed length in seconds, a start moved back by whole periods keeps the same next occurrence
+REWIND_SPANS = {"HOURLY": 3600, "DAILY": 86400, "WEEKLY": 7 * 86400}
+
+
+def seed(db_name: str, guilds: int, channels: int, users: int, announcements: int, rng: random.Random) -> float:
+    # Creates the schema through DBUtil.db_setup and fills it with guilds, admins and announcements spread over every
+    # period. They all start at least two days out, so they sit in the table without firing during the run the way
+    # most of a real table does. Returns the seconds it took.
+    started = time.perf_counter()
+    db = DBUtil(db_name)
+    db.db_setup()
+    now = time.time()
+    rows = []
+    for n in range(announcements):
+        g = rng.randrange(guilds)
+        period = PERIODS[n % len(PERIODS)]
+        timestamp = int(now + 2 * 86400 + rng.randrange(30 * 86400))
+        rows.append((str(guild_id(g)), str(user_id(g % users)), str(channel_id(g, rng.randrange(channels))),
+                     f"announcement {n}", f"content {n}", timestamp, period,
+                     get_next_fire_at(timestamp, period, now)))
+    with db.db.conn:
+        db.db.conn.executemany("INSERT INTO guilds (guild_id) VALUES (?)", [(str(guild_id(g)),) for g in range(guilds)])
+        db.db.conn.executemany("INSERT INTO admins (guild_id, user_id) VALUES (?, ?)",
+                               [(str(guild_id(g)), str(user_id(g % users))) for g in range(guilds)])
+        db.db.conn.executemany(
+            "INSERT INTO announcements (guild_id, user_id, channel_id, name, content, timestamp, period, next_fire_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return time.perf_counter() - started
+
+
+def seed_fires(db_name: str, guilds: int, channels: int, users: int, fires: int, start: float, window: float,
+               rng: random.Random) -> None:
+    # Announcements firing on the minute boundaries between `start` and `start + window`, spread over every period
+    # that fires at most once inside the window, so each of them is exactly one expected send. Recurring ones started
+    # a few periods earlier where the period allows it. Their content carries the planned fire time, so the stub's
+    # receive times give the exact fire lag of every send.
+    db = DBUtil(db_name)
+    periods = [period for period in PERIODS if period != "MINUTELY" and (period != "HOURLY" or window < 3000)]
+    rows = []
+    for n in range(fires):
+        g = rng.randrange(guilds)
+        period = periods[n % len(periods)]
+        # Occurrences fall on the minute of the timestamp, so pick a minute boundary inside the window first
+        planned = int(get_next_fire_time(start + 60 * rng.randrange(max(1, int(window // 60))), "ONCE", start))
+        planned = planned if planned >= start else planned + 60
+        if period == "ONCE":
+            timestamp = planned + rng.randrange(60)
+        else:
+            timestamp = planned - rng.randrange(4) * REWIND_SPANS.get(period, 0)
+            if get_next_fire_at(timestamp, period, start) != planned:
+                # A DST change in between moved the wall clock time
+                timestamp = planned
+        rows.append((str(guild_id(g)), str(user_id(g % users)), str(channel_id(g, rng.randrange(channels))),
+                     f"fire {n}", f"bench:{planned}", timestamp, period, planned))
+    with db.db.conn:
+        db.db.conn.executemany(
+            "INSERT INTO announcements (guild_id, user_id, channel_id, name, content, timestamp, period, next_fire_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
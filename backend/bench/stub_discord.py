@@ -0,0 +1,174 @@
+import asyncio
+import itertools
+import json
+import time
+from datetime import datetime, timezone
+from aiohttp import WSMsgType, web
+
+# Stand-in for Discord's REST API and gateway, just enough for the bot to log in, receive its guilds, send messages
+# and for the API to resolve user tokens. Runs in its own process so it doesn't compete with the backend for the
+# event loop. Tokens "user-<n>" belong to user n, who administers every guild g with g % users == n.
+
+BOT_ID = 900000000000000000
+GUILD_BASE = 100000000000000000
+CHANNEL_BASE = 200000000000000000
+USER_BASE = 300000000000000000
+
+
+def guild_id(g: int) -> int:
+    # Consecutive guilds land on consecutive shards, like snowflakes created at different times
+    return GUILD_BASE + (g << 22)
+
+
+def channel_id(g: int, c: int) -> int:
+    return CHANNEL_BASE + g * 1000 + c
+
+
+def user_id(n: int) -> int:
+    return USER_BASE + n
+
+
+def _user(id_: int, name: str, bot: bool = False) -> dict:
+    return {"id": str(id_), "username": name, "discriminator": "0", "global_name": None, "avatar": None, "bot": bot}
+
+
+def _guild(g: int, channels: int) -> dict:
+    gid = guild_id(g)
+    return {
+        "id": str(gid), "name": f"guild {g}", "icon": None, "owner_id": str(user_id(0)), "unavailable": False,
+        "large": False, "member_count": 1, "features": [], "emojis": [], "stickers": [], "threads": [],
+        "voice_states": [], "presences": [], "stage_instances": [], "guild_scheduled_events": [],
+        "verification_level": 0, "default_message_notifications": 0, "explicit_content_filter": 0, "mfa_level": 0,
+        "premium_tier": 0, "nsfw_level": 0, "preferred_locale": "en-US", "system_channel_flags": 0,
+        "joined_at": datetime.now(timezone.utc).isoformat(),
+        "roles": [{"id": str(gid), "name": "@everyone", "color": 0, "hoist": False, "position": 0,
+                   "permissions": "2048", "managed": False, "mentionable": False, "flags": 0}],
+        "channels": [{"id": str(channel_id(g, c)), "type": 0, "name": f"channel-{c}", "position": c,
+                      "guild_id": str(gid), "permission_overwrites": [], "nsfw": False, "topic": None,
+                      "last_message_id": None, "rate_limit_per_user": 0, "parent_id": None}
+                     for c in range(channels)],
+        "members": [{"user": _user(BOT_ID, "announcer", bot=True), "roles": [], "joined_at": None, "deaf": False,
+                     "mute": False, "flags": 0}],
+    }
+
+
+def _json(data, status: int = 200) -> web.Response:
+    # discord.py only decodes bodies whose content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json"})
+
+
+class DiscordStub:
+    def __init__(self, guilds: int, channels: int, users: int, send_latency: float = 0):
+        self.guilds: int = guilds
+        self.channels: int = channels
+        self.users: int = users
+        self.send_latency: float = send_latency
+        # (receive time, channel id, content) of every message the bot sent
+        self.sends: list[tuple[float, str, str]] = []
+        self._ids = itertools.count(BOT_ID + 1)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get("/api/v10/users/@me", self.get_user),
+            web.get("/api/v10/users/@me/guilds", self.get_user_guilds),
+            web.post("/api/v10/channels/{channel_id}/messages", self.send_message),
+            web.get("/api/v10/guilds/{guild_id}/members/{user_id}", self.get_member),
+            web.get("/api/v10/oauth2/applications/@me", self.get_application),
+            web.get("/api/v10/gateway", self.get_gateway),
+            web.get("/api/v10/gateway/bot", self.get_gateway),
+            web.get("/gateway", self.gateway),
+            web.get("/_bench/sends", self.get_sends),
+        ])
+        return app
+
+    def _caller(self, request: web.Request):
+        # Returns "bot", a user number or None for an unknown token
+        token = request.headers.get("Authorization", "")
+        if token.startswith("Bot "):
+            return "bot"
+        if token.startswith("user-") and token[5:].isdigit() and int(token[5:]) < self.users:
+            return int(token[5:])
+        return None
+
+    async def get_user(self, request: web.Request) -> web.Response:
+        caller = self._caller(request)
+        if caller is None:
+            return _json({"message": "401: Unauthorized", "code": 0}, status=401)
+        if caller == "bot":
+            return _json(_user(BOT_ID, "announcer", bot=True))
+        return _json(_user(user_id(caller), f"user {caller}"))
+
+    async def get_user_guilds(self, request: web.Request) -> web.Response:
+        caller = self._caller(request)
+        if caller is None or caller == "bot":
+            return _json({"message": "401: Unauthorized", "code": 0}, status=401)
+        return _json([{"id": str(guild_id(g)), "name": f"guild {g}", "icon": None, "owner": False, "permissions": "8"}
+                      for g in range(caller, self.guilds, self.users)])
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.sends.append((time.time(), request.match_info["channel_id"], data.get("content", "")))
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        return _json({
+            "id": str(next(self._ids)), "channel_id": request.match_info["channel_id"], "type": 0,
+            "author": _user(BOT_ID, "announcer", bot=True), "content": data.get("content", ""),
+            "timestamp": datetime.now(timezone.utc).isoformat(), "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": [],
+            "pinned": False, "flags": 0,
+        })
+
+    async def get_member(self, request: web.Request) -> web.Response:
+        # Only reached in the low_memory gateway profile, where role membership is fetched instead of cached
+        member_id = int(request.match_info["user_id"])
+        user = _user(BOT_ID, "announcer", bot=True) if member_id == BOT_ID else _user(member_id, "member")
+        return _json({"user": user, "roles": [], "joined_at": None, "deaf": False, "mute": False, "flags": 0})
+
+    async def get_gateway(self, request: web.Request) -> web.Response:
+        return _json({"url": f"ws://{request.host}/gateway", "shards": 1,
+                      "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0,
+                                              "max_concurrency": 1}})
+
+    async def get_application(self, request: web.Request) -> web.Response:
+        return _json({"id": str(BOT_ID), "name": "announcer", "icon": None, "description": "", "summary": "",
+                      "bot_public": True, "bot_require_code_grant": False, "verify_key": "", "flags": 0, "team": None,
+                      "owner": _user(user_id(0), "user 0")})
+
+    async def get_sends(self, request: web.Request) -> web.Response:
+        return _json(self.sends)
+
+    async def gateway(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        sequence = itertools.count(1)
+
+        async def dispatch(event: str, data: dict) -> None:
+            await ws.send_str(json.dumps({"op": 0, "t": event, "s": next(sequence), "d": data}))
+
+        await ws.send_str(json.dumps({"op": 10, "d": {"heartbeat_interval": 41250}}))
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                break
+            payload = json.loads(message.data)
+            if payload["op"] == 1:
+                await ws.send_str(json.dumps({"op": 11}))
+            elif payload["op"] == 2:
+                # Sharded clients only get the guilds on their shard
+                shard_id, shard_count = payload["d"].get("shard") or (0, 1)
+                guilds = [g for g in range(self.guilds) if (guild_id(g) >> 22) % shard_count == shard_id]
+                await dispatch("READY", {
+                    "v": 10, "user": _user(BOT_ID, "announcer", bot=True), "session_id": "bench",
+                    "resume_gateway_url": f"ws://{request.host}/gateway", "shard": [shard_id, shard_count],
+                    "application": {"id": str(BOT_ID), "flags": 0},
+                    "guilds": [{"id": str(guild_id(g)), "unavailable": True} for g in guilds]})
+                for g in guilds:
+                    await dispatch("GUILD_CREATE", _guild(g, self.channels))
+            elif payload["op"] == 6:
+                await ws.send_str(json.dumps({"op": 9, "d": False}))
+        return ws
+
+
+def serve(port: int, guilds: int, channels: int, users: int, send_latency: float = 0) -> None:
+    web.run_app(DiscordStub(guilds, channels, users, send_latency).app(), host="127.0.0.1", port=port,
+                print=None, access_log=None)
@@ -1,29 +1,124 @@
 import discord
 from discord.ext import commands
+from util.config import GATEWAY_PROFILE, SHARD_COUNT
 from util.db import DBUtil
+from util.metrics import resident_memory_bytes
+from util.permissions import permissions
+from bot.guild_index import guild_index
+from shared.sharding import worker_shard_ids
 
 db = DBUtil()
 
-intents = discord.Intents.all()
+if GATEWAY_PROFILE == "low_memory":
+    # Guild, channel and role events only. Nothing here reads messages or presences, and members are fetched on demand
+    # by util/permissions, so none of them are cached
+    intents = discord.Intents.none()
+    intents.guilds = True
+    options = {"intents": intents, "max_messages": None, "member_cache_flags": discord.MemberCacheFlags.none(),
+               "chunk_guilds_at_startup": False}
+elif GATEWAY_PROFILE == "full":
+    options = {"intents": discord.Intents.all()}
+else:
+    raise ValueError(f"Unknown GATEWAY_PROFILE {GATEWAY_PROFILE!r}, expected 'full' or 'low_memory'")
 
-bot = discord.Client(intents=intents)
+if SHARD_COUNT > 1:
+    # Only this worker's shards in sharded mode, see shared/sharding.py
+    bot = discord.AutoShardedClient(shard_count=SHARD_COUNT, shard_ids=worker_shard_ids(), **options)
+else:
+    bot = discord.Client(**options)
 
 
 @bot.event
 async def on_ready():
-    print(f"Bot is ready as {bot.user}")
+    guild_index.rebuild(bot.guilds)
+    rss = resident_memory_bytes()
+    print(f"Bot is ready as {bot.user} with the {GATEWAY_PROFILE} gateway profile, {len(bot.guilds)} guilds, "
+          f"{rss / 2 ** 20:.1f} MB resident ({rss / 1024 / max(1, len(bot.guilds)):.1f} KB per guild)")
 
 
 @bot.event
 async def on_guild_join(guild):
+    guild_index.add_guild(guild)
     db.add_guild(guild.id)
     db.add_admin(guild.id, guild.owner_id)
+    permissions.invalidate_guild(guild.id)
 
 
 @bot.event
 async def on_guild_remove(guild):
     print(guild.name)
+    guild_index.remove_guild(guild.id)
     db.remove_guild(guild.id)
+    permissions.invalidate_guild(guild.id)
+
+
+@bot.event
+async def on_guild_available(guild):
+    # Sent instead of guild_join for a guild that comes back after on_ready, after an outage or a lazily loaded shard
+    guild_index.add_guild(guild)
+    permissions.invalidate_guild(guild.id)
+
+
+@bot.event
+async def on_guild_unavailable(guild):
+    # The bot is still in the guild, only the index forgets it until it's available again
+    guild_index.remove_guild(guild.id)
+    permissions.invalidate_guild(guild.id)
+
+
+@bot.event
+async def on_guild_update(before, after):
+    guild_index.update_guild(after)
+
+
+@bot.event
+async def on_guild_channel_create(channel):
+    guild_index.update_channels(channel.guild)
+
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    guild_index.update_channels(channel.guild)
+
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    guild_index.update_channels(after.guild)
+
+
+@bot.event
+async def on_guild_role_create(role):
+    guild_index.update_roles(role.guild)
+    permissions.invalidate_denials(role.guild.id)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    guild_index.update_roles(role.guild)
+    permissions.invalidate_guild(role.guild.id)
+
+
+@bot.event
+async def on_guild_role_update(before, after):
+    guild_index.update_roles(after.guild)
+    permissions.invalidate_denials(after.guild.id)
+
+
+@bot.event
+async def on_member_join(member):
+    # A user that wasn't in the guild was memoised as not allowed
+    permissions.invalidate_member(member.guild.id, member.id)
+
+
+@bot.event
+async def on_member_update(before, after):
+    if before.roles != after.roles:
+        permissions.invalidate_member(after.guild.id, after.id)
+
+
+@bot.event
+async def on_member_remove(member):
+    permissions.invalidate_member(member.guild.id, member.id)
 
 
 def get_bot_instance():
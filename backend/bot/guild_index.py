@@ -0,0 +1,80 @@
+import hashlib
+import json
+from typing import Optional
+import discord
+
+
+def _payload(data) -> tuple[str, str]:
+    body = json.dumps(data, separators=(",", ":"))
+    return body, hashlib.sha1(body.encode()).hexdigest()
+
+
+class GuildEntry:
+    def __init__(self, guild: discord.Guild):
+        self.id: str = str(guild.id)
+        self.name: str = str(guild.name)
+        self.icon: str = str(guild.icon)
+        self.channels: str = ""
+        self.channels_etag: str = ""
+        self.roles: str = ""
+        self.roles_etag: str = ""
+        self.update_channels(guild)
+        self.update_roles(guild)
+
+    def update_channels(self, guild: discord.Guild) -> None:
+        self.channels, self.channels_etag = _payload(
+            [{"name": channel.name, "id": channel.id} for channel in guild.text_channels])
+
+    def update_roles(self, guild: discord.Guild) -> None:
+        # Roles are mapped as following
+        # {
+        #     "name": "@everyone",
+        #     "id": 1147839218379399208,
+        #     "color": "(0, 0, 0)"
+        # }
+        self.roles, self.roles_etag = _payload({"roles": [
+            {"name": role.name, "id": role.id, "color": f"{role.color.r, role.color.g, role.color.b}"} for role
+            in guild.roles]})
+
+
+class GuildIndex:
+    # Guild id -> pre-serialised channel and role payloads with their ETags. Kept up to date from gateway events in
+    # bot/bot.py, so API lookups are a dict access instead of a scan over bot.guilds and a fresh serialisation.
+    def __init__(self):
+        self.guilds: dict[str, GuildEntry] = {}
+
+    def __contains__(self, guild_id: str) -> bool:
+        return guild_id in self.guilds
+
+    def get(self, guild_id: str) -> Optional[GuildEntry]:
+        return self.guilds.get(guild_id)
+
+    def rebuild(self, guilds: list[discord.Guild]) -> None:
+        self.guilds = {str(guild.id): GuildEntry(guild) for guild in guilds}
+
+    def add_guild(self, guild: discord.Guild) -> None:
+        self.guilds[str(guild.id)] = GuildEntry(guild)
+
+    def remove_guild(self, guild_id: int | str) -> None:
+        self.guilds.pop(str(guild_id), None)
+
+    def update_guild(self, guild: discord.Guild) -> None:
+        entry = self.guilds.get(str(guild.id))
+        if entry is None:
+            self.add_guild(guild)
+            return
+        entry.name = str(guild.name)
+        entry.icon = str(guild.icon)
+
+    def update_channels(self, guild: discord.Guild) -> None:
+        entry = self.guilds.get(str(guild.id))
+        if entry is not None:
+            entry.update_channels(guild)
+
+    def update_roles(self, guild: discord.Guild) -> None:
+        entry = self.guilds.get(str(guild.id))
+        if entry is not None:
+            entry.update_roles(guild)
+
+
+guild_index = GuildIndex()
@@ -1,10 +1,19 @@
 import asyncio
-from apscheduler.schedulers.background import BackgroundScheduler
+import time
 from bot.bot import get_bot_instance
 from backend.api import create_app
+from backend.router import create_router_app
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
+from util.config import WORKER_COUNT, WORKER_INDEX
 from util.db import DBUtil
+from util.http import discord_http
+from util.permissions import permissions
+from shared.delivery import DeliveryPipeline
+from shared.outbox import outbox
+from shared.recovery import recover_missed_announcements
+from shared.scheduler import AnnouncementScheduler
+from shared.sharding import WorkerLease, supervise_workers
 from shared.tasks import load_announcements
 
 
@@ -12,29 +21,55 @@ async def run_discord_bot(bot):
     await bot.start(<BOT_TOKEN>)
 
 
-async def run_flask_app(app):
+async def run_api(app, bind="localhost:5000"):
     config = Config()
-    config.bind = ["localhost:5000"]
+    config.bind = [bind]
     await serve(app, config)
 
 
+async def run_cluster():
+    # Sharded mode: this process only routes the public API, the bot and the scheduler run in the workers. Migrations
+    # run here once, before any worker opens the database.
+    DBUtil().db_setup()
+    await asyncio.gather(
+        supervise_workers(__file__),
+        run_api(create_router_app())
+    )
+
+
 async def main():
     db = DBUtil()
     db.db_setup()
 
-    scheduler = BackgroundScheduler()
+    lease = None
+    if WORKER_INDEX is not None:
+        lease = WorkerLease(db, WORKER_INDEX)
+        await lease.acquire()
+        outbox.lease = lease.fence
+
+    scheduler = AnnouncementScheduler()
 
     bot = get_bot_instance()
-    loop = asyncio.get_event_loop()
-    scheduler.start(),
-    app = create_app(bot, loop, scheduler)
-    load_announcements(bot, scheduler, loop)
+    permissions.bot = bot
+    delivery = DeliveryPipeline(bot)
+    scheduler.start()
+    delivery.start()
+    outbox.start()
+    started_at = time.time()
+    await recover_missed_announcements(delivery, started_at)
+    await discord_http.start()
+    app = create_app(bot, scheduler, delivery)
 
     await asyncio.gather(
-        run_flask_app(app),
-        run_discord_bot(bot)
+        load_announcements(delivery, scheduler, started_at),
+        run_api(app, f"unix:{lease.address}" if lease else "localhost:5000"),
+        run_discord_bot(bot),
+        *([lease.keep()] if lease else [])
     )
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKER_COUNT > 1 and WORKER_INDEX is None:
+        asyncio.run(run_cluster())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,197 @@
+import asyncio
+import itertools
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+import aiohttp
+import discord
+from util.config import (DELIVERY_CONCURRENCY, DELIVERY_MAX_ATTEMPTS, DELIVERY_MAX_BACKOFF, DELIVERY_RATE_LIMIT)
+from util.metrics import LAG_BUCKETS, registry
+from shared.sharding import owns_guild
+
+# Together with scheduler_fire_lag_seconds these split an announcement's lateness into scheduler, queue and Discord
+queue_lag = registry.histogram("delivery_queue_lag_seconds", "Planned fire time to the first send attempt",
+                               buckets=LAG_BUCKETS)
+send_seconds = registry.histogram("delivery_send_seconds", "Duration of each send request to Discord", ["outcome"])
+# Announcements whose latest send latency /delivery reports, the most recently delivered ones are kept
+LATENCY_HISTORY = 1000
+
+fire_lag = registry.histogram("delivery_fire_lag_seconds", "Planned fire time to Discord acknowledging the message",
+                              buckets=LAG_BUCKETS)
+
+
+class Delivery:
+    def __init__(self, announcement_id: int, guild_id: str, channel_id: str, content: str, scheduled_at: float,
+                 on_done: Optional[Callable[["Delivery", bool], None]] = None):
+        self.announcement_id: int = announcement_id
+        self.guild_id: str = guild_id
+        self.channel_id: str = channel_id
+        self.content: str = content
+        self.scheduled_at: float = scheduled_at
+        self.on_done: Optional[Callable[[Delivery, bool], None]] = on_done
+        self.attempts: int = 0
+        self.started_at: Optional[float] = None
+        self.latency: Optional[float] = None
+
+    @property
+    def bucket(self) -> tuple[str, str]:
+        # Discord rate limits a route per major parameter, for creating messages that's the channel
+        return "POST /channels/{channel_id}/messages", self.channel_id
+
+
+class DeliveryPipeline:
+    # Sends go through one FIFO queue per Discord rate limit bucket (see Delivery.bucket), so a busy bucket only ever
+    # has one request in flight and never holds up other buckets. Buckets with work are picked by the scheduled time
+    # of their oldest message, so overdue sends go first. `concurrency` workers bound
+    # the requests in flight and every send takes a slot from a global rate limit kept under Discord's 50/s.
+    def __init__(self, bot: discord.Client, concurrency: int = DELIVERY_CONCURRENCY,
+                 rate_limit: float = DELIVERY_RATE_LIMIT, max_attempts: int = DELIVERY_MAX_ATTEMPTS):
+        self.bot: discord.Client = bot
+        self.concurrency: int = concurrency
+        self.rate_limit: float = rate_limit
+        self.max_attempts: int = max_attempts
+        self.pending: int = 0
+        self.delivered: int = 0
+        self.failed: int = 0
+        # announcement id -> seconds from scheduled time to Discord acknowledging the message, for the last send of
+        # the LATENCY_HISTORY most recently delivered announcements
+        self.latencies: OrderedDict[int, float] = OrderedDict()
+        self._queues: dict[tuple[str, str], deque[Delivery]] = {}
+        self._ready: Optional[asyncio.PriorityQueue] = None
+        self._counter = itertools.count()
+        self._next_slot: float = 0
+        self._workers: list[asyncio.Task] = []
+        self._space: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        self._ready = asyncio.PriorityQueue()
+        self._space = asyncio.Event()
+        self._workers = [asyncio.get_running_loop().create_task(self._work()) for _ in range(self.concurrency)]
+
+    def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+
+    def submit(self, delivery: Delivery) -> None:
+        self.pending += 1
+        queue = self._queues.get(delivery.bucket)
+        if queue is not None:
+            queue.append(delivery)
+            return
+        self._queues[delivery.bucket] = deque([delivery])
+        self._make_ready(delivery.bucket)
+
+    async def wait_for_capacity(self, limit: int) -> None:
+        while self.pending >= limit:
+            self._space.clear()
+            await self._space.wait()
+
+    @property
+    def buckets(self) -> int:
+        # Rate limit buckets with sends queued
+        return len(self._queues)
+
+    def stats(self) -> dict[str, int]:
+        return {"pending": self.pending, "buckets": self.buckets, "delivered": self.delivered,
+                "failed": self.failed}
+
+    def _make_ready(self, bucket: tuple[str, str]) -> None:
+        queue = self._queues[bucket]
+        self._ready.put_nowait((queue[0].scheduled_at, next(self._counter), bucket))
+
+    async def _wait_until_ready(self) -> None:
+        # Client.wait_until_ready raises until the client has started logging in, and the workers start before it
+        while True:
+            try:
+                await self.bot.wait_until_ready()
+                return
+            except RuntimeError:
+                await asyncio.sleep(0.1)
+
+    async def _work(self) -> None:
+        await self._wait_until_ready()
+        while True:
+            _, _, bucket = await self._ready.get()
+            queue = self._queues[bucket]
+            delivery = queue[0]
+            retry_in = await self._send(delivery)
+            if retry_in is not None:
+                asyncio.get_running_loop().call_later(retry_in, self._make_ready, bucket)
+                continue
+            queue.popleft()
+            self.pending -= 1
+            self._space.set()
+            if queue:
+                self._make_ready(bucket)
+            else:
+                del self._queues[bucket]
+
+    async def _throttle(self) -> None:
+        now = time.monotonic()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + 1 / self.rate_limit
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _send(self, delivery: Delivery) -> Optional[float]:
+        # Returns how long to wait before retrying, or None once the delivery succeeded or was given up on
+        guild = self.bot.get_guild(int(delivery.guild_id))
+        if guild:
+            channel = guild.get_channel(int(delivery.channel_id))
+        elif not owns_guild(delivery.guild_id):
+            # A broadcast target on another worker's shards, sent over REST without this process caching the guild
+            channel = self.bot.get_partial_messageable(int(delivery.channel_id), guild_id=int(delivery.guild_id))
+        else:
+            channel = None
+        if not channel:
+            self._finish(delivery, False)
+            return None
+        await self._throttle()
+        delivery.attempts += 1
+        started = time.time()
+        if delivery.started_at is None:
+            delivery.started_at = started
+            queue_lag.observe(started - delivery.scheduled_at)
+        try:
+            await channel.send(delivery.content)
+        except discord.HTTPException as e:
+            send_seconds.observe(time.time() - started, str(e.status))
+            if (e.status == 429 or e.status >= 500) and delivery.attempts < self.max_attempts:
+                retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+                return float(retry_after) if retry_after else self._backoff(delivery.attempts)
+            print(f"Error sending announcement {delivery.announcement_id}: {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            send_seconds.observe(time.time() - started, "error")
+            if delivery.attempts < self.max_attempts:
+                return self._backoff(delivery.attempts)
+            print(f"Error sending announcement {delivery.announcement_id}: {e}")
+        except Exception as e:
+            print(f"Error sending announcement {delivery.announcement_id}: {e}")
+        else:
+            send_seconds.observe(time.time() - started, "ok")
+            self._finish(delivery, True)
+            return None
+        self._finish(delivery, False)
+        return None
+
+    @staticmethod
+    def _backoff(attempts: int) -> float:
+        return min(DELIVERY_MAX_BACKOFF, 2 ** (attempts - 1)) * (0.5 + random.random())
+
+    def _finish(self, delivery: Delivery, success: bool) -> None:
+        if success:
+            self.delivered += 1
+            delivery.latency = time.time() - delivery.scheduled_at
+            self.latencies[delivery.announcement_id] = delivery.latency
+            self.latencies.move_to_end(delivery.announcement_id)
+            while len(self.latencies) > LATENCY_HISTORY:
+                self.latencies.popitem(last=False)
+            fire_lag.observe(delivery.latency)
+        else:
+            self.failed += 1
+        if delivery.on_done:
+            try:
+                delivery.on_done(delivery, success)
+            except Exception as e:
+                print(f"Error finishing announcement {delivery.announcement_id}: {e}")
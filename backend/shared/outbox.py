@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+from util.config import OUTBOX_FLUSH_INTERVAL, OUTBOX_RETENTION
+from util.db import DBUtil
+
+
+class OutboxWriter:
+    # Collects delivery status changes and next_fire_at updates in memory and writes them in one transaction every
+    # `interval` seconds from a worker thread, so a burst of fires costs one commit instead of one per announcement.
+    # An occurrence is recorded as pending in the same commit that moves its announcement's next_fire_at past it, and
+    # is only marked sent once Discord acknowledged it, which gives at-least-once delivery across crashes.
+    def __init__(self, db: DBUtil, interval: float = OUTBOX_FLUSH_INTERVAL, retention: int = OUTBOX_RETENTION):
+        self.db: DBUtil = db
+        self.interval: float = interval
+        self.retention: int = retention
+        self.flushes: int = 0
+        self._due: list[tuple[int, int, str, str, int]] = []
+        # (announcement id, occurrence, channel id) -> (status, attempts, updated at)
+        self._statuses: dict[tuple[int, int, str], tuple[str, int, int]] = {}
+        self._next_fire_ats: dict[int, Optional[int]] = {}
+        self._removed: set[int] = set()
+        # Recently recorded (announcement id, occurrence) pairs, so the same occurrence isn't dispatched twice
+        self._seen: OrderedDict[tuple[int, int], None] = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
+        self._runner: Optional[asyncio.Task] = None
+        self._last_prune: float = 0
+        # (worker id, owner) of the worker lease in sharded mode, see WorkerLease.fence
+        self.lease: Optional[tuple[int, str]] = None
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner:
+            self._runner.cancel()
+        await self.flush()
+
+    @property
+    def pending(self) -> int:
+        return len(self._due) + len(self._statuses) + len(self._next_fire_ats) + len(self._removed)
+
+    @property
+    def next_fire_ats_pending(self) -> int:
+        return len(self._next_fire_ats)
+
+    def record_due(self, announcement_id: int, occurrence: int, channels: list[tuple[str, str]]) -> bool:
+        # Records the occurrence as pending for every (guild_id, channel_id) it goes to. Returns False when the
+        # occurrence was already recorded and must not be sent again. Recent occurrences are answered from memory,
+        # older ones, including those of a previous run, from the deliveries unique key.
+        if not self.replay(announcement_id, occurrence):
+            return False
+        if self.db.has_delivery(announcement_id, occurrence):
+            return False
+        now = int(time.time())
+        self._due.extend((announcement_id, occurrence, guild_id, channel_id, now) for guild_id, channel_id in channels)
+        self._notify()
+        return True
+
+    def replay(self, announcement_id: int, occurrence: int) -> bool:
+        # Claims an occurrence that is already in the deliveries table, like a pending one left by the previous run.
+        # Returns False when this run already dispatched it.
+        key = (announcement_id, occurrence)
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        while len(self._seen) > 100000:
+            self._seen.popitem(last=False)
+        return True
+
+    def mark_sent(self, announcement_id: int, occurrence: int, channel_id: str, attempts: int) -> None:
+        self._statuses[(announcement_id, occurrence, channel_id)] = ("sent", attempts, int(time.time()))
+        self._notify()
+
+    def mark_failed(self, announcement_id: int, occurrence: int, channel_id: str, attempts: int) -> None:
+        self._statuses[(announcement_id, occurrence, channel_id)] = ("failed", attempts, int(time.time()))
+        self._notify()
+
+    def set_next_fire_at(self, announcement_id: int, next_fire_at: Optional[int]) -> None:
+        self._next_fire_ats[announcement_id] = next_fire_at
+        self._notify()
+
+    def remove_announcement(self, announcement_id: int) -> None:
+        self._next_fire_ats.pop(announcement_id, None)
+        self._removed.add(announcement_id)
+        self._notify()
+
+    def _notify(self) -> None:
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        # One flush at a time, so batches commit in the order they were taken and a status update never lands before
+        # the pending row it updates. A caller that finds a flush under way waits for it, so everything queued before
+        # the call is in the table once it returns.
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self.pending:
+            return
+        due, self._due = self._due, []
+        statuses, self._statuses = self._statuses, {}
+        next_fire_ats, self._next_fire_ats = self._next_fire_ats, {}
+        removed, self._removed = self._removed, set()
+        try:
+            await asyncio.to_thread(
+                self.db.apply_delivery_batch,
+                due,
+                [(status, attempts, updated_at, announcement_id, occurrence, channel_id)
+                 for (announcement_id, occurrence, channel_id), (status, attempts, updated_at) in statuses.items()],
+                [(next_fire_at, announcement_id) for announcement_id, next_fire_at in next_fire_ats.items()],
+                [(announcement_id,) for announcement_id in removed],
+                self.lease)
+        except Exception:
+            # Put the batch back underneath anything queued meanwhile so the next flush retries it
+            self._due = due + self._due
+            self._statuses = {**statuses, **self._statuses}
+            self._next_fire_ats = {**next_fire_ats, **self._next_fire_ats}
+            self._removed |= removed
+            raise
+        self.flushes += 1
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Give the rest of the burst a moment to arrive so it lands in the same commit
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                if time.time() - self._last_prune > 3600:
+                    self._last_prune = time.time()
+                    await asyncio.to_thread(self.db.prune_deliveries, int(time.time()) - self.retention)
+            except Exception as e:
+                print(f"Error writing delivery outbox: {e}")
+                await asyncio.sleep(1)
+                self._notify()
+
+
+outbox = OutboxWriter(DBUtil())
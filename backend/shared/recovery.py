@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+from util.config import (MISSED_FIRE_MAX_AGE, MISSED_FIRE_MAX_PER_ANNOUNCEMENT, MISSED_FIRE_POLICY,
+                         RECOVERY_BATCH_SIZE, RECOVERY_MAX_PENDING)
+from util.db import DBUtil
+from util.trigger_util import PERIOD_SPANS, get_next_fire_at, get_next_fire_time
+from shared.outbox import outbox
+from shared.sharding import owned_shards
+from shared.tasks import announcement_channels, send_discord_message
+from shared.templates import template_source
+
+db = DBUtil()
+
+
+def get_missed_occurrences(timestamp: int, period: str, next_fire_at: int, now: float,
+                           policy: str = MISSED_FIRE_POLICY) -> list[int]:
+    # Occurrences between the persisted next_fire_at and now that the policy wants sent. Only the stretch of time the
+    # policy can keep is expanded, so a MINUTELY announcement after a week of downtime isn't walked minute by minute.
+    match policy:
+        case "all":
+            limit = MISSED_FIRE_MAX_PER_ANNOUNCEMENT
+            lower = now - limit * PERIOD_SPANS[period]
+        case "latest":
+            limit = 1
+            lower = now - PERIOD_SPANS[period]
+        case "drop":
+            limit = None
+            lower = now - MISSED_FIRE_MAX_AGE * 60
+        case _:
+            raise ValueError(f"Unknown missed fire policy '{policy}'")
+    if period == "ONCE" and policy != "drop":
+        lower = next_fire_at
+    occurrences = deque(maxlen=limit)
+    fire_at = next_fire_at if next_fire_at >= lower else get_next_fire_time(timestamp, period, lower)
+    while fire_at is not None and fire_at < now:
+        occurrences.append(int(fire_at))
+        fire_at = get_next_fire_time(timestamp, period, fire_at + 1) if period != "ONCE" else None
+    return list(occurrences)
+
+
+async def recover_missed_announcements(delivery, now: Optional[float] = None) -> None:
+    # One pass over the overdue end of the next_fire_at index: record every missed occurrence the policy keeps in the
+    # outbox, move next_fire_at past now, and leave the sends to a background drain so startup doesn't wait on them
+    now = now if now is not None else time.time()
+    backlog = deque()
+    # In sharded mode every worker reads the same tables and only takes its own shards
+    shards = owned_shards()
+    pending_deliveries = db.get_pending_deliveries(shards)
+    # Only the channels of an occurrence that weren't acknowledged are sent again
+    unacknowledged: dict[tuple[int, int], tuple[dict, list[tuple[str, str]]]] = {}
+    for pending in pending_deliveries:
+        _, channels = unacknowledged.setdefault((pending["announcement_id"], pending["occurrence"]), (pending, []))
+        channels.append((pending["target_guild_id"], pending["target_channel_id"]))
+    for (announcement_id, occurrence), (pending, channels) in unacknowledged.items():
+        if outbox.replay(announcement_id, occurrence):
+            (guild_id, channel_id), *others = channels
+            backlog.append((announcement_id, guild_id, channel_id,
+                            template_source(pending["content"], pending["templated"]), pending["timestamp"],
+                            pending["period"], occurrence, tuple(others)))
+    replayed = len(backlog)
+    after = (-1, 0)
+    while True:
+        announcements = db.get_overdue_announcements(int(now), after, RECOVERY_BATCH_SIZE, shards)
+        if not announcements:
+            break
+        targets = db.get_announcement_targets([announcement["id"] for announcement in announcements])
+        for announcement in announcements:
+            announcement_id = announcement["id"]
+            timestamp = announcement["timestamp"]
+            period = announcement["period"]
+            missed = get_missed_occurrences(timestamp, period, announcement["next_fire_at"], now)
+            channels = announcement_channels(announcement["guild_id"], announcement["channel_id"],
+                                             targets.get(announcement_id, ()))
+            for occurrence in missed:
+                if outbox.record_due(announcement_id, occurrence, channels):
+                    backlog.append((announcement_id, announcement["guild_id"], announcement["channel_id"],
+                                    template_source(announcement["content"], announcement["templated"]), timestamp,
+                                    period, occurrence, targets.get(announcement_id, ())))
+            if period == "ONCE" and not missed:
+                # The policy dropped its only occurrence, nothing will ever send or remove it
+                outbox.remove_announcement(announcement_id)
+                continue
+            outbox.set_next_fire_at(announcement_id, get_next_fire_at(timestamp, period, now))
+        after = (announcements[-1]["next_fire_at"], announcements[-1]["id"])
+        await asyncio.sleep(0)
+    if backlog:
+        print(f"Recovering {replayed} unacknowledged and {len(backlog) - replayed} missed announcement sends.")
+        asyncio.get_running_loop().create_task(drain_backlog(delivery, backlog))
+
+
+async def drain_backlog(delivery, backlog: deque) -> None:
+    # Feed the delivery pipeline only as fast as it empties, so the backlog never crowds out announcements firing now
+    while backlog:
+        await delivery.wait_for_capacity(RECOVERY_MAX_PENDING)
+        send_discord_message(delivery, *backlog.popleft())
@@ -0,0 +1,76 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Optional
+
+
+class Job:
+    def __init__(self, job_id: str, fire_at: float, callback: Callable[[float], Awaitable[None]]):
+        self.id: str = job_id
+        self.next_run_time: float = fire_at
+        self.callback: Callable[[float], Awaitable[None]] = callback
+
+
+class AnnouncementScheduler:
+    # Min-heap of (fire_at, seq, job) living on the bot's event loop. Removing or moving a job leaves its old heap
+    # entry behind and it is skipped when popped, so add/remove/fire are all O(log n) and no worker threads are used.
+    def __init__(self):
+        self.jobs: dict[str, Job] = {}
+        # Only announcements firing at or before this time are held in memory, see load_announcements
+        self.horizon: float = 0
+        self._heap: list[tuple[float, int, Job]] = []
+        self._counter = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._runner = self._loop.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._runner:
+            self._runner.cancel()
+
+    def add_job(self, job_id: str, fire_at: float, callback: Callable[[float], Awaitable[None]]) -> None:
+        job = Job(job_id, fire_at, callback)
+        self.jobs[job_id] = job
+        heapq.heappush(self._heap, (fire_at, next(self._counter), job))
+        if self._heap[0][2] is job and self._wakeup:
+            self._wakeup.set()
+
+    def remove_job(self, job_id: str) -> None:
+        self.jobs.pop(job_id, None)
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def get_jobs(self) -> list[Job]:
+        return list(self.jobs.values())
+
+    def lag(self, now: Optional[float] = None) -> float:
+        # Seconds the earliest entry is past due, which stays near zero unless something keeps the loop from running
+        # the scheduler. A stale entry of a moved job counts too, it's popped on the same pass.
+        now = now if now is not None else time.time()
+        return max(0.0, now - self._heap[0][0]) if self._heap else 0.0
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, _, job = heapq.heappop(self._heap)
+                if self.jobs.get(job.id) is not job:
+                    continue
+                del self.jobs[job.id]
+                task = self._loop.create_task(job.callback(fire_at))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
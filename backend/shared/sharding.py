@@ -0,0 +1,123 @@
+import asyncio
+import os
+import socket
+import sys
+import time
+import uuid
+from typing import Optional
+from util.config import SHARD_COUNT, WORKER_COUNT, WORKER_INDEX, WORKER_LEASE_TTL, WORKER_SOCKET_DIR
+from util.db import DBUtil
+
+
+def shard_for_guild(guild_id: int | str, shard_count: int = SHARD_COUNT) -> int:
+    # Discord's own mapping of guilds to gateway shards
+    return (int(guild_id) >> 22) % shard_count
+
+
+def worker_for_shard(shard_id: int, worker_count: int = WORKER_COUNT) -> int:
+    return shard_id % worker_count
+
+
+def worker_for_guild(guild_id: int | str) -> int:
+    return worker_for_shard(shard_for_guild(guild_id))
+
+
+def worker_shard_ids(worker_index: Optional[int] = WORKER_INDEX) -> list[int]:
+    # Every shard outside of sharded mode
+    return [shard_id for shard_id in range(SHARD_COUNT)
+            if worker_index is None or worker_for_shard(shard_id) == worker_index]
+
+
+def owns_guild(guild_id: int | str) -> bool:
+    # Whether this process schedules and sends the guild's announcements, always true outside of sharded mode
+    return WORKER_INDEX is None or worker_for_guild(guild_id) == WORKER_INDEX
+
+
+def owned_shards() -> Optional[list[int]]:
+    # The shards to limit database reads to, None outside of sharded mode where every row is this process's
+    return worker_shard_ids() if WORKER_INDEX is not None else None
+
+
+def worker_socket(worker_index: int) -> str:
+    return os.path.join(WORKER_SOCKET_DIR, f"announcer-worker-{worker_index}.sock")
+
+
+class WorkerLease:
+    # The database row that makes this process the owner of a worker index. acquire() waits for a previous holder's
+    # lease to run out, so a restarted worker never overlaps with one that is still shutting down, and keep() renews
+    # it until the lease is lost, at which point the worker has to stop.
+    def __init__(self, db: DBUtil, worker_index: int, ttl: float = WORKER_LEASE_TTL):
+        self.db: DBUtil = db
+        self.worker_index: int = worker_index
+        self.ttl: float = ttl
+        self.owner: str = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.address: str = worker_socket(worker_index)
+        self.shard_ids: list[int] = worker_shard_ids(worker_index)
+
+    def _renew(self) -> bool:
+        return self.db.acquire_worker_lease(self.worker_index, self.owner, self.address,
+                                            ",".join(map(str, self.shard_ids)), self.ttl)
+
+    async def acquire(self) -> None:
+        while not self._renew():
+            print(f"Waiting for the lease of worker {self.worker_index} to expire.")
+            await asyncio.sleep(self.ttl / 3)
+        # Whoever held the lease before is gone, so a socket file left behind is stale. Only removed while the lease
+        # is still this process's, otherwise it may be the socket of a newer holder.
+        if os.path.exists(self.address) and self.holds():
+            os.unlink(self.address)
+
+    def holds(self) -> bool:
+        return any(lease["worker_id"] == self.worker_index and lease["owner"] == self.owner
+                   for lease in self.db.get_worker_leases())
+
+    @property
+    def fence(self) -> tuple[int, str]:
+        # Passed along with writes that must only land while this process holds the lease
+        return self.worker_index, self.owner
+
+    async def keep(self) -> None:
+        expires_at = time.time() + self.ttl
+        try:
+            while True:
+                await asyncio.sleep(self.ttl / 3)
+                renewing_at = time.time()
+                try:
+                    renewed = self._renew()
+                except Exception as e:
+                    # A busy or briefly unavailable database is retried for as long as the lease still holds
+                    print(f"Error renewing the lease of worker {self.worker_index}: {e}")
+                    renewed = None
+                if renewed:
+                    expires_at = renewing_at + self.ttl
+                elif renewed is False or time.time() >= expires_at:
+                    raise RuntimeError(f"Lost the lease of worker {self.worker_index}")
+        finally:
+            self.release()
+
+    def release(self) -> None:
+        try:
+            self.db.release_worker_lease(self.worker_index, self.owner)
+        except Exception as e:
+            print(f"Error releasing the lease of worker {self.worker_index}: {e}")
+
+
+async def supervise_workers(script: str, worker_count: int = WORKER_COUNT) -> None:
+    # Runs `script` once per worker index with WORKER_INDEX set and restarts a worker whenever it exits. The new
+    # process waits in WorkerLease.acquire until the old one's lease is released or has expired.
+    if worker_count > SHARD_COUNT:
+        raise ValueError(f"WORKER_COUNT ({worker_count}) can't be larger than SHARD_COUNT ({SHARD_COUNT})")
+
+    async def run(worker_index: int) -> None:
+        while True:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, script, env={**os.environ, "WORKER_INDEX": str(worker_index)})
+            try:
+                code = await process.wait()
+            finally:
+                if process.returncode is None:
+                    process.terminate()
+            print(f"Worker {worker_index} exited with code {code}, restarting.")
+            await asyncio.sleep(1)
+
+    await asyncio.gather(*(run(worker_index) for worker_index in range(worker_count)))
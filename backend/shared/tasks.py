@@ -1,47 +1,176 @@
-import discord
-from util.trigger_util import get_trigger
-from util.db import DBUtil
 import asyncio
+import time
+from util.config import ANNOUNCEMENT_HORIZON, ANNOUNCEMENT_REFILL_INTERVAL
+from util.trigger_util import get_next_fire_time
+from util.db import DBUtil
+from util.metrics import LAG_BUCKETS, registry
+from shared.delivery import Delivery
+from shared.outbox import outbox
+from shared.sharding import owned_shards
+from shared.templates import invalidate_template, render_announcement, template_source
 
 db = DBUtil()
 
+scheduler_lag = registry.histogram("scheduler_fire_lag_seconds", "Planned fire time to the scheduler running the job",
+                                   buckets=LAG_BUCKETS)
+
+
+def announcement_channels(guild_id, channel_id, targets=()):
+    # (guild_id, channel_id) of the announcement's own channel and its broadcast `targets`, a channel listed twice once
+    channels = {channel_id: guild_id}
+    for target_guild_id, target_channel_id in targets:
+        channels.setdefault(target_channel_id, target_guild_id)
+    return [(target_guild_id, target_channel_id) for target_channel_id, target_guild_id in channels.items()]
+
+
+def send_discord_message(delivery, announcement_id, guild_id, channel_id, message, timestamp, period, occurrence,
+                         targets=()):
+    # Fans the occurrence out to the announcement's own channel and its broadcast `targets`. Every channel's delivery
+    # is recorded as sent or failed on its own, and a ONCE announcement is removed once all of them were sent.
+    channels = announcement_channels(guild_id, channel_id, targets)
+    remaining = len(channels)
+    failed = False
+
+    def on_done(sent, success):
+        nonlocal remaining, failed
+        remaining -= 1
+        failed = failed or not success
+        if success:
+            outbox.mark_sent(announcement_id, occurrence, sent.channel_id, sent.attempts)
+        else:
+            outbox.mark_failed(announcement_id, occurrence, sent.channel_id, sent.attempts)
+        if remaining:
+            return
+        if period == "ONCE" and not failed:
+            outbox.remove_announcement(announcement_id)
+        elif period == "ONCE":
+            # Kept with its failed delivery as the record, it doesn't fire again unless it's edited
+            outbox.set_next_fire_at(announcement_id, None)
 
-async def send_discord_message(bot, loop, announcement_id, guild_id, channel_id, message, timestamp, period):
-    guild = bot.get_guild(int(guild_id))
-    if not guild:
-        return
-    channel = guild.get_channel(int(channel_id))
-    if not channel:
-        return
-    try:
-        asyncio.run_coroutine_threadsafe(channel.send(message), loop)
-        if period == "ONCE":
-            db.remove_announcement(announcement_id)
-    except Exception as e:
-        print(f"Error sending message: {e}")
+    # Only the per-occurrence substitution runs here, the template itself is compiled once per announcement, and the
+    # rendered text is shared by every target
+    content = render_announcement(announcement_id, message, timestamp, period, occurrence)
+    for target_guild_id, target_channel_id in channels:
+        delivery.submit(Delivery(announcement_id, target_guild_id, target_channel_id, content, occurrence, on_done))
 
 
-def schedule_announcement(bot, scheduler, loop, announcement_id, guild_id, channel_id, message, timestamp, period):
-    trigger = get_trigger(timestamp, period)
-    scheduler.add_job(lambda: asyncio.run(send_discord_message(bot, loop, announcement_id, guild_id, channel_id, message, timestamp, period)), trigger, id=str(announcement_id))
-    print(f"Scheduled announcement for guild {guild_id}, channel {channel_id} at {timestamp} with period '{period}'.")
+def schedule_announcement(delivery, scheduler, announcement_id, guild_id, channel_id, message, timestamp, period,
+                          now=None, targets=()):
+    # One job per announcement however many channels it broadcasts to, `targets` are the extra (guild_id, channel_id)
+    # pairs from announcement_targets
+    fire_at = get_next_fire_time(timestamp, period, now if now is not None else time.time())
+    if fire_at is None or fire_at > scheduler.horizon:
+        # Out of the loaded window, load_announcements picks it up from next_fire_at once the window reaches it
+        return fire_at
+
+    async def fire(fired_at):
+        scheduler_lag.observe(time.time() - fired_at)
+        occurrence = int(fired_at)
+        if not outbox.record_due(announcement_id, occurrence, announcement_channels(guild_id, channel_id, targets)):
+            return
+        # Queue the next occurrence first so a backed up delivery queue doesn't drift the schedule
+        if period != "ONCE":
+            next_fire_at = schedule_announcement(delivery, scheduler, announcement_id, guild_id, channel_id, message,
+                                                 timestamp, period, now=fired_at + 1, targets=targets)
+            outbox.set_next_fire_at(announcement_id, int(next_fire_at))
+        send_discord_message(delivery, announcement_id, guild_id, channel_id, message, timestamp, period, occurrence,
+                             targets)
+
+    scheduler.add_job(str(announcement_id), fire_at, fire)
+    return fire_at
 
 
 def remove_scheduled_announcement(scheduler, announcement_id):
     scheduler.remove_job(str(announcement_id))
 
 
-def parse_announcement(message):
-    return message
+def apply_announcement_change(delivery, scheduler, announcement_id, announcement=None, now=None):
+    # The single path every create, update and delete takes into the scheduler once the row is written: only this
+    # announcement's next fire time is recomputed and its job moved, which the heap does in O(log n). `announcement`
+    # is the row as stored, or None when it was deleted, with its broadcast targets under "targets" if the caller
+    # already has them. Returns the new fire time.
+    remove_scheduled_announcement(scheduler, announcement_id)
+    invalidate_template(announcement_id)
+    if announcement is None:
+        return None
+    targets = announcement.get("targets")
+    if targets is None:
+        targets = db.get_announcement_targets([announcement_id]).get(announcement_id, [])
+    fire_at = schedule_announcement(delivery, scheduler, announcement_id, announcement["guild_id"],
+                                    announcement["channel_id"],
+                                    template_source(announcement["content"], announcement.get("templated", True)),
+                                    announcement["timestamp"], announcement["period"], now=now, targets=tuple(targets))
+    # Supersedes a next_fire_at still queued in the outbox from a fire of the old version
+    outbox.set_next_fire_at(announcement_id, int(fire_at) if fire_at is not None else None)
+    return fire_at
+
 
+async def diff_scheduler(scheduler, now=None):
+    # Compares the in-memory schedule with the rows the table says are due inside the loaded window. Rows whose time
+    # already passed are reported as overdue rather than missing, those are the missed fire recovery's business.
+    await outbox.flush()
+    now = now if now is not None else time.time()
+    rows = {str(row["id"]): row for row in db.get_due_announcements(int(scheduler.horizon), shards=owned_shards())}
+    jobs = {job.id: job for job in scheduler.get_jobs()}
+    missing, overdue, mismatched = [], [], []
+    for announcement_id, row in rows.items():
+        job = jobs.get(announcement_id)
+        if job is None:
+            (overdue if row["next_fire_at"] < now else missing).append(row["id"])
+        elif int(job.next_run_time) != row["next_fire_at"]:
+            mismatched.append({"id": row["id"], "scheduled": int(job.next_run_time), "stored": row["next_fire_at"]})
+    extra = [int(job_id) for job_id in jobs if job_id not in rows]
+    return {"in_sync": not (missing or mismatched or extra), "horizon": int(scheduler.horizon), "jobs": len(jobs),
+            "rows": len(rows), "missing": missing, "extra": extra, "mismatched": mismatched, "overdue": overdue}
 
-def load_announcements(bot, scheduler, loop):
-    announcements = db.get_all_announcements()
+
+async def refill_announcements(delivery, scheduler, now=None):
+    # The window is read from the table, so next_fire_ats that fires left in the outbox have to be written first, or
+    # a row whose stored time is still inside the old window would never be read again. There's no await between the
+    # last flush and the read, so no fire can queue another one in between.
+    while outbox.next_fire_ats_pending:
+        await outbox.flush()
+    now = now if now is not None else time.time()
+    horizon = int(now + ANNOUNCEMENT_HORIZON)
+    # The first pass also picks up rows whose next_fire_at already passed while the bot was down, starting from the
+    # same `now` the missed fire recovery stopped at
+    after = int(scheduler.horizon) if scheduler.horizon else None
+    scheduler.horizon = horizon
+    announcements = db.get_due_announcements(horizon, after, owned_shards())
+    # Broadcast targets of the whole window in one query
+    targets = db.get_announcement_targets([announcement["id"] for announcement in announcements])
     for announcement in announcements:
         announcement_id = announcement["id"]
+        if scheduler.get_job(str(announcement_id)):
+            continue
         guild_id = announcement["guild_id"]
         channel_id = announcement["channel_id"]
-        content = announcement["content"]
+        content = template_source(announcement["content"], announcement["templated"])
         timestamp = announcement["timestamp"]
         period = announcement["period"]
-        schedule_announcement(bot, scheduler, loop, announcement_id, guild_id, channel_id, content, timestamp, period)
+        fire_at = schedule_announcement(delivery, scheduler, announcement_id, guild_id, channel_id, content, timestamp,
+                                        period, now=now, targets=tuple(targets.get(announcement_id, ())))
+        fire_at = int(fire_at) if fire_at is not None else None
+        if fire_at != announcement["next_fire_at"]:
+            outbox.set_next_fire_at(announcement_id, fire_at)
+    return len(announcements)
+
+
+async def load_announcements(delivery, scheduler, now=None):
+    # Keeps a sliding window of ANNOUNCEMENT_HORIZON seconds in memory, so startup cost and memory depend on how
+    # many announcements are due soon rather than on the size of the table
+    while True:
+        try:
+            loaded = await refill_announcements(delivery, scheduler, now)
+        except Exception as e:
+            # The window stays where it is and the next pass tries again
+            print(f"Error loading announcements: {e}")
+            await asyncio.sleep(ANNOUNCEMENT_REFILL_INTERVAL)
+            continue
+        now = None
+        if loaded:
+            print(f"Loaded {loaded} announcements due before {scheduler.horizon}.")
+        expired = db.remove_expired_announcements()
+        if expired:
+            print(f"Removed {expired} ONCE announcements that passed without firing.")
+        await asyncio.sleep(ANNOUNCEMENT_REFILL_INTERVAL)
@@ -0,0 +1,147 @@
+import re
+from datetime import datetime
+from typing import Callable, Optional
+from util.cache import TTLCache
+from util.config import TEMPLATE_CACHE_SIZE
+from util.trigger_util import get_occurrence_number
+
+# Placeholders in announcement content, written as {name} or {name:argument}, with {{ and }} for literal braces:
+#   {date}, {date:%d.%m.}    the occurrence's local date, strftime format optional (%Y-%m-%d by default)
+#   {time}, {time:%H.%M}     the occurrence's local time, strftime format optional (%H:%M by default)
+#   {timestamp:R}            Discord timestamp markup for the occurrence, in the reader's own time zone, with an
+#                            optional style out of t, T, d, D, f, F and R (f by default)
+#   {occurrence}             which occurrence of the announcement this is, starting from 1
+#   {countdown:1767225600}   time left from the occurrence until a unix timestamp, like "3d 4h 5m"
+#   {role:ID}, {channel:ID}, {user:ID}, {everyone}, {here}   mentions
+# Anything else in braces, unknown names and lone braces included, is sent as written.
+TIMESTAMP_STYLES = "tTdDfFR"
+PLACEHOLDER_PATTERN = re.compile(r"\{\{|\}\}|\{([A-Za-z_]+)(?::([^{}]*))?\}")
+
+# (occurrence, announcement timestamp, period) -> text
+Renderer = Callable[[int, int, str], str]
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class Template:
+    # Content compiled into literal text and renderers for the placeholders that depend on the occurrence. Mentions
+    # are resolved at compile time, so content without occurrence placeholders renders to one precomputed string.
+    def __init__(self, source: str, parts: list[str | Renderer]):
+        self.source: str = source
+        self.parts: tuple[str | Renderer, ...] = tuple(parts)
+        self.static: Optional[str] = None
+        if all(isinstance(part, str) for part in parts):
+            self.static = "".join(parts)
+
+    def render(self, occurrence: int, timestamp: int, period: str) -> str:
+        if self.static is not None:
+            return self.static
+        return "".join(part if isinstance(part, str) else part(occurrence, timestamp, period) for part in self.parts)
+
+
+def _mention(prefix: str, name: str, argument: str) -> str:
+    if not argument.isdigit():
+        raise TemplateError(f"'{{{name}}}' needs a numeric id, like {{{name}:123}}")
+    return f"<{prefix}{argument}>"
+
+
+def _countdown(argument: str) -> Renderer:
+    if not argument.isdigit():
+        raise TemplateError("'{countdown}' needs a unix timestamp, like {countdown:1767225600}")
+    target = int(argument)
+
+    def render(occurrence: int, timestamp: int, period: str) -> str:
+        minutes = max(0, target - occurrence) // 60
+        days, minutes = divmod(minutes, 1440)
+        hours, minutes = divmod(minutes, 60)
+        units = [f"{days}d"] if days else []
+        if days or hours:
+            units.append(f"{hours}h")
+        units.append(f"{minutes}m")
+        return " ".join(units)
+
+    return render
+
+
+def _placeholder(name: str, argument: str) -> Optional[str | Renderer]:
+    match name:
+        case "date" | "time":
+            fmt = argument or ("%Y-%m-%d" if name == "date" else "%H:%M")
+            return lambda occurrence, timestamp, period: datetime.fromtimestamp(occurrence).strftime(fmt)
+        case "timestamp":
+            style = argument or "f"
+            if len(style) != 1 or style not in TIMESTAMP_STYLES:
+                raise TemplateError(f"Unknown timestamp style '{style}', use one of {', '.join(TIMESTAMP_STYLES)}")
+            return lambda occurrence, timestamp, period: f"<t:{occurrence}:{style}>"
+        case "occurrence":
+            return lambda occurrence, timestamp, period: str(get_occurrence_number(timestamp, period, occurrence))
+        case "countdown":
+            return _countdown(argument)
+        case "role":
+            return _mention("@&", name, argument)
+        case "channel":
+            return _mention("#", name, argument)
+        case "user":
+            return _mention("@", name, argument)
+        case "everyone" | "here":
+            return f"@{name}"
+        case _:
+            return None
+
+
+def compile_template(source: str) -> Template:
+    # Raises TemplateError for a known placeholder with an invalid argument, like {role:abc}, so it's rejected when
+    # it's written instead of when it fires
+    parts: list[str | Renderer] = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(source):
+        parts.append(source[position:match.start()])
+        position = match.end()
+        if match.group(0) in ("{{", "}}"):
+            parts.append(match.group(0)[0])
+            continue
+        part = _placeholder(match.group(1), match.group(2) or "")
+        parts.append(match.group(0) if part is None else part)
+    parts.append(source[position:])
+    # Neighbouring literal text, mentions included, is joined once here instead of on every render
+    merged: list[str | Renderer] = []
+    for part in parts:
+        if part == "":
+            continue
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        else:
+            merged.append(part)
+    return Template(source, merged)
+
+
+# Announcement id -> compiled template, least recently fired evicted first. Entries don't expire, a PATCH invalidates
+# them through apply_announcement_change and a template compiled from other content is never used.
+template_cache = TTLCache(TEMPLATE_CACHE_SIZE, float("inf"))
+
+
+def get_template(announcement_id: int, content: str) -> Template:
+    template = template_cache.get(announcement_id)
+    if template is None or template.source != content:
+        try:
+            template = compile_template(content)
+        except TemplateError:
+            # Content that reached the table without being validated goes out as it is
+            template = Template(content, [content])
+        template_cache.set(announcement_id, template)
+    return template
+
+
+def template_source(content: str, templated: bool) -> str:
+    # Rows written before templates existed aren't templates, their braces are escaped so they go out as written
+    return content if templated else content.replace("{", "{{").replace("}", "}}")
+
+
+def render_announcement(announcement_id: int, content: str, timestamp: int, period: str, occurrence: int) -> str:
+    return get_template(announcement_id, content).render(occurrence, timestamp, period)
+
+
+def invalidate_template(announcement_id: int) -> None:
+    template_cache.invalidate(announcement_id)
@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+from backend.admission import AdmissionController, KeyedLimiter
+from util import auth
+from util.cache import TTLCache
+
+
+def test_bucket_refills_at_its_rate():
+    limiter = KeyedLimiter(2, 3)
+    assert [limiter.take("a", 100) for _ in range(3)] == [0, 0, 0]
+    assert limiter.take("a", 100) == 0.5
+    assert limiter.take("b", 100) == 0
+    assert limiter.take("a", 100.25) == 0.25
+    assert limiter.take("a", 100.5) == 0
+    # A long pause refills up to the burst, not beyond it
+    assert [limiter.take("a", 1000) for _ in range(4)] == [0, 0, 0, 0.5]
+    assert limiter.limited == 3
+
+
+def test_least_recently_used_bucket_is_dropped():
+    limiter = KeyedLimiter(1, 1, max_keys=2)
+    limiter.take("a", 100)
+    limiter.take("b", 100)
+    limiter.take("a", 100)
+    limiter.take("c", 100)
+    assert len(limiter) == 2
+    # "a" was kept and is still empty, "b" starts over with a full bucket
+    assert limiter.take("a", 100) == 1
+    assert limiter.take("b", 100) == 0
+
+
+def admission() -> AdmissionController:
+    return AdmissionController(SimpleNamespace(lag=lambda: 0), SimpleNamespace(pending=0), max_in_flight=1000)
+
+
+def test_unverified_callers_share_one_bucket():
+    controller = admission()
+    controller.unverified = KeyedLimiter(1, 2, 1)
+
+    async def admit():
+        return [await controller.admit(None, False) for _ in range(3)], await controller.admit("token", False)
+
+    unverified, verified = asyncio.run(admit())
+    assert unverified[:2] == [None, None] and unverified[2][2] == "unverified"
+    assert verified is None
+    assert controller.unverified.stats()["keys"] == 1
+
+
+def test_guild_bucket_is_separate_from_admission():
+    controller = admission()
+    controller.guilds = KeyedLimiter(1, 1)
+    assert controller.admit_guild("1") is None
+    assert controller.admit_guild("1")[2] == "guild"
+    assert controller.admit_guild("2") is None
+    assert controller.rejected["guild"] == 1
+
+
+def test_token_stays_verified_after_its_lookup_expires(monkeypatch):
+    async def fetch(token, path):
+        return {"id": "2"} if token == "good" else None
+
+    monkeypatch.setattr(auth, "_fetch", fetch)
+    monkeypatch.setattr(auth, "verified_tokens", TTLCache(10, 3600))
+    assert asyncio.run(auth.is_auth("good")) and not asyncio.run(auth.is_auth("junk"))
+    auth.user_cache.clear()
+    assert auth.is_verified("good")
+    assert not auth.is_verified("junk")
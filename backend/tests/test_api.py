@@ -0,0 +1,32 @@
+import asyncio
+from quart import Quart, jsonify
+from backend import api
+
+
+def internal_app():
+    app = Quart(__name__)
+
+    @app.route('/internal')
+    @api.internal
+    async def internal_route():
+        return jsonify({"ok": True})
+
+    return app
+
+
+def get_status(app, headers=None) -> int:
+    async def get():
+        return (await app.test_client().get('/internal', headers=headers or {})).status_code
+
+    return asyncio.run(get())
+
+
+def test_internal_endpoints_need_the_internal_token(monkeypatch):
+    app = internal_app()
+    monkeypatch.setattr(api, "INTERNAL_API_TOKEN", None)
+    assert get_status(app, {"Authorization": "Bearer secret"}) == 404
+    monkeypatch.setattr(api, "INTERNAL_API_TOKEN", "secret")
+    assert get_status(app) == 401
+    assert get_status(app, {"Authorization": "Bearer wrong"}) == 401
+    assert get_status(app, {"Authorization": "secret"}) == 401
+    assert get_status(app, {"Authorization": "Bearer secret"}) == 200
@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+from werkzeug.datastructures import MultiDict
+from backend.bulk import EXPORT_FIELDS, MAX_TARGETS, apply_batch, parse_ndjson, parse_targets
+from backend.listing import ListingQuery, list_announcements
+from shared import tasks
+from shared.outbox import OutboxWriter
+from shared.scheduler import AnnouncementScheduler
+from util.db import DBUtil
+
+ITEM = {"channel_id": "3", "name": "a", "message": "text", "timestamp": 4102444800, "period": "DAILY"}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = DBUtil(str(tmp_path / "test.db"))
+    db.db_setup()
+    monkeypatch.setattr(tasks, "db", db)
+    monkeypatch.setattr(tasks, "outbox", OutboxWriter(db))
+    return db
+
+
+async def same_guild(channel_id):
+    return "1"
+
+
+def batch(db, scheduler, create=(), update=(), delete=(), errors=None):
+    return asyncio.run(apply_batch(db, None, scheduler, "1", "2", list(create), list(update), list(delete), errors,
+                                   channel_guild=same_guild))
+
+
+def test_targets_default_to_the_announcement_guild():
+    assert parse_targets([{"channel_id": "10"}, {"channel_id": 11, "guild_id": 2}], "1") == [("1", "10"), ("2", "11")]
+    # A channel listed twice keeps the guild it was first listed with
+    assert parse_targets([{"channel_id": "10"}, {"channel_id": "10", "guild_id": "2"}], "1") == [("1", "10")]
+    assert parse_targets([], "1") == []
+
+
+def test_invalid_targets_are_rejected():
+    for value in ({"channel_id": "10"}, ["10"], [{"guild_id": "2"}], [{"channel_id": "ten"}],
+                  [{"channel_id": "10", "guild_id": "two"}], [{"channel_id": str(i)} for i in range(MAX_TARGETS + 1)]):
+        with pytest.raises(ValueError):
+            parse_targets(value, "1")
+
+
+def test_target_channel_must_be_in_its_guild(db):
+    channels = {"10": "1", "11": "2"}
+
+    async def channel_guild(channel_id):
+        return channels.get(channel_id, "")
+
+    item = ITEM
+    create = [{**item, "targets": [{"channel_id": "11"}]}, {**item, "targets": [{"channel_id": "12"}]}]
+    result = asyncio.run(apply_batch(db, None, None, "1", "2", create, [], [], channel_guild=channel_guild))
+    assert result["created"] == []
+    assert [error["error"] for error in result["errors"]] == ["Channel 11 is not in guild 1",
+                                                              "Channel 12 is not in guild 1"]
+    assert db.get_announcements("1") == []
+
+
+def test_batch_creates_updates_and_deletes_together(db):
+    scheduler = AnnouncementScheduler()
+    kept, removed = (db.add_announcement("1", "2", "3", name, "text", 4102444800, "DAILY") for name in ("kept", "gone"))
+    result = batch(db, scheduler, [{**ITEM, "name": "new", "targets": [{"channel_id": "4"}]}],
+                   [{"id": kept, "name": "renamed"}], [removed])
+    assert result["errors"] == []
+    created = result["created"][0]["id"]
+    assert {row["id"]: row["name"] for row in db.get_announcements("1")} == {kept: "renamed", created: "new"}
+    assert db.get_announcement_targets([created]) == {created: [("1", "4")]}
+
+
+def test_invalid_items_are_reported_and_the_rest_applied(db):
+    scheduler = AnnouncementScheduler()
+    result = batch(db, scheduler, [ITEM, {**ITEM, "period": "SOMETIMES"}, {**ITEM, "timestamp": "soon"}],
+                   [{"id": 999, "name": "missing"}], [999])
+    assert [row["name"] for row in db.get_announcements("1")] == ["a"]
+    assert [(error["op"], error["index"]) for error in result["errors"]] == [
+        ("create", 1), ("create", 2), ("delete", 0), ("update", 0)]
+
+
+def test_failed_write_rolls_the_whole_batch_back(db, monkeypatch):
+    scheduler = AnnouncementScheduler()
+    kept = db.add_announcement("1", "2", "3", "kept", "text", 4102444800, "DAILY")
+    removed = db.add_announcement("1", "2", "3", "gone", "text", 4102444800, "DAILY")
+    before = db.get_announcements("1")
+
+    def fail(announcement_id, targets):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(db, "_replace_targets", fail)
+    with pytest.raises(RuntimeError):
+        batch(db, scheduler, [ITEM, {**ITEM, "targets": [{"channel_id": "4"}]}], [{"id": kept, "name": "renamed"}],
+              [removed])
+    assert db.get_announcements("1") == before
+    assert scheduler.get_jobs() == []
+
+
+def test_export_imports_back_as_it_was(db, tmp_path, monkeypatch):
+    scheduler = AnnouncementScheduler()
+    batch(db, scheduler, [{**ITEM, "name": "plain"}, {**ITEM, "name": "braces", "message": "{{literal}} {date}"},
+                          {**ITEM, "name": "broadcast", "period": "ONCE", "targets": [{"channel_id": "4"}]}])
+    query = ListingQuery(MultiDict({"format": "ndjson"}))
+    query.fields, query.limit, query.targets = EXPORT_FIELDS, None, True
+    exported = asyncio.run(list_announcements(db, "1", query).get_data(as_text=True))
+
+    copy = DBUtil(str(tmp_path / "copy.db"))
+    copy.db_setup()
+    monkeypatch.setattr(tasks, "db", copy)
+    monkeypatch.setattr(tasks, "outbox", OutboxWriter(copy))
+    items, errors = parse_ndjson(exported + "\nnot json\n")
+    result = batch(copy, AnnouncementScheduler(), items, errors=errors)
+    assert [error["error"] for error in result["errors"]] == ["Invalid JSON"]
+
+    def rows(db):
+        announcements = db.get_announcements("1")
+        targets = db.get_announcement_targets([row["id"] for row in announcements])
+        return [({field: row[field] for field in EXPORT_FIELDS}, targets.get(row["id"], [])) for row in announcements]
+
+    assert rows(copy) == rows(db)
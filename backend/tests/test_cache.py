@@ -0,0 +1,60 @@
+import asyncio
+import time
+import pytest
+from util.cache import TTLCache
+
+
+def test_concurrent_loads_share_one_call():
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        cache = TTLCache(10, 60)
+        results = await asyncio.gather(*(cache.get_or_load("key", load) for _ in range(5)))
+        return results, await cache.get_or_load("key", load)
+
+    results, cached = asyncio.run(run())
+    assert results == ["value"] * 5
+    assert cached == "value"
+    assert calls == 1
+
+
+def test_none_and_errors_are_not_cached():
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RuntimeError("boom")
+        return None
+
+    async def run():
+        cache = TTLCache(10, 60)
+        with pytest.raises(RuntimeError):
+            await cache.get_or_load("key", load)
+        assert await cache.get_or_load("key", load) is None
+        assert await cache.get_or_load("key", load) is None
+
+    asyncio.run(run())
+    assert calls == 3
+
+
+def test_entries_expire_and_least_recently_used_go_first():
+    cache = TTLCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    expiring = TTLCache(2, 0.01)
+    expiring.set("a", 1)
+    time.sleep(0.02)
+    assert expiring.get("a") is None
@@ -0,0 +1,119 @@
+import asyncio
+import time
+import pytest
+from shared.outbox import OutboxWriter
+from util import db as util_db
+from util.db import DBUtil
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DBUtil(str(tmp_path / "test.db"))
+    db.db_setup()
+    return db
+
+
+def test_expired_once_announcements_are_removed(db):
+    now = int(time.time())
+    expired = db.add_announcement("1", "2", "3", "past", "text", now - 3600, "ONCE")
+    upcoming = db.add_announcement("1", "2", "3", "future", "text", now + 3600, "ONCE")
+    recurring = db.add_announcement("1", "2", "3", "daily", "text", now - 3600, "DAILY")
+    assert db.remove_expired_announcements() == 1
+    assert sorted(row["id"] for row in db.get_announcements("1")) == [upcoming, recurring]
+    assert expired not in [row["id"] for row in db.get_announcements("1")]
+
+
+def test_failed_once_announcement_is_kept(db):
+    now = int(time.time())
+    failed = db.add_announcement("1", "2", "3", "failed", "text", now - 3600, "ONCE")
+    db.apply_delivery_batch([(failed, now - 3600, "1", "3", now)], [("failed", 5, now, failed, now - 3600, "3")],
+                            [(None, failed)], [])
+    assert db.remove_expired_announcements() == 0
+    db.prune_deliveries(now + 1)
+    assert db.has_delivery(failed, now - 3600)
+    assert [row["id"] for row in db.get_announcements("1")] == [failed]
+
+
+def test_once_announcement_waiting_on_its_send_is_kept(db):
+    now = int(time.time())
+    pending = db.add_announcement("1", "2", "3", "pending", "text", now - 3600, "ONCE")
+    db.apply_delivery_batch([(pending, now - 3600, "1", "3", now)], [], [(None, pending)], [])
+    assert db.remove_expired_announcements() == 0
+    assert len(db.get_pending_deliveries()) == 1
+
+
+def test_recorded_occurrence_is_not_recorded_again_after_restart(db):
+    now = int(time.time())
+    announcement = db.add_announcement("1", "2", "3", "daily", "text", now, "DAILY")
+    db.apply_delivery_batch([(announcement, now, "1", "3", now)], [], [], [])
+    outbox = OutboxWriter(db)
+    assert not outbox.record_due(announcement, now, [("1", "3")])
+    assert outbox.record_due(announcement, now + 86400, [("1", "3")])
+    assert not outbox.record_due(announcement, now + 86400, [("1", "3")])
+
+
+def test_due_announcements_are_read_per_shard(db, monkeypatch):
+    monkeypatch.setattr(util_db, "SHARD_COUNT", 2)
+    db.db_setup()
+    now = int(time.time())
+    even = db.add_announcement(str(4 << 22), "2", "3", "even", "text", now + 60, "DAILY")
+    odd = db.add_announcement(str(5 << 22), "2", "3", "odd", "text", now + 60, "DAILY")
+    assert [row["id"] for row in db.get_due_announcements(now + 172800, shards=[1])] == [odd]
+    assert [row["id"] for row in db.get_overdue_announcements(now + 172800, (-1, 0), 10, [0])] == [even]
+    assert len(db.get_due_announcements(now + 172800)) == 2
+    monkeypatch.setattr(util_db, "SHARD_COUNT", 1)
+    db.db_setup()
+    assert len(db.get_due_announcements(now + 172800, shards=[0])) == 2
+    # Rows written without a shard get one on the next start even when the count didn't change
+    db.db.execute("UPDATE announcements SET shard = NULL")
+    db.db_setup()
+    assert len(db.get_due_announcements(now + 172800, shards=[0])) == 2
+
+
+def test_delivery_batch_is_fenced_by_the_lease(db):
+    now = int(time.time())
+    announcement = db.add_announcement("1", "2", "3", "daily", "text", now, "DAILY")
+    assert db.acquire_worker_lease(0, "old", "socket", "0", -1)
+    assert db.acquire_worker_lease(0, "new", "socket", "0", 30)
+    with pytest.raises(RuntimeError):
+        db.apply_delivery_batch([(announcement, now, "1", "3", now)], [], [], [], lease=(0, "old"))
+    assert not db.has_delivery(announcement, now)
+    db.apply_delivery_batch([(announcement, now, "1", "3", now)], [], [], [], lease=(0, "new"))
+    assert db.has_delivery(announcement, now)
+
+
+def test_content_becomes_a_template_once_it_changes(db):
+    legacy = db.add_announcement("1", "2", "3", "legacy", "{date}", 4102444800, "DAILY")
+    db.db.execute("UPDATE announcements SET templated = 0")
+    db.update_announcement(legacy, "2", content="{date}", timestamp=4102444860)
+    assert db.get_announcement("1", legacy)["templated"] == 0
+    row = db.get_announcement("1", legacy)
+    db.apply_announcement_batch("1", [], [("2", "3", "legacy", "{date}", row["timestamp"], "DAILY", None, legacy)], [])
+    assert db.get_announcement("1", legacy)["templated"] == 0
+    db.update_announcement(legacy, "2", content="{time}")
+    assert db.get_announcement("1", legacy)["templated"] == 1
+
+
+def test_concurrent_flushes_commit_in_order(db):
+    now = int(time.time())
+    announcement = db.add_announcement("1", "2", "3", "daily", "text", now, "DAILY")
+    outbox = OutboxWriter(db)
+    apply_delivery_batch = db.apply_delivery_batch
+
+    def slow_insert(due, *args):
+        # Holds the batch with the pending row back, so a second flush running alongside would commit first
+        if due:
+            time.sleep(0.05)
+        return apply_delivery_batch(due, *args)
+
+    db.apply_delivery_batch = slow_insert
+
+    async def flush_twice():
+        outbox.record_due(announcement, now, [("1", "3")])
+        first = asyncio.create_task(outbox.flush())
+        await asyncio.sleep(0)
+        outbox.mark_sent(announcement, now, "3", 1)
+        await asyncio.gather(first, outbox.flush())
+
+    asyncio.run(flush_twice())
+    assert db.get_pending_deliveries() == []
@@ -0,0 +1,61 @@
+import asyncio
+import time
+import shared.delivery
+from shared.delivery import Delivery, DeliveryPipeline
+
+
+class FakeChannel:
+    def __init__(self, sent: list):
+        self.sent = sent
+
+    async def send(self, content):
+        self.sent.append(content)
+        await asyncio.sleep(0)
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_guild(self, guild_id):
+        bot = self
+
+        class Guild:
+            def get_channel(self, channel_id):
+                return FakeChannel(bot.sent)
+
+        return Guild()
+
+
+def deliver(deliveries: list[Delivery], **options) -> tuple[FakeBot, DeliveryPipeline]:
+    async def run():
+        bot = FakeBot()
+        pipeline = DeliveryPipeline(bot, concurrency=4, rate_limit=10000, **options)
+        pipeline.start()
+        for delivery in deliveries:
+            pipeline.submit(delivery)
+        while pipeline.pending:
+            await asyncio.sleep(0.001)
+        pipeline.stop()
+        return bot, pipeline
+
+    return asyncio.run(run())
+
+
+def test_sends_in_one_bucket_keep_their_order():
+    now = time.time()
+    deliveries = [Delivery(n, "1", "10", f"message {n}", now) for n in range(5)]
+    bot, pipeline = deliver(deliveries)
+    assert bot.sent == [f"message {n}" for n in range(5)]
+    assert pipeline.delivered == 5
+    assert pipeline.stats()["buckets"] == 0
+
+
+def test_latencies_keep_only_the_most_recent_announcements(monkeypatch):
+    monkeypatch.setattr(shared.delivery, "LATENCY_HISTORY", 3)
+    now = time.time()
+    _, pipeline = deliver([Delivery(n, "1", str(100 + n), "text", now) for n in range(10)])
+    assert len(pipeline.latencies) == 3
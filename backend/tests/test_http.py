@@ -0,0 +1,14 @@
+import time
+from util.http import DiscordHTTPClient
+
+
+def test_prune_drops_passed_resets_and_their_routes():
+    client = DiscordHTTPClient()
+    now = time.monotonic()
+    client._routes = {("a", "GET", "/users/@me"): "users", ("b", "GET", "/users/@me"): "users"}
+    client._bucket_resets = {("a", "users"): now + 60, ("b", "users"): now - 1}
+    client._global_resets = {"a": now - 1, "b": now + 60}
+    client._prune()
+    assert client._routes == {("a", "GET", "/users/@me"): "users"}
+    assert client._bucket_resets == {("a", "users"): now + 60}
+    assert client._global_resets == {"b": now + 60}
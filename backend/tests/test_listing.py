@@ -0,0 +1,25 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+from backend.listing import ListingQuery
+from util.db import DBUtil
+
+
+def test_cursor_must_match_the_order():
+    assert ListingQuery(MultiDict({"cursor": "5"})).after == (5,)
+    assert ListingQuery(MultiDict({"order": "next_fire_at", "cursor": "1767225600:5"})).after == (1767225600, 5)
+    assert ListingQuery(MultiDict()).after is None
+    for args in ({"cursor": "1767225600:5"}, {"order": "next_fire_at", "cursor": "5"}, {"cursor": "five"},
+                 {"cursor": "5:"}):
+        with pytest.raises(ValueError):
+            ListingQuery(MultiDict(args))
+
+
+def test_pages_continue_after_the_last_key(tmp_path):
+    db = DBUtil(str(tmp_path / "test.db"))
+    db.db_setup()
+    ids = [db.add_announcement("1", "2", "3", str(i), "text", 4102444800 + i * 60, "DAILY") for i in range(7)]
+    pages = list(db.iter_announcements("1", ["name"], page_size=3))
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [row["id"] for page in pages for row in page] == ids
+    pages = list(db.iter_announcements("1", ["name"], "next_fire_at", (4102444800 + 60, ids[1]), 3, page_size=2))
+    assert [row["id"] for page in pages for row in page] == ids[2:5]
@@ -0,0 +1,22 @@
+from util.metrics import Histogram, timed
+
+
+def test_timed_observes_once_per_call():
+    histogram = Histogram("test_seconds", "test", ["method"])
+
+    @timed(histogram, "plain")
+    def plain():
+        return 1
+
+    @timed(histogram, "pages")
+    def pages():
+        yield 1
+        yield 2
+
+    assert plain() == 1
+    assert list(pages()) == [1, 2]
+    first = pages()
+    next(first)
+    first.close()
+    observed = {key: sum(series[:-1]) for key, series in histogram._snapshot()}
+    assert observed == {("plain",): 1, ("pages",): 2}
@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from backend.occurrences import get_calendar, get_upcoming_load
+from util.db import DBUtil
+from util.trigger_util import get_next_fire_time
+
+START = 4102444800
+END = START + 3 * 86400
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DBUtil(str(tmp_path / "test.db"))
+    db.db_setup()
+    # Two HOURLY rows share a schedule key but enter it at different times
+    for name, offset, period in (("hourly", 300, "HOURLY"), ("later hourly", 7500, "HOURLY"),
+                                 ("daily", 18000, "DAILY"), ("weekly", 600, "WEEKLY"), ("once", 86400, "ONCE"),
+                                 ("once after", 3 * 86400 + 60, "ONCE")):
+        db.add_announcement("1", "2", "3", name, "text", START + offset, period)
+    db.add_announcement("2", "2", "3", "other guild", "text", START + 300, "DAILY")
+    return db
+
+
+def brute_force(db, guild_id=None):
+    # Every occurrence in [START, END) walked one by one, as (at, id)
+    occurrences = []
+    rows = db.get_all_announcements()
+    for row in rows:
+        if guild_id is not None and row["guild_id"] != guild_id:
+            continue
+        at = row["next_fire_at"]
+        while at is not None and at < END:
+            if at >= START:
+                occurrences.append((int(at), row["id"]))
+            at = get_next_fire_time(row["timestamp"], row["period"], at + 1) if row["period"] != "ONCE" else None
+    return sorted(occurrences)
+
+
+def test_calendar_matches_every_occurrence(db):
+    calendar = asyncio.run(get_calendar(db, "1", START, END))
+    assert [(occurrence["at"], occurrence["id"]) for occurrence in calendar["occurrences"]] == brute_force(db, "1")
+    assert not calendar["truncated"]
+
+
+def test_calendar_keeps_the_earliest_occurrences_up_to_the_limit(db):
+    calendar = asyncio.run(get_calendar(db, "1", START, END, limit=10))
+    assert [(occurrence["at"], occurrence["id"]) for occurrence in calendar["occurrences"]] == brute_force(db, "1")[:10]
+    assert calendar["truncated"]
+
+
+def test_upcoming_load_counts_every_occurrence_per_bucket(db):
+    load = asyncio.run(get_upcoming_load(db, START, END, 3600))
+    expected = [0] * 72
+    for at, _ in brute_force(db):
+        expected[(at - START) // 3600] += 1
+    assert load["counts"] == expected
+    assert load["total"] == sum(expected)
+    assert load["peaks"][0]["count"] == max(expected)
+    with pytest.raises(ValueError):
+        asyncio.run(get_upcoming_load(db, START, END, 0))
+
+
+def test_upcoming_pages_continue_after_ties(db):
+    for _ in range(3):
+        db.add_announcement("1", "2", "3", "tie", "text", START + 300, "ONCE")
+    pages = list(db.iter_upcoming_announcements(END, "1", page_size=2))
+    rows = [(row["next_fire_at"], row["id"]) for page in pages for row in page]
+    assert rows == sorted(rows)
+    assert len(rows) == len(set(rows)) == 8
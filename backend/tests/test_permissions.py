@@ -0,0 +1,56 @@
+import asyncio
+from types import SimpleNamespace
+from util.permissions import PermissionResolver
+
+
+class FakeDB:
+    def get_admins(self, guild_id):
+        return [{"user_id": 1}]
+
+    def get_admin_roles(self, guild_id):
+        return [{"role_id": 10}]
+
+
+class FakeGuild:
+    def __init__(self):
+        self.members = {}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+
+def resolver():
+    guild = FakeGuild()
+    permissions = PermissionResolver(FakeDB())
+    permissions.bot = SimpleNamespace(get_guild=lambda guild_id: guild, intents=SimpleNamespace(members=True))
+    return permissions, guild
+
+
+def member(*role_ids):
+    return SimpleNamespace(roles=[SimpleNamespace(id=role_id) for role_id in role_ids])
+
+
+def test_decisions_are_memoised_per_guild():
+    permissions, guild = resolver()
+    assert asyncio.run(permissions.can_manage("1", "5"))
+    assert not asyncio.run(permissions.can_manage("2", "5"))
+    assert not asyncio.run(permissions.can_manage("2", "6"))
+    guild.members[2] = member(10)
+    assert not asyncio.run(permissions.can_manage("2", "5"))
+    permissions.invalidate_guild("5")
+    assert asyncio.run(permissions.can_manage("2", "5"))
+    assert not asyncio.run(permissions.can_manage("2", "6"))
+    assert permissions._decision_count == 2
+
+
+def test_member_join_and_role_changes_drop_denials():
+    permissions, guild = resolver()
+    assert not asyncio.run(permissions.can_manage("2", "5"))
+    guild.members[2] = member(10)
+    permissions.invalidate_member("5", "2")
+    assert asyncio.run(permissions.can_manage("2", "5"))
+    assert not asyncio.run(permissions.can_manage("3", "5"))
+    guild.members[3] = member(10)
+    permissions.invalidate_denials("5")
+    assert asyncio.run(permissions.can_manage("3", "5"))
+    assert permissions._decision_count == 2
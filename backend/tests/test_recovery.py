@@ -0,0 +1,62 @@
+import asyncio
+import time
+import pytest
+from shared import recovery
+from shared.outbox import OutboxWriter
+from util.db import DBUtil
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = DBUtil(str(tmp_path / "test.db"))
+    db.db_setup()
+    monkeypatch.setattr(recovery, "db", db)
+    monkeypatch.setattr(recovery, "outbox", OutboxWriter(db))
+    return db
+
+
+def test_drop_policy_keeps_only_recent_occurrences():
+    now = 1767225600
+    assert recovery.get_missed_occurrences(now - 7200, "ONCE", now - 7200, now, "drop") == []
+    assert recovery.get_missed_occurrences(now - 600, "ONCE", now - 600, now, "drop") == [now - 600]
+    assert recovery.get_missed_occurrences(now - 7200, "ONCE", now - 7200, now, "all") == [now - 7200]
+    assert recovery.get_missed_occurrences(now - 86400, "HOURLY", now - 86400, now, "latest") == [now - 3600]
+
+
+def test_dropped_once_announcement_is_removed(db, monkeypatch):
+    monkeypatch.setattr(recovery, "get_missed_occurrences", lambda *args: [])
+    now = int(time.time())
+    dropped = db.add_announcement("1", "2", "3", "dropped", "text", now + 60, "ONCE")
+    daily = db.add_announcement("1", "2", "3", "daily", "text", now + 60, "DAILY")
+
+    async def recover():
+        await recovery.recover_missed_announcements(None, now + 7200)
+        await recovery.outbox.flush()
+
+    asyncio.run(recover())
+    assert [row["id"] for row in db.get_announcements("1")] == [daily]
+
+
+def test_only_unacknowledged_channels_are_replayed(db, monkeypatch):
+    now = int(time.time())
+    announcement_id = db.add_announcement("1", "2", "3", "broadcast", "text", now + 3600, "DAILY",
+                                          [("1", "4"), ("5", "6")])
+    replayed = []
+
+    async def drain_backlog(delivery, backlog):
+        replayed.extend(backlog)
+
+    monkeypatch.setattr(recovery, "drain_backlog", drain_backlog)
+
+    async def recover():
+        recovery.outbox.record_due(announcement_id, now, [("1", "3"), ("1", "4"), ("5", "6")])
+        recovery.outbox.mark_sent(announcement_id, now, "4", 1)
+        await recovery.outbox.flush()
+        # As after a restart, nothing in memory remembers the occurrence
+        monkeypatch.setattr(recovery, "outbox", OutboxWriter(db))
+        await recovery.recover_missed_announcements(None, now)
+        await asyncio.sleep(0)
+
+    asyncio.run(recover())
+    assert [(guild_id, channel_id, others) for _, guild_id, channel_id, *_, others in replayed] == [
+        ("1", "3", (("5", "6"),))]
@@ -0,0 +1,30 @@
+import asyncio
+from types import SimpleNamespace
+from quart import Response
+from backend.router import UpstreamBody
+
+
+class Upstream:
+    def __init__(self, chunks):
+        self.released = 0
+
+        async def iter_any():
+            for chunk in chunks:
+                yield chunk
+
+        self.content = SimpleNamespace(iter_any=iter_any)
+
+    def release(self):
+        self.released += 1
+
+
+def test_upstream_is_released_whether_or_not_the_body_is_read():
+    read, unread = Upstream([b"a", b"b"]), Upstream([b"a"])
+
+    async def send():
+        assert await Response(UpstreamBody(read)).get_data() == b"ab"
+        async with UpstreamBody(unread):
+            pass
+
+    asyncio.run(send())
+    assert read.released == unread.released == 1
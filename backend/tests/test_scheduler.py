@@ -0,0 +1,46 @@
+import asyncio
+import time
+from shared.scheduler import AnnouncementScheduler
+
+
+def test_jobs_fire_in_time_order():
+    async def run():
+        scheduler = AnnouncementScheduler()
+        scheduler.start()
+        fired = []
+        now = time.time()
+
+        async def record(fired_at):
+            fired.append(fired_at)
+
+        scheduler.add_job("late", now + 0.05, record)
+        scheduler.add_job("early", now + 0.01, record)
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        return now, fired, scheduler.jobs
+
+    now, fired, jobs = asyncio.run(run())
+    assert fired == [now + 0.01, now + 0.05]
+    assert jobs == {}
+
+
+def test_removed_and_moved_jobs_skip_their_old_entries():
+    async def run():
+        scheduler = AnnouncementScheduler()
+        scheduler.start()
+        fired = []
+        now = time.time()
+
+        async def record(fired_at):
+            fired.append(fired_at)
+
+        scheduler.add_job("removed", now + 0.01, record)
+        scheduler.remove_job("removed")
+        scheduler.add_job("moved", now + 0.01, record)
+        scheduler.add_job("moved", now + 0.03, record)
+        await asyncio.sleep(0.08)
+        scheduler.stop()
+        return now, fired
+
+    now, fired = asyncio.run(run())
+    assert fired == [now + 0.03]
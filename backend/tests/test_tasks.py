@@ -0,0 +1,98 @@
+import asyncio
+import time
+import pytest
+from shared import tasks
+from shared.outbox import OutboxWriter
+from shared.scheduler import AnnouncementScheduler
+from util.db import DBUtil
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = DBUtil(str(tmp_path / "test.db"))
+    db.db_setup()
+    monkeypatch.setattr(tasks, "db", db)
+    monkeypatch.setattr(tasks, "outbox", OutboxWriter(db))
+    return db
+
+
+def minute() -> int:
+    # Announcements fire on whole minutes
+    return int(time.time()) // 60 * 60 + 60
+
+
+def scheduler_until(horizon: float) -> AnnouncementScheduler:
+    scheduler = AnnouncementScheduler()
+    scheduler.horizon = horizon
+    return scheduler
+
+
+def announcement(db, guild_id, announcement_id):
+    return {**db.get_announcement(guild_id, announcement_id), "targets": []}
+
+
+def test_change_moves_and_removes_the_job(db):
+    now = minute()
+    scheduler = scheduler_until(now + 7200)
+    announcement_id = db.add_announcement("1", "2", "3", "daily", "text", now + 600, "DAILY")
+    assert tasks.apply_announcement_change(None, scheduler, announcement_id, announcement(db, "1", announcement_id),
+                                           now=now) == now + 600
+    assert scheduler.get_job(str(announcement_id)).next_run_time == now + 600
+    db.update_announcement(announcement_id, "2", None, None, now + 1200, None)
+    tasks.apply_announcement_change(None, scheduler, announcement_id, announcement(db, "1", announcement_id), now=now)
+    assert [job.next_run_time for job in scheduler.get_jobs()] == [now + 1200]
+    # Moved past the loaded window, the refill picks it up from next_fire_at later
+    db.update_announcement(announcement_id, "2", None, None, now + 10800, None)
+    assert tasks.apply_announcement_change(None, scheduler, announcement_id, announcement(db, "1", announcement_id),
+                                           now=now) == now + 10800
+    assert scheduler.get_jobs() == []
+    tasks.apply_announcement_change(None, scheduler, announcement_id, announcement(db, "1", announcement_id), now=now)
+    tasks.apply_announcement_change(None, scheduler, announcement_id, None, now=now)
+    assert scheduler.get_jobs() == []
+
+
+def test_edited_once_announcement_is_rescheduled(db):
+    now = minute()
+    scheduler = scheduler_until(now + 7200)
+    announcement_id = db.add_announcement("1", "2", "3", "once", "text", now + 600, "ONCE")
+    db.update_announcement(announcement_id, "2", None, None, now - 600, None)
+    assert tasks.apply_announcement_change(None, scheduler, announcement_id, announcement(db, "1", announcement_id),
+                                           now=now) is None
+    assert scheduler.get_jobs() == []
+    db.update_announcement(announcement_id, "2", None, None, now + 900, None)
+    tasks.apply_announcement_change(None, scheduler, announcement_id, announcement(db, "1", announcement_id), now=now)
+    asyncio.run(tasks.outbox.flush())
+    assert scheduler.get_job(str(announcement_id)).next_run_time == now + 900
+    assert db.get_announcement("1", announcement_id)["next_fire_at"] == now + 900
+
+
+def test_diff_reports_jobs_and_rows_out_of_sync(db):
+    now = minute()
+    scheduler = scheduler_until(now + 7200)
+    scheduled = db.add_announcement("1", "2", "3", "scheduled", "text", now + 600, "DAILY")
+    moved = db.add_announcement("1", "2", "3", "moved", "text", now + 1200, "DAILY")
+    missing = db.add_announcement("1", "2", "3", "missing", "text", now + 1800, "DAILY")
+    for announcement_id in (scheduled, moved):
+        tasks.apply_announcement_change(None, scheduler, announcement_id, announcement(db, "1", announcement_id),
+                                        now=now)
+    assert asyncio.run(tasks.diff_scheduler(scheduler, now))["missing"] == [missing]
+
+    tasks.apply_announcement_change(None, scheduler, missing, announcement(db, "1", missing), now=now)
+    assert asyncio.run(tasks.diff_scheduler(scheduler, now))["in_sync"]
+
+    db.set_next_fire_at(moved, now + 1500)
+    scheduler.add_job("99", now + 60, None)
+    diff = asyncio.run(tasks.diff_scheduler(scheduler, now))
+    assert not diff["in_sync"]
+    assert diff["mismatched"] == [{"id": moved, "scheduled": now + 1200, "stored": now + 1500}]
+    assert diff["extra"] == [99]
+
+
+def test_refill_sees_next_fire_at_still_in_the_outbox(db):
+    now = minute()
+    scheduler = scheduler_until(now + 600)
+    announcement_id = db.add_announcement("1", "2", "3", "hourly", "text", now, "HOURLY")
+    # Fired at `now` and moved past the window, with the new next_fire_at not flushed yet
+    tasks.outbox.set_next_fire_at(announcement_id, now + 3600)
+    assert asyncio.run(tasks.refill_announcements(None, scheduler, now + 3300)) == 1
+    assert scheduler.get_job(str(announcement_id)).next_run_time == now + 3600
@@ -0,0 +1,29 @@
+import pytest
+from shared.templates import TemplateError, compile_template, template_source
+
+
+def render(source: str, occurrence: int = 1767225600) -> str:
+    return compile_template(source).render(occurrence, occurrence, "DAILY")
+
+
+def test_placeholders_are_substituted():
+    assert render("{role:123} {everyone} {timestamp:R}") == "<@&123> @everyone <t:1767225600:R>"
+    assert render("{countdown:1767321000}") == "1d 2h 30m"
+    assert render("{{literal}}") == "{literal}"
+    assert compile_template("static {channel:5}").static == "static <#5>"
+
+
+def test_anything_else_in_braces_is_sent_as_written():
+    for source in ("{name}", "{", "}", "a { b", "{}", "{date!r}", "json {\"a\": 1}", "{ date }"):
+        assert render(source) == source
+
+
+def test_known_placeholders_with_invalid_arguments_are_rejected():
+    for source in ("{role:abc}", "{timestamp:x}", "{countdown:soon}"):
+        with pytest.raises(TemplateError):
+            compile_template(source)
+
+
+def test_rows_from_before_templates_go_out_as_written():
+    assert render(template_source("{date} {{x}} {role:abc", False)) == "{date} {{x}} {role:abc"
+    assert template_source("{date}", True) == "{date}"
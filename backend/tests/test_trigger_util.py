@@ -0,0 +1,32 @@
+from datetime import datetime
+from util.trigger_util import get_next_fire_at, get_next_fire_time
+
+
+def ts(*args) -> float:
+    return datetime(*args).timestamp()
+
+
+def test_once_fires_on_its_minute_until_it_passed():
+    assert get_next_fire_time(int(ts(2026, 3, 1, 9, 30, 20)), "ONCE", ts(2026, 3, 1, 9, 0)) == ts(2026, 3, 1, 9, 30)
+    assert get_next_fire_time(int(ts(2026, 3, 1, 9, 30)), "ONCE", ts(2026, 3, 1, 9, 31)) is None
+
+
+def test_recurring_periods_start_at_their_timestamp():
+    start = int(ts(2026, 3, 4, 9, 30))
+    assert get_next_fire_time(start, "DAILY", ts(2026, 1, 1)) == start
+    assert get_next_fire_time(start, "DAILY", ts(2026, 3, 4, 9, 31)) == ts(2026, 3, 5, 9, 30)
+    assert get_next_fire_time(start, "HOURLY", ts(2026, 3, 4, 10, 31)) == ts(2026, 3, 4, 11, 30)
+    assert get_next_fire_time(start, "MINUTELY", ts(2026, 3, 4, 9, 40, 1)) == ts(2026, 3, 4, 9, 41)
+    assert get_next_fire_time(start, "WEEKLY", ts(2026, 3, 5)) == ts(2026, 3, 11, 9, 30)
+
+
+def test_monthly_and_yearly_skip_missing_days():
+    assert get_next_fire_time(int(ts(2026, 1, 31, 12)), "MONTHLY", ts(2026, 2, 1)) == ts(2026, 3, 31, 12)
+    assert get_next_fire_time(int(ts(2024, 2, 29, 12)), "YEARLY", ts(2024, 3, 1)) == ts(2028, 2, 29, 12)
+
+
+def test_next_fire_at_is_stored_as_whole_seconds():
+    start = int(ts(2026, 3, 4, 9, 30))
+    assert get_next_fire_at(start, "DAILY", ts(2026, 3, 4, 9, 31)) == int(ts(2026, 3, 5, 9, 30))
+    assert isinstance(get_next_fire_at(start, "DAILY", ts(2026, 3, 4, 9, 31)), int)
+    assert get_next_fire_at(start, "ONCE", ts(2026, 3, 4, 9, 31)) is None
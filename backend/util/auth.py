@@ -1,30 +1,61 @@
-import json
-from util.db import DBUtil
-import requests
+import hashlib
+from typing import Optional
+from util.cache import TTLCache
+from util.config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL, VERIFIED_TOKEN_TTL
+from util.http import discord_http
+from util.permissions import permissions
 
+# Keyed by a hash of the token so raw tokens are never kept in memory longer than the request needs them
+user_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+user_guilds_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+# Tokens Discord accepted, remembered far longer than the lookups above so admission control keeps telling a returning
+# user apart from a made up token
+verified_tokens = TTLCache(AUTH_CACHE_SIZE, VERIFIED_TOKEN_TTL)
 
-db = DBUtil()
 
+def _token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
 
-def is_auth(token):
-    headers = {"Authorization": token}
-    return requests.get("https://discord.com/api/v10/users/@me", headers=headers).status_code == 200
 
+async def _fetch(token, path):
+    status, data = await discord_http.get(path, token=token)
+    return data if status == 200 else None
 
-def get_user_id(token):
+
+async def get_user(token) -> Optional[dict]:
+    key = _token_key(token)
+    user = await user_cache.get_or_load(key, lambda: _fetch(token, "/users/@me"))
+    if user is not None:
+        verified_tokens.set(key, True)
+    return user
+
+
+def is_verified(token) -> bool:
+    # Whether Discord accepted the token within VERIFIED_TOKEN_TTL, answered without asking Discord
+    return _token_key(token) in verified_tokens
+
+
+async def is_auth(token):
+    return await get_user(token) is not None
+
+
+async def get_user_id(token):
     try:
-        headers = {"Authorization": token}
-        response = json.loads(requests.get("https://discord.com/api/v10/users/@me", headers=headers).content)
-        return response['id']
+        return (await get_user(token))['id']
     except Exception as e:
         print(f"Exception occurred: {e}")
         return 0
 
 
-def is_authorised_for_guild(token, guild_id):
-    return get_user_id(token) in [admin['user_id'] for admin in db.get_admins(guild_id)]
+async def is_authorised_for_guild(token, guild_id):
+    return await permissions.can_manage(str(await get_user_id(token)), guild_id)
+
+
+async def get_user_guilds(token):
+    return await user_guilds_cache.get_or_load(_token_key(token), lambda: _fetch(token, "/users/@me/guilds"))
 
 
-def get_user_guilds(token):
-    headers = {"Authorization": token}
-    return json.loads(requests.get("https://discord.com/api/v10/users/@me/guilds", headers=headers).content)
\ No newline at end of file
+def get_auth_cache_stats():
+    # members is the permission resolver's member cache, only filled in the low_memory gateway profile
+    return {"user": user_cache.stats(), "user_guilds": user_guilds_cache.stats(),
+            "members": permissions.members.stats()}
\ No newline at end of file
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class TTLCache:
+    # Bounded LRU cache whose entries expire after `ttl` seconds. get_or_load lets only one caller per key run the
+    # loader, concurrent callers for the same key wait for that result instead of repeating the work.
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._flights: dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Whether a live entry exists, without counting as a hit or miss or refreshing its recency
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._set(key, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        # None results are handed to every waiter but not stored, so a failed lookup is retried on the next call
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = asyncio.get_running_loop().create_future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            return await asyncio.shield(flight)
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting on it
+            flight.exception()
+            raise
+        else:
+            flight.set_result(value)
+            if value is not None:
+                self.set(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
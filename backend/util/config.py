@@ -0,0 +1,94 @@
+import os
+import tempfile
+from typing import Optional
+
+DB_NAME: str = os.environ.get("DB_NAME", "demo_database.db")
+# Prepared statements kept per SQLite connection
+DB_STATEMENT_CACHE_SIZE: int = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 256))
+
+# Announcements due within this many seconds are kept in the in-memory scheduler, the rest stay in the database
+ANNOUNCEMENT_HORIZON: int = int(os.environ.get("ANNOUNCEMENT_HORIZON", 600))
+# How often the horizon slides forward and the next slice of announcements is loaded
+ANNOUNCEMENT_REFILL_INTERVAL: int = int(os.environ.get("ANNOUNCEMENT_REFILL_INTERVAL", 60))
+
+# REST API admission control: token buckets per verified Authorization token and per guild (requests per second and
+# burst), while callers whose token Discord hasn't accepted yet all share one API_UNVERIFIED bucket. At most
+# API_MAX_IN_FLIGHT requests are handled at once with up to API_MAX_QUEUED more waiting at most API_QUEUE_TIMEOUT
+# seconds for a slot. Dashboard reads are turned away while the scheduler runs more than API_SHED_SCHEDULER_LAG
+# seconds late or more than API_SHED_DELIVERY_PENDING sends are queued, so they can't hold up announcements.
+API_TOKEN_RATE: float = float(os.environ.get("API_TOKEN_RATE", 10))
+API_TOKEN_BURST: float = float(os.environ.get("API_TOKEN_BURST", 40))
+API_GUILD_RATE: float = float(os.environ.get("API_GUILD_RATE", 20))
+API_GUILD_BURST: float = float(os.environ.get("API_GUILD_BURST", 80))
+API_UNVERIFIED_RATE: float = float(os.environ.get("API_UNVERIFIED_RATE", 5))
+API_UNVERIFIED_BURST: float = float(os.environ.get("API_UNVERIFIED_BURST", 20))
+API_LIMITER_KEYS: int = int(os.environ.get("API_LIMITER_KEYS", 100000))
+API_MAX_IN_FLIGHT: int = int(os.environ.get("API_MAX_IN_FLIGHT", 64))
+API_MAX_QUEUED: int = int(os.environ.get("API_MAX_QUEUED", 256))
+API_QUEUE_TIMEOUT: float = float(os.environ.get("API_QUEUE_TIMEOUT", 5))
+API_SHED_SCHEDULER_LAG: float = float(os.environ.get("API_SHED_SCHEDULER_LAG", 1))
+API_SHED_DELIVERY_PENDING: int = int(os.environ.get("API_SHED_DELIVERY_PENDING", 1000))
+
+# Compiled announcement templates kept in memory, least recently fired announcements are compiled again when needed
+TEMPLATE_CACHE_SIZE: int = int(os.environ.get("TEMPLATE_CACHE_SIZE", 10000))
+
+# Guild of a broadcast target's channel, when the channel isn't in this process's guild cache and has to be looked up
+# over REST
+CHANNEL_CACHE_SIZE: int = int(os.environ.get("CHANNEL_CACHE_SIZE", 10000))
+CHANNEL_CACHE_TTL: int = int(os.environ.get("CHANNEL_CACHE_TTL", 3600))
+
+# Operator endpoints like /metrics and /scheduler/diff only answer requests carrying "Authorization: Bearer <token>"
+# with this token, and are not found at all while it isn't set
+INTERNAL_API_TOKEN: Optional[str] = os.environ.get("INTERNAL_API_TOKEN") or None
+
+# Discord identity lookups (user and guild list per token) are cached for this many seconds
+AUTH_CACHE_TTL: int = int(os.environ.get("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_SIZE: int = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+# Tokens Discord accepted count as verified for admission control this long, as Discord's access tokens live a week
+VERIFIED_TOKEN_TTL: int = int(os.environ.get("VERIFIED_TOKEN_TTL", 604800))
+
+# Every REST call to Discord goes through the pooled client in util/http, point this at a stub server for testing
+DISCORD_API_BASE: str = os.environ.get("DISCORD_API_BASE", "https://discord.com/api/v10")
+DISCORD_HTTP_TIMEOUT: float = float(os.environ.get("DISCORD_HTTP_TIMEOUT", 10))
+DISCORD_HTTP_MAX_CONNECTIONS: int = int(os.environ.get("DISCORD_HTTP_MAX_CONNECTIONS", 100))
+DISCORD_HTTP_CONCURRENCY: int = int(os.environ.get("DISCORD_HTTP_CONCURRENCY", 50))
+
+# Announcement sends: concurrent requests, global sends per second (Discord allows 50) and retries on 429/5xx
+DELIVERY_CONCURRENCY: int = int(os.environ.get("DELIVERY_CONCURRENCY", 10))
+DELIVERY_RATE_LIMIT: float = float(os.environ.get("DELIVERY_RATE_LIMIT", 45))
+DELIVERY_MAX_ATTEMPTS: int = int(os.environ.get("DELIVERY_MAX_ATTEMPTS", 5))
+DELIVERY_MAX_BACKOFF: float = float(os.environ.get("DELIVERY_MAX_BACKOFF", 30))
+
+# The delivery outbox commits everything queued within this many seconds as one transaction
+OUTBOX_FLUSH_INTERVAL: float = float(os.environ.get("OUTBOX_FLUSH_INTERVAL", 0.005))
+# Finished deliveries are kept this long for deduplication before being pruned
+OUTBOX_RETENTION: int = int(os.environ.get("OUTBOX_RETENTION", 86400))
+
+# What to do with occurrences missed while the bot was down: "all" sends each of them (at most
+# MISSED_FIRE_MAX_PER_ANNOUNCEMENT per announcement), "latest" sends only the most recent one and "drop" sends only the
+# ones missed within the last MISSED_FIRE_MAX_AGE minutes
+MISSED_FIRE_POLICY: str = os.environ.get("MISSED_FIRE_POLICY", "latest")
+MISSED_FIRE_MAX_AGE: int = int(os.environ.get("MISSED_FIRE_MAX_AGE", 60))
+MISSED_FIRE_MAX_PER_ANNOUNCEMENT: int = int(os.environ.get("MISSED_FIRE_MAX_PER_ANNOUNCEMENT", 100))
+# Recovery reads overdue announcements in pages of this size and keeps at most RECOVERY_MAX_PENDING of the missed
+# sends queued for delivery at a time
+RECOVERY_BATCH_SIZE: int = int(os.environ.get("RECOVERY_BATCH_SIZE", 1000))
+RECOVERY_MAX_PENDING: int = int(os.environ.get("RECOVERY_MAX_PENDING", 200))
+
+# Sharded mode: with WORKER_COUNT > 1, main.py supervises that many worker processes and routes the API to them.
+# The SHARD_COUNT gateway shards are split between the workers, and each worker schedules only the guilds on its
+# shards. WORKER_INDEX is set by the supervisor for each worker it starts. Workers hold a lease row in the database
+# for their index, renewed every third of WORKER_LEASE_TTL seconds, and serve their API on a unix socket.
+SHARD_COUNT: int = int(os.environ.get("SHARD_COUNT", 1))
+WORKER_COUNT: int = int(os.environ.get("WORKER_COUNT", 1))
+WORKER_INDEX: Optional[int] = int(os.environ["WORKER_INDEX"]) if os.environ.get("WORKER_INDEX") else None
+WORKER_LEASE_TTL: float = float(os.environ.get("WORKER_LEASE_TTL", 30))
+WORKER_SOCKET_DIR: str = os.environ.get("WORKER_SOCKET_DIR", tempfile.gettempdir())
+
+# Gateway profile: "full" connects with every intent and lets discord.py cache members, presences and messages.
+# "low_memory" only asks for guild events (guild, channel and role metadata) and caches no members or messages, role
+# membership for permission checks is fetched from the REST API when needed and kept in a small LRU for
+# MEMBER_CACHE_TTL seconds instead.
+GATEWAY_PROFILE: str = os.environ.get("GATEWAY_PROFILE", "full")
+MEMBER_CACHE_SIZE: int = int(os.environ.get("MEMBER_CACHE_SIZE", 10000))
+MEMBER_CACHE_TTL: int = int(os.environ.get("MEMBER_CACHE_TTL", 300))
@@ -1,14 +1,79 @@
 import sqlite3
+import threading
+import time
 import sqlite_utils
-from typing import Optional
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+from util.config import DB_NAME, DB_STATEMENT_CACHE_SIZE, SHARD_COUNT
+from util.metrics import registry, timed
+from util.trigger_util import get_next_fire_at
+
+_local = threading.local()
+
+ANNOUNCEMENT_FIELDS = ("id", "user_id", "guild_id", "name", "channel_id", "content", "timestamp", "period",
+                       "next_fire_at")
+
+
+def get_database(db_name: str = DB_NAME) -> sqlite_utils.Database:
+    # sqlite3 connections must not be shared between threads, so every thread gets its own connection per file.
+    # Statements are prepared once per connection and reused through sqlite3's statement cache, which is why the
+    # queries below are constant strings instead of being generated per call.
+    databases = getattr(_local, "databases", None)
+    if databases is None:
+        databases = _local.databases = {}
+    db = databases.get(db_name)
+    if db is None:
+        conn = sqlite3.connect(db_name, timeout=30, cached_statements=DB_STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        db = databases[db_name] = sqlite_utils.Database(conn)
+    return db
+
+
+def _shard_of(guild_id: str) -> str:
+    # SQL for the gateway shard of a guild id column or parameter, the same mapping as shared/sharding.shard_for_guild
+    return f"(CAST({guild_id} AS INTEGER) >> 22) % {SHARD_COUNT}"
+
+
+def _in_shards(column: str, shards: Optional[list[int]]) -> str:
+    # Condition limiting a query to the given shards, with the ids inlined since they are fixed for the process
+    return "" if shards is None else f" AND {column} IN ({', '.join(str(int(shard)) for shard in shards) or 'NULL'})"
+
+
+# Every public DBUtil method is timed under its own name
+db_query_seconds = registry.histogram("db_query_seconds", "Time spent in each DBUtil method", ["method"])
 
 
 class DBUtil:
-    def __init__(self):
-        self.db_name: str = "demo_database.db"
-        self.db: sqlite_utils.Database = sqlite_utils.Database(sqlite3.connect(self.db_name, check_same_thread=False))
+    def __init__(self, db_name: str = DB_NAME):
+        self.db_name: str = db_name
+
+    @property
+    def db(self) -> sqlite_utils.Database:
+        return get_database(self.db_name)
 
+    @timed(db_query_seconds, "db_setup")
     def db_setup(self) -> None:
+        # Runs every migration newer than the version stored in the database file, see MIGRATIONS
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(self)
+            self.db.execute(f"PRAGMA user_version = {number}")
+        self._sync_shards()
+
+    def _sync_shards(self) -> None:
+        # Every row is only renumbered when SHARD_COUNT differs from the count stored at the last start, otherwise
+        # just rows written without a shard, like ones inserted outside of DBUtil, found through the shard index
+        with self._transaction():
+            stored = self.db.execute("SELECT value FROM settings WHERE key = 'shard_count'").fetchone()
+            if stored is not None and int(stored[0]) == SHARD_COUNT:
+                self.db.execute(f"UPDATE announcements SET shard = {_shard_of('guild_id')} WHERE shard IS NULL")
+                return
+            self.db.execute(f"UPDATE announcements SET shard = {_shard_of('guild_id')}")
+            self.db.execute("INSERT INTO settings (key, value) VALUES ('shard_count', ?) "
+                            "ON CONFLICT (key) DO UPDATE SET value = excluded.value", [str(SHARD_COUNT)])
+
+    def _create_tables(self) -> None:
         self.db["guilds"].create({
             "id": int,
             "guild_id": str,
@@ -37,84 +102,374 @@ class DBUtil:
             "period": str,
         }, pk="id", if_not_exists=True)
 
+    def _add_next_fire_at(self) -> None:
+        # Databases created before next_fire_at existed get the column added and filled in once
+        announcements = self.db["announcements"]
+        if "next_fire_at" not in announcements.columns_dict:
+            announcements.add_column("next_fire_at", int)
+            now = time.time()
+            with self._transaction():
+                for row in announcements.rows:
+                    announcements.update(row["id"], {
+                        "next_fire_at": get_next_fire_at(row["timestamp"], row["period"], now)})
+        announcements.create_index(["next_fire_at"], if_not_exists=True)
+
+    def _add_guild_indexes(self) -> None:
+        # (guild_id, id) also serves every lookup on guild_id alone
+        self.db["announcements"].create_index(["guild_id", "id"], if_not_exists=True)
+        self.db["admins"].create_index(["guild_id", "user_id"], if_not_exists=True)
+        self.db["admin_roles"].create_index(["guild_id", "role_id"], if_not_exists=True)
+        self.db["guilds"].create_index(["guild_id"], if_not_exists=True)
+
+    def _add_listing_indexes(self) -> None:
+        # Keyset pagination of a guild's announcements by next fire time
+        self.db["announcements"].create_index(["guild_id", "next_fire_at"], if_not_exists=True)
+
+    def _create_deliveries(self) -> None:
+        # Outbox of due occurrences, one row per (announcement, occurrence) so a resent occurrence is deduplicated
+        self.db["deliveries"].create({
+            "id": int,
+            "announcement_id": int,
+            "occurrence": int,
+            "status": str,
+            "attempts": int,
+            "updated_at": int,
+        }, pk="id", if_not_exists=True)
+        self.db["deliveries"].create_index(["announcement_id", "occurrence"], unique=True, if_not_exists=True)
+        self.db["deliveries"].create_index(["status", "updated_at"], if_not_exists=True)
+
+    def _create_worker_leases(self) -> None:
+        # One row per worker index in sharded mode, held by whichever process renewed it last before expires_at
+        self.db["worker_leases"].create({
+            "worker_id": int,
+            "owner": str,
+            "address": str,
+            "shard_ids": str,
+            "expires_at": float,
+        }, pk="worker_id", if_not_exists=True)
+
+    def _create_announcement_targets(self) -> None:
+        # Extra channels a broadcast announcement is sent to besides its own channel_id, possibly in other guilds
+        self.db["announcement_targets"].create({
+            "id": int,
+            "announcement_id": int,
+            "guild_id": str,
+            "channel_id": str,
+        }, pk="id", if_not_exists=True)
+        self.db["announcement_targets"].create_index(["announcement_id", "channel_id"], unique=True,
+                                                     if_not_exists=True)
+        self.db["announcement_targets"].create_index(["guild_id"], if_not_exists=True)
+
+    def _add_shards(self) -> None:
+        # In sharded mode a worker only reads the due, overdue and pending rows of its own gateway shards, filled in
+        # by _sync_shards
+        announcements = self.db["announcements"]
+        if "shard" not in announcements.columns_dict:
+            announcements.add_column("shard", int)
+        announcements.create_index(["shard", "next_fire_at"], if_not_exists=True)
+
+    def _add_templated(self) -> None:
+        # Whether content is a template, see shared/templates. Rows from before templates existed keep 0 and are sent
+        # as written, every content written since is a template.
+        announcements = self.db["announcements"]
+        if "templated" not in announcements.columns_dict:
+            announcements.add_column("templated", int, not_null_default=0)
+
+    def _add_delivery_targets(self) -> None:
+        # Deliveries are tracked per channel an occurrence goes to, so a broadcast replays and fails per target.
+        # Existing rows were all for the announcement's own channel.
+        deliveries = self.db["deliveries"]
+        if "channel_id" not in deliveries.columns_dict:
+            deliveries.add_column("guild_id", str)
+            deliveries.add_column("channel_id", str)
+            with self._transaction():
+                self.db.execute(
+                    "UPDATE deliveries SET "
+                    "guild_id = (SELECT guild_id FROM announcements WHERE id = deliveries.announcement_id), "
+                    "channel_id = (SELECT channel_id FROM announcements WHERE id = deliveries.announcement_id)")
+        self.db.execute("DROP INDEX IF EXISTS idx_deliveries_announcement_id_occurrence")
+        deliveries.create_index(["announcement_id", "occurrence", "channel_id"], unique=True, if_not_exists=True)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # Opened explicitly, since sqlite_utils commits a write on its own unless a transaction is already open, and
+        # sqlite3 only opens one on the first write. Commits on leaving, rolls everything back on an exception.
+        conn = self.db.conn
+        with conn:
+            conn.execute("BEGIN")
+            yield
+
+    def _create_settings(self) -> None:
+        # Values the database has to remember between starts, like the SHARD_COUNT its shards were computed for
+        self.db["settings"].create({
+            "key": str,
+            "value": str,
+        }, pk="key", if_not_exists=True)
+
+    def _write(self, sql: str, values: list) -> sqlite3.Cursor:
+        with self._transaction():
+            return self.db.execute(sql, values)
+
+    @timed(db_query_seconds, "add_guild")
     def add_guild(self, guild_id: str) -> None:
-        self.db["guilds"].insert({"guild_id": guild_id})
+        self._write("INSERT INTO guilds (guild_id) VALUES (?)", [guild_id])
 
+    @timed(db_query_seconds, "remove_guild")
     def remove_guild(self, guild_id: str) -> None:
-        where_str = f"guild_id = ?"
         where_values = [guild_id]
-        with self.db.conn:
-            self.db["guilds"].delete_where(where_str, where_values)
-            self.db["admins"].delete_where(where_str, where_values)
-            self.db["admin_roles"].delete_where(where_str, where_values)
-            self.db["announcements"].delete_where(where_str, where_values)
+        with self._transaction():
+            self.db.execute("DELETE FROM guilds WHERE guild_id = ?", where_values)
+            self.db.execute("DELETE FROM admins WHERE guild_id = ?", where_values)
+            self.db.execute("DELETE FROM admin_roles WHERE guild_id = ?", where_values)
+            self.db.execute("DELETE FROM announcement_targets WHERE guild_id = ? OR announcement_id IN "
+                            "(SELECT id FROM announcements WHERE guild_id = ?)", [guild_id, guild_id])
+            self.db.execute("DELETE FROM announcements WHERE guild_id = ?", where_values)
 
+    @timed(db_query_seconds, "get_guilds")
     def get_guilds(self) -> list[dict[str, str]]:
-        return list(self.db["guilds"].rows)
+        return list(self.db.query("SELECT * FROM guilds"))
 
+    @timed(db_query_seconds, "add_admin")
     def add_admin(self, guild_id: str, user_id: str) -> None:
-        self.db["admins"].insert({"guild_id": guild_id, "user_id": user_id})
+        self._write("INSERT INTO admins (guild_id, user_id) VALUES (?, ?)", [guild_id, user_id])
 
+    @timed(db_query_seconds, "remove_admin")
     def remove_admin(self, guild_id: str, user_id: str) -> None:
-        where_str = f"guild_id = ? AND user_id = ?"
-        where_values = [guild_id, user_id]
-        with self.db.conn:
-            self.db["admins"].delete_where(where_str, where_values)
+        self._write("DELETE FROM admins WHERE guild_id = ? AND user_id = ?", [guild_id, user_id])
 
+    @timed(db_query_seconds, "get_admins")
     def get_admins(self, guild_id: str) -> list[dict[str, int]]:
-        where_str = f"guild_id = ?"
-        where_values = [guild_id]
-        return list(self.db["admins"].rows_where(where_str, where_values))
+        return list(self.db.query("SELECT * FROM admins WHERE guild_id = ?", [guild_id]))
 
+    @timed(db_query_seconds, "add_admin_role")
     def add_admin_role(self, guild_id: str, role_id: str) -> None:
-        self.db["admin_roles"].insert({"guild_id": guild_id, "role_id": role_id})
+        self._write("INSERT INTO admin_roles (guild_id, role_id) VALUES (?, ?)", [guild_id, role_id])
 
+    @timed(db_query_seconds, "remove_admin_role")
     def remove_admin_role(self, guild_id: str, role_id: str) -> None:
-        where_str = f"guild_id = ? AND role_id = ?"
-        where_values = [guild_id, role_id]
-        with self.db.conn:
-            self.db["admin_roles"].delete_where(where_str, where_values)
+        self._write("DELETE FROM admin_roles WHERE guild_id = ? AND role_id = ?", [guild_id, role_id])
 
+    @timed(db_query_seconds, "get_admin_roles")
     def get_admin_roles(self, guild_id: str) -> list[dict[str, str]]:
-        where_str = f"guild_id = ?"
-        where_values = [guild_id]
-        return list(self.db["admin_roles"].rows_where(where_str, where_values))
+        return list(self.db.query("SELECT * FROM admin_roles WHERE guild_id = ?", [guild_id]))
 
+    @timed(db_query_seconds, "add_announcement")
     def add_announcement(self, guild_id: str, user_id: str, channel_id: str, name: str, content: str, timestamp: int,
-                         period: str) -> int:
-        return self.db["announcements"].insert({
-            "guild_id": guild_id,
-            "user_id": user_id,
-            "channel_id": channel_id,
-            "name": name,
-            "content": content,
-            "timestamp": timestamp,
-            "period": period,
-        }).last_pk
+                         period: str, targets: Optional[list[tuple[str, str]]] = None) -> int:
+        # The row and its broadcast targets are written in one transaction
+        with self._transaction():
+            announcement_id = self.db.execute(
+                "INSERT INTO announcements (guild_id, user_id, channel_id, name, content, timestamp, period, "
+                f"next_fire_at, shard, templated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, {_shard_of('?')}, 1)",
+                [guild_id, user_id, channel_id, name, content, timestamp, period,
+                 get_next_fire_at(timestamp, period, time.time()), guild_id]).lastrowid
+            if targets:
+                self._replace_targets(announcement_id, targets)
+        return announcement_id
 
+    @timed(db_query_seconds, "remove_announcement")
     def remove_announcement(self, announcement_id: int) -> None:
-        self.db["announcements"].delete(announcement_id)
+        with self._transaction():
+            self.db.execute("DELETE FROM announcement_targets WHERE announcement_id = ?", [announcement_id])
+            self.db.execute("DELETE FROM announcements WHERE id = ?", [announcement_id])
+
+    def _replace_targets(self, announcement_id: int, targets: list[tuple[str, str]]) -> None:
+        self.db.execute("DELETE FROM announcement_targets WHERE announcement_id = ?", [announcement_id])
+        self.db.conn.executemany(
+            "INSERT OR IGNORE INTO announcement_targets (announcement_id, guild_id, channel_id) VALUES (?, ?, ?)",
+            [(announcement_id, guild_id, channel_id) for guild_id, channel_id in targets])
 
+    @timed(db_query_seconds, "get_announcement_targets")
+    def get_announcement_targets(self, announcement_ids: list[int]) -> dict[int, list[tuple[str, str]]]:
+        # (guild_id, channel_id) of every extra target per announcement, announcements without any are left out.
+        # Looked up in chunks like get_announcements_by_ids.
+        targets: dict[int, list[tuple[str, str]]] = {}
+        for start in range(0, len(announcement_ids), 500):
+            chunk = announcement_ids[start:start + 500]
+            for announcement_id, guild_id, channel_id in self.db.execute(
+                    "SELECT announcement_id, guild_id, channel_id FROM announcement_targets "
+                    f"WHERE announcement_id IN ({', '.join('?' * len(chunk))}) ORDER BY id", chunk).fetchall():
+                targets.setdefault(announcement_id, []).append((guild_id, channel_id))
+        return targets
+
+    @timed(db_query_seconds, "get_announcement")
     def get_announcement(self, guild_id: str, announcement_id: int) -> dict[str, int]:
-        where_str = f"guild_id = ? AND id = ?"
-        where_values = [guild_id, announcement_id]
-        return list(self.db["announcements"].rows_where(where_str, where_values))[0]
+        return list(self.db.query("SELECT * FROM announcements WHERE guild_id = ? AND id = ?",
+                                  [guild_id, announcement_id]))[0]
 
+    @timed(db_query_seconds, "get_announcements")
     def get_announcements(self, guild_id: str) -> list[dict[str, int]]:
-        where_str = f"guild_id = ?"
-        where_values = [guild_id]
-        return list(self.db["announcements"].rows_where(where_str, where_values))
+        return list(self.db.query("SELECT * FROM announcements WHERE guild_id = ?", [guild_id]))
 
+    @timed(db_query_seconds, "iter_announcements")
+    def iter_announcements(self, guild_id: str, fields: Optional[list[str]] = None, order: str = "id",
+                           after: Optional[tuple[int, ...]] = None, limit: Optional[int] = None,
+                           channel_id: Optional[str] = None, period: Optional[str] = None,
+                           until: Optional[int] = None, page_size: int = 500) -> Iterator[list[dict[str, int]]]:
+        # Yields pages of a guild's announcements, so a listing never holds the whole guild in memory. Rows are keyset
+        # ordered by id or by (next_fire_at, id), and `after` is the last key already seen. Every page is its own query
+        # continuing after the previous page's last key, so no cursor stays open while the caller awaits in between.
+        # The key columns are always selected, whatever `fields` asks for, so the caller can build the next cursor.
+        fields = list(fields or ANNOUNCEMENT_FIELDS)
+        if any(field not in ANNOUNCEMENT_FIELDS for field in fields):
+            raise ValueError("Unknown announcement field")
+        if order not in ("id", "next_fire_at"):
+            raise ValueError(f"Unknown order '{order}'")
+        keys = ["id"] if order == "id" else ["next_fire_at", "id"]
+        where, values = ["guild_id = ?"], [guild_id]
+        if order == "next_fire_at" or until is not None:
+            where.append("next_fire_at IS NOT NULL")
+        if channel_id is not None:
+            where.append("channel_id = ?")
+            values.append(channel_id)
+        if period is not None:
+            where.append("period = ?")
+            values.append(period)
+        if until is not None:
+            where.append("next_fire_at <= ?")
+            values.append(until)
+        columns = ", ".join(fields + [key for key in keys if key not in fields])
+        keyset = "id > ?" if order == "id" else "(next_fire_at > ? OR (next_fire_at = ? AND id > ?))"
+        while limit is None or limit > 0:
+            page_where, page_values = list(where), list(values)
+            if after is not None:
+                page_where.append(keyset)
+                page_values.extend([after[0]] if order == "id" else [after[0], after[0], after[1]])
+            size = page_size if limit is None else min(page_size, limit)
+            page = list(self.db.query(f"SELECT {columns} FROM announcements WHERE {' AND '.join(page_where)} "
+                                      f"ORDER BY {', '.join(keys)} LIMIT ?", page_values + [size]))
+            if page:
+                yield page
+            if len(page) < size:
+                return
+            after = tuple(page[-1][key] for key in keys)
+            if limit is not None:
+                limit -= len(page)
+
+    @timed(db_query_seconds, "get_all_announcements")
     def get_all_announcements(self) -> list[dict[str, int]]:
-        return list(self.db["announcements"].rows)
+        return list(self.db.query("SELECT * FROM announcements"))
+
+    @timed(db_query_seconds, "get_due_announcements")
+    def get_due_announcements(self, until: int, after: Optional[int] = None,
+                              shards: Optional[list[int]] = None) -> list[dict[str, int]]:
+        # Served from the next_fire_at index, or the (shard, next_fire_at) one for a worker's `shards`, so only the
+        # rows inside the window are read
+        if after is None:
+            return list(self.db.query(
+                f"SELECT * FROM announcements WHERE next_fire_at <= ?{_in_shards('shard', shards)} "
+                "ORDER BY next_fire_at", [until]))
+        return list(self.db.query(
+            f"SELECT * FROM announcements WHERE next_fire_at > ? AND next_fire_at <= ?{_in_shards('shard', shards)} "
+            "ORDER BY next_fire_at", [after, until]))
+
+    @timed(db_query_seconds, "remove_expired_announcements")
+    def remove_expired_announcements(self) -> int:
+        # ONCE announcements whose minute passed without being sent never fire again and are left with a NULL
+        # next_fire_at, see get_next_fire_time. Sent ones are removed by the outbox instead, ones whose send failed are
+        # kept together with their failed delivery, and ones whose send is still pending are left for it.
+        expired = ("SELECT id FROM announcements a WHERE next_fire_at IS NULL AND period = 'ONCE' AND NOT EXISTS "
+                   "(SELECT 1 FROM deliveries d WHERE d.announcement_id = a.id AND d.status != 'sent')")
+        with self._transaction():
+            self.db.execute(f"DELETE FROM announcement_targets WHERE announcement_id IN ({expired})")
+            return self.db.execute(f"DELETE FROM announcements WHERE id IN ({expired})").rowcount
+
+    @timed(db_query_seconds, "has_delivery")
+    def has_delivery(self, announcement_id: int, occurrence: int) -> bool:
+        return self.db.execute("SELECT 1 FROM deliveries WHERE announcement_id = ? AND occurrence = ?",
+                               [announcement_id, occurrence]).fetchone() is not None
+
+    @timed(db_query_seconds, "count_due_announcements")
+    def count_due_announcements(self, since: int, until: int) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM announcements WHERE next_fire_at >= ? AND next_fire_at <= ?",
+                               [since, until]).fetchone()[0]
 
+    @timed(db_query_seconds, "iter_upcoming_announcements")
+    def iter_upcoming_announcements(self, until: int, guild_id: Optional[str] = None,
+                                    page_size: int = 1000) -> Iterator[list[dict[str, int]]]:
+        # Pages of the announcements with an occurrence before `until`, keyset ordered by (next_fire_at, id) like
+        # iter_announcements, so no cursor stays open while the caller awaits between pages. Read through the
+        # (guild_id, next_fire_at) index for one guild and the next_fire_at index across all of them.
+        where, values = ["next_fire_at IS NOT NULL", "next_fire_at < ?"], [until]
+        if guild_id is not None:
+            where.append("guild_id = ?")
+            values.append(guild_id)
+        after = None
+        while True:
+            page_where, page_values = list(where), list(values)
+            if after is not None:
+                page_where.append("(next_fire_at > ? OR (next_fire_at = ? AND id > ?))")
+                page_values.extend([after[0], after[0], after[1]])
+            page = list(self.db.query(
+                "SELECT id, guild_id, channel_id, name, timestamp, period, next_fire_at FROM announcements "
+                f"WHERE {' AND '.join(page_where)} ORDER BY next_fire_at, id LIMIT ?", page_values + [page_size]))
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after = (page[-1]["next_fire_at"], page[-1]["id"])
+
+    @timed(db_query_seconds, "get_overdue_announcements")
+    def get_overdue_announcements(self, now: int, after: tuple[int, int], limit: int,
+                                  shards: Optional[list[int]] = None) -> list[dict[str, int]]:
+        # Keyset pagination on (next_fire_at, id), which the next_fire_at index already orders by
+        return list(self.db.query(
+            "SELECT * FROM announcements "
+            "WHERE next_fire_at < ? AND (next_fire_at > ? OR (next_fire_at = ? AND id > ?))"
+            f"{_in_shards('shard', shards)} ORDER BY next_fire_at, id LIMIT ?",
+            [now, after[0], after[0], after[1], limit]))
+
+    @timed(db_query_seconds, "get_announcements_by_ids")
+    def get_announcements_by_ids(self, guild_id: str, announcement_ids: list[int]) -> list[dict[str, int]]:
+        # Looked up in chunks to stay below SQLite's bound parameter limit
+        rows = []
+        for start in range(0, len(announcement_ids), 500):
+            chunk = announcement_ids[start:start + 500]
+            rows.extend(self.db.query(
+                f"SELECT * FROM announcements WHERE guild_id = ? AND id IN ({', '.join('?' * len(chunk))})",
+                [guild_id, *chunk]))
+        return rows
+
+    @timed(db_query_seconds, "apply_announcement_batch")
+    def apply_announcement_batch(self, guild_id: str, created: list[tuple], updated: list[tuple],
+                                 removed: list[int], created_targets: Optional[list[list[tuple[str, str]]]] = None,
+                                 updated_targets: Optional[dict[int, list[tuple[str, str]]]] = None) -> list[int]:
+        # Creates, updates and deletes of a bulk request in one transaction, so the whole batch costs one commit and
+        # either lands completely or not at all. Returns the ids of the created rows in order. Rows are
+        # (user_id, channel_id, name, content, timestamp, period, next_fire_at), updates carry the id last.
+        # Broadcast targets come in order for the created rows and by id for the updated rows whose targets change.
+        with self._transaction():
+            ids = [self.db.execute(
+                "INSERT INTO announcements (guild_id, user_id, channel_id, name, content, timestamp, period, "
+                f"next_fire_at, shard, templated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, {_shard_of('?')}, 1)",
+                [guild_id, *row, guild_id]).lastrowid for row in created]
+            # Untouched content of a row from before templates stays as it is
+            self.db.conn.executemany(
+                "UPDATE announcements SET templated = (templated OR content IS NOT ?), user_id = ?, channel_id = ?, "
+                "name = ?, content = ?, timestamp = ?, period = ?, next_fire_at = ? WHERE id = ? AND guild_id = ?",
+                [(row[3], *row, guild_id) for row in updated])
+            for announcement_id, targets in [*zip(ids, created_targets or []), *(updated_targets or {}).items()]:
+                self._replace_targets(announcement_id, targets)
+            self.db.conn.executemany("DELETE FROM announcement_targets WHERE announcement_id = ?",
+                                     [(announcement_id,) for announcement_id in removed])
+            self.db.conn.executemany("DELETE FROM announcements WHERE id = ? AND guild_id = ?",
+                                     [(announcement_id, guild_id) for announcement_id in removed])
+        return ids
+
+    @timed(db_query_seconds, "set_next_fire_at")
+    def set_next_fire_at(self, announcement_id: int, next_fire_at: Optional[int]) -> None:
+        self._write("UPDATE announcements SET next_fire_at = ? WHERE id = ?", [next_fire_at, announcement_id])
+
+    @timed(db_query_seconds, "update_announcement")
     def update_announcement(self, announcement_id: int,
                             user_id: str,
                             channel_id: Optional[str] = None,
                             content: Optional[str] = None,
                             timestamp: Optional[int] = None,
-                            period: Optional[str] = None) -> None:
-        if not (channel_id or content or timestamp or period):
+                            period: Optional[str] = None,
+                            targets: Optional[list[tuple[str, str]]] = None) -> None:
+        # `targets` replaces the broadcast targets in the same transaction as the row, None leaves them as they are
+        if not (channel_id or content or timestamp or period or targets is not None):
             return
         update_data: dict[str, Optional[str | int]] = {"user_id": user_id}
         if channel_id:
@@ -125,4 +480,90 @@ class DBUtil:
             update_data["timestamp"] = timestamp
         if period:
             update_data["period"] = period
-        self.db["announcements"].update(announcement_id, update_data)
+        current = self.db["announcements"].get(announcement_id)
+        if content and content != current["content"]:
+            # Untouched content of a row from before templates stays as it is
+            update_data["templated"] = 1
+        if timestamp or period:
+            update_data["next_fire_at"] = get_next_fire_at(timestamp or current["timestamp"],
+                                                           period or current["period"], time.time())
+        with self._transaction():
+            self.db.execute(f"UPDATE announcements SET {', '.join(f'{column} = ?' for column in update_data)} "
+                            "WHERE id = ?", [*update_data.values(), announcement_id])
+            if targets is not None:
+                self._replace_targets(announcement_id, targets)
+
+    @timed(db_query_seconds, "apply_delivery_batch")
+    def apply_delivery_batch(self, due: list[tuple[int, int, str, str, int]],
+                             statuses: list[tuple[str, int, int, int, int, str]],
+                             next_fire_ats: list[tuple[Optional[int], int]], removed: list[tuple[int]],
+                             lease: Optional[tuple[int, str]] = None) -> None:
+        # One transaction, and so one commit, for everything the outbox writer collected since its last flush. With a
+        # (worker id, owner) `lease` the batch is only written while that lease still holds: touching the lease row
+        # first takes the write lock, so no other process can take the lease over before the commit.
+        with self._transaction():
+            if lease is not None and self.db.execute(
+                    "UPDATE worker_leases SET expires_at = expires_at WHERE worker_id = ? AND owner = ? "
+                    "AND expires_at >= ?", [*lease, time.time()]).rowcount != 1:
+                raise RuntimeError(f"Worker {lease[0]} no longer holds its lease")
+            self.db.conn.executemany(
+                "INSERT OR IGNORE INTO deliveries (announcement_id, occurrence, guild_id, channel_id, status, attempts, "
+                "updated_at) VALUES (?, ?, ?, ?, 'pending', 0, ?)", due)
+            self.db.conn.executemany(
+                "UPDATE deliveries SET status = ?, attempts = ?, updated_at = ? "
+                "WHERE announcement_id = ? AND occurrence = ? AND channel_id = ?", statuses)
+            self.db.conn.executemany("UPDATE announcements SET next_fire_at = ? WHERE id = ?", next_fire_ats)
+            self.db.conn.executemany("DELETE FROM announcement_targets WHERE announcement_id = ?", removed)
+            self.db.conn.executemany("DELETE FROM announcements WHERE id = ?", removed)
+
+    @timed(db_query_seconds, "get_pending_deliveries")
+    def get_pending_deliveries(self, shards: Optional[list[int]] = None) -> list[dict[str, int]]:
+        # One row per channel still waiting for an occurrence, the channel as target_guild_id and target_channel_id
+        return list(self.db.query(
+            "SELECT d.announcement_id, d.occurrence, d.guild_id AS target_guild_id, d.channel_id AS target_channel_id, "
+            "a.guild_id, a.channel_id, a.content, a.templated, a.timestamp, a.period "
+            "FROM deliveries d JOIN announcements a ON a.id = d.announcement_id "
+            f"WHERE d.status = 'pending'{_in_shards('a.shard', shards)} ORDER BY d.occurrence, d.id"))
+
+    @timed(db_query_seconds, "prune_deliveries")
+    def prune_deliveries(self, before: int) -> None:
+        # Failed deliveries of ONCE announcements stay as long as the announcement, see remove_expired_announcements
+        self._write("DELETE FROM deliveries WHERE status != 'pending' AND updated_at < ? AND NOT (status = 'failed' "
+                    "AND announcement_id IN (SELECT id FROM announcements WHERE period = 'ONCE'))", [before])
+
+    @timed(db_query_seconds, "acquire_worker_lease")
+    def acquire_worker_lease(self, worker_id: int, owner: str, address: str, shard_ids: str, ttl: float) -> bool:
+        # Takes or renews the lease of a worker index. Only succeeds when the lease is free, expired or already held
+        # by `owner`, so two processes never run the same shards. The upsert makes check and write one statement.
+        now = time.time()
+        return self._write(
+            "INSERT INTO worker_leases (worker_id, owner, address, shard_ids, expires_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (worker_id) DO UPDATE SET owner = excluded.owner, address = excluded.address, "
+            "shard_ids = excluded.shard_ids, expires_at = excluded.expires_at "
+            "WHERE worker_leases.owner = excluded.owner OR worker_leases.expires_at < ?",
+            [worker_id, owner, address, shard_ids, now + ttl, now]).rowcount == 1
+
+    @timed(db_query_seconds, "release_worker_lease")
+    def release_worker_lease(self, worker_id: int, owner: str) -> None:
+        self._write("DELETE FROM worker_leases WHERE worker_id = ? AND owner = ?", [worker_id, owner])
+
+    @timed(db_query_seconds, "get_worker_leases")
+    def get_worker_leases(self) -> list[dict[str, str | int | float]]:
+        return list(self.db.query("SELECT * FROM worker_leases WHERE expires_at >= ? ORDER BY worker_id",
+                                  [time.time()]))
+
+
+# Schema versions in order, the database's PRAGMA user_version records how many of them have been applied
+MIGRATIONS: list[Callable[[DBUtil], None]] = [
+    DBUtil._create_tables,
+    DBUtil._add_next_fire_at,
+    DBUtil._add_guild_indexes,
+    DBUtil._create_deliveries,
+    DBUtil._add_listing_indexes,
+    DBUtil._create_worker_leases,
+    DBUtil._create_announcement_targets,
+    DBUtil._add_shards,
+    DBUtil._add_templated,
+    DBUtil._add_delivery_targets,
+    DBUtil._create_settings,
+]
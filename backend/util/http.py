@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, Optional
+import aiohttp
+from util.config import (DISCORD_API_BASE, DISCORD_HTTP_CONCURRENCY, DISCORD_HTTP_MAX_CONNECTIONS,
+                         DISCORD_HTTP_TIMEOUT)
+
+
+class DiscordHTTPClient:
+    # One keep-alive connection pool for every REST call the backend makes to Discord. Requests are capped at
+    # `max_concurrency` in flight, and Discord's rate limit headers are tracked per bucket and per token so that
+    # callers wait for a bucket to reset instead of running into 429s. `base_url` can point at a local stub server.
+    def __init__(self, base_url: str = DISCORD_API_BASE, max_connections: int = DISCORD_HTTP_MAX_CONNECTIONS,
+                 max_concurrency: int = DISCORD_HTTP_CONCURRENCY, timeout: float = DISCORD_HTTP_TIMEOUT,
+                 max_retries: int = 3):
+        self.base_url: str = base_url.rstrip("/")
+        self.max_connections: int = max_connections
+        self.max_concurrency: int = max_concurrency
+        self.timeout: float = timeout
+        self.max_retries: int = max_retries
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # (token key, method, path) -> bucket hash reported by Discord
+        self._routes: dict[tuple[str, str, str], str] = {}
+        # (token key, bucket) -> time at which the bucket has requests left again
+        self._bucket_resets: dict[tuple[str, str], float] = {}
+        # token key -> time at which the global rate limit for that token is lifted
+        self._global_resets: dict[str, float] = {}
+        self._pruned_at: float = time.monotonic()
+
+    async def start(self) -> None:
+        if self.session is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             headers={"User-Agent": "DiscordAnnouncer (aiohttp)"})
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method: str, path: str, token: Optional[str] = None,
+                      json: Optional[Any] = None) -> tuple[int, Any]:
+        await self.start()
+        token_key = hashlib.sha256(token.encode()).hexdigest() if token else ""
+        route = (token_key, method, path)
+        headers = {"Authorization": token} if token else {}
+        status, data = 0, None
+        for _ in range(self.max_retries + 1):
+            await self._wait_for_route(route)
+            async with self._semaphore:
+                async with self.session.request(method, self.base_url + path, headers=headers,
+                                                json=json) as response:
+                    status = response.status
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        data = None
+                    self._update_bucket(route, response.headers)
+            if status != 429:
+                return status, data
+            self._handle_rate_limit(route, response.headers, data)
+        return status, data
+
+    async def get(self, path: str, token: Optional[str] = None) -> tuple[int, Any]:
+        return await self.request("GET", path, token=token)
+
+    async def _wait_for_route(self, route: tuple[str, str, str]) -> None:
+        if time.monotonic() - self._pruned_at > 60:
+            self._prune()
+        token_key = route[0]
+        reset_at = self._global_resets.get(token_key, 0)
+        bucket = self._routes.get(route)
+        if bucket is not None:
+            reset_at = max(reset_at, self._bucket_resets.get((token_key, bucket), 0))
+        delay = reset_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _prune(self) -> None:
+        # Resets that already passed don't hold anything back, and a route is only worth remembering while its
+        # bucket is waiting for a reset, so neither grows with every token and path ever seen
+        now = self._pruned_at = time.monotonic()
+        self._bucket_resets = {key: reset_at for key, reset_at in self._bucket_resets.items() if reset_at > now}
+        self._global_resets = {key: reset_at for key, reset_at in self._global_resets.items() if reset_at > now}
+        self._routes = {route: bucket for route, bucket in self._routes.items()
+                        if (route[0], bucket) in self._bucket_resets}
+
+    def _update_bucket(self, route: tuple[str, str, str], headers) -> None:
+        bucket = headers.get("X-RateLimit-Bucket")
+        if bucket is None:
+            return
+        self._routes[route] = bucket
+        key = (route[0], bucket)
+        if headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset-After"):
+            self._bucket_resets[key] = time.monotonic() + float(headers["X-RateLimit-Reset-After"])
+        else:
+            self._bucket_resets.pop(key, None)
+
+    def _handle_rate_limit(self, route: tuple[str, str, str], headers, data: Any) -> None:
+        body = data if isinstance(data, dict) else {}
+        retry_after = float(body.get("retry_after") or headers.get("Retry-After") or 1)
+        reset_at = time.monotonic() + retry_after
+        if body.get("global") or headers.get("X-RateLimit-Global"):
+            self._global_resets[route[0]] = reset_at
+            return
+        bucket = self._routes.get(route)
+        if bucket is None:
+            bucket = self._routes[route] = f"{route[1]} {route[2]}"
+        self._bucket_resets[(route[0], bucket)] = reset_at
+
+
+discord_http = DiscordHTTPClient()
@@ -0,0 +1,212 @@
+import bisect
+import functools
+import inspect
+import json
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+# Upper bounds in seconds, for request and query timings and for how late an announcement went out
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    type: str = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (),
+                 callback: Optional[Callable[[], float | dict[tuple, float]]] = None):
+        self.name: str = name
+        self.help: str = help
+        self.labels: tuple[str, ...] = tuple(labels)
+        # Read at scrape time instead of being updated on the hot path, returns a value or {label values: value}
+        self.callback = callback
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def values(self) -> dict[tuple, float]:
+        if self.callback is None:
+            return dict(self._values)
+        value = self.callback()
+        return value if isinstance(value, dict) else {(): value}
+
+    def samples(self) -> list[tuple[str, tuple[str, ...], tuple, float]]:
+        return [(self.name, self.labels, key, value) for key, value in sorted(self.values().items())]
+
+    def as_json(self) -> list[dict]:
+        return [{"labels": dict(zip(self.labels, key)), "value": value}
+                for key, value in sorted(self.values().items())]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets: tuple[float, ...] = buckets
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _snapshot(self) -> list[tuple[tuple, list[float]]]:
+        with self._lock:
+            return sorted((key, list(series)) for key, series in self._series.items())
+
+    def samples(self) -> list[tuple[str, tuple[str, ...], tuple, float]]:
+        samples = []
+        for key, series in self._snapshot():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", (*self.labels, "le"), (*key, bound), cumulative))
+            samples.append((f"{self.name}_sum", self.labels, key, series[-1]))
+            samples.append((f"{self.name}_count", self.labels, key, cumulative))
+        return samples
+
+    def quantile(self, series: list[float], q: float) -> Optional[float]:
+        # Linear interpolation inside the bucket the quantile falls in, like Prometheus' histogram_quantile
+        counts = series[:-1]
+        total = sum(counts)
+        if not total:
+            return None
+        rank, cumulative, lower = q * total, 0, 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.buckets[-1]
+
+    def as_json(self) -> list[dict]:
+        return [{"labels": dict(zip(self.labels, key)), "count": sum(series[:-1]), "sum": series[-1],
+                 "p50": self.quantile(series, 0.5), "p90": self.quantile(series, 0.9),
+                 "p99": self.quantile(series, 0.99)} for key, series in self._snapshot()]
+
+
+class Registry:
+    # Every metric registers itself here by name. Collecting costs a dict update under a lock on the hot path, anything
+    # that can be read off existing state (queue lengths, cache counters) is a callback evaluated only when scraped.
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        # Registering the same name again replaces the metric, so callbacks can be rebound to new objects
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = (), callback=None) -> Counter:
+        return self._register(Counter(name, help, labels, callback))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = (), callback=None) -> Gauge:
+        return self._register(Gauge(name, help, labels, callback))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{_labels(names, key)} {value}" for name, names, key, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def as_json(self) -> str:
+        data = {}
+        for metric in self.metrics.values():
+            try:
+                data[metric.name] = {"type": metric.type, "help": metric.help, "values": metric.as_json()}
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {e}")
+        return json.dumps(data)
+
+
+registry = Registry()
+
+
+def timed(histogram: Histogram, *labels) -> Callable:
+    # Observes how long each call takes. For generator functions that's the time spent producing items, summed into
+    # one observation once the caller is done with the generator, the time the caller spends between items left out.
+    def decorator(f):
+        if inspect.isgeneratorfunction(f):
+            @functools.wraps(f)
+            def generator(*args, **kwargs):
+                iterator = f(*args, **kwargs)
+                elapsed = 0.0
+                try:
+                    while True:
+                        started = time.perf_counter()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += time.perf_counter() - started
+                        yield item
+                finally:
+                    iterator.close()
+                    histogram.observe(elapsed, *labels)
+
+            return generator
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+
+        return wrapper
+
+    return decorator
+
+
+def resident_memory_bytes() -> int:
+    # Current RSS of this process, 0 where /proc isn't available
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
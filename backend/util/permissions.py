@@ -0,0 +1,101 @@
+from typing import Optional
+import discord
+from util.cache import TTLCache
+from util.config import MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL
+from util.db import DBUtil
+
+
+class PermissionResolver:
+    # Answers "can user X manage guild Y" from memory: the guild's admin user ids and admin role ids are loaded from
+    # the database once and kept until an admin or admin role write invalidates them, and role membership comes from
+    # the bot's member cache. Decisions are memoised per guild and user until the member, the guild or its admins
+    # change, and negative ones also until a member joins or a role of the guild changes.
+    # Without a member cache (the low_memory gateway profile) a member's roles are fetched from Discord and kept in
+    # `members` for MEMBER_CACHE_TTL seconds, and decisions based on them aren't memoised, so they expire with it.
+    def __init__(self, db: DBUtil, max_decisions: int = 100000):
+        self.db: DBUtil = db
+        self.bot: Optional[discord.Client] = None
+        self.max_decisions: int = max_decisions
+        self.members: TTLCache = TTLCache(MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL)
+        self._admins: dict[str, set[str]] = {}
+        self._admin_roles: dict[str, set[str]] = {}
+        self._decisions: dict[str, dict[str, bool]] = {}
+        self._decision_count: int = 0
+
+    def get_admins(self, guild_id: str) -> set[str]:
+        admins = self._admins.get(guild_id)
+        if admins is None:
+            admins = self._admins[guild_id] = {str(admin["user_id"]) for admin in self.db.get_admins(guild_id)}
+        return admins
+
+    def get_admin_roles(self, guild_id: str) -> set[str]:
+        roles = self._admin_roles.get(guild_id)
+        if roles is None:
+            roles = self._admin_roles[guild_id] = {str(role["role_id"]) for role in self.db.get_admin_roles(guild_id)}
+        return roles
+
+    async def can_manage(self, user_id: str, guild_id: str) -> bool:
+        guild_id, user_id = str(guild_id), str(user_id)
+        decision = self._decisions.get(guild_id, {}).get(user_id)
+        if decision is None:
+            decision, memoise = await self._resolve(guild_id, user_id)
+            if memoise:
+                if self._decision_count >= self.max_decisions:
+                    self._decisions.clear()
+                    self._decision_count = 0
+                self._decisions.setdefault(guild_id, {})[user_id] = decision
+                self._decision_count += 1
+        return decision
+
+    async def _resolve(self, guild_id: str, user_id: str) -> tuple[bool, bool]:
+        # Returns the decision and whether it can be memoised until the next invalidation
+        if user_id in self.get_admins(guild_id):
+            return True, True
+        admin_roles = self.get_admin_roles(guild_id)
+        if not admin_roles or self.bot is None:
+            return False, True
+        guild = self.bot.get_guild(int(guild_id))
+        if guild is None:
+            return False, True
+        member = guild.get_member(int(user_id))
+        if member is not None:
+            return any(str(role.id) in admin_roles for role in member.roles), True
+        if self.bot.intents.members:
+            # The member cache is complete, so the user isn't in the guild
+            return False, True
+        roles = await self.members.get_or_load((guild_id, user_id), lambda: self._fetch_member_roles(guild, user_id))
+        return roles is not None and not roles.isdisjoint(admin_roles), False
+
+    async def _fetch_member_roles(self, guild: discord.Guild, user_id: str) -> Optional[frozenset[str]]:
+        try:
+            member = await guild.fetch_member(int(user_id))
+        except discord.NotFound:
+            return frozenset()
+        except discord.HTTPException as e:
+            # Not cached, so the next check asks again
+            print(f"Error fetching member {user_id} of guild {guild.id}: {e}")
+            return None
+        return frozenset(str(role.id) for role in member.roles)
+
+    def invalidate_guild(self, guild_id: int | str) -> None:
+        guild_id = str(guild_id)
+        self._admins.pop(guild_id, None)
+        self._admin_roles.pop(guild_id, None)
+        self._decision_count -= len(self._decisions.pop(guild_id, ()))
+
+    def invalidate_denials(self, guild_id: int | str) -> None:
+        # A new or changed role can make a member an admin, granted decisions stay as they are
+        decisions = self._decisions.get(str(guild_id))
+        if decisions:
+            for user_id in [user_id for user_id, decision in decisions.items() if not decision]:
+                del decisions[user_id]
+                self._decision_count -= 1
+
+    def invalidate_member(self, guild_id: int | str, user_id: int | str) -> None:
+        decisions = self._decisions.get(str(guild_id))
+        if decisions is not None and decisions.pop(str(user_id), None) is not None:
+            self._decision_count -= 1
+        self.members.invalidate((str(guild_id), str(user_id)))
+
+
+permissions = PermissionResolver(DBUtil())
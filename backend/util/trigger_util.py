@@ -1,24 +1,152 @@
-from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime
-
-
-def get_trigger(timestamp, period):
-    td = datetime.fromtimestamp(timestamp)
-    # td.weekday returns 0 for monday and 6 for sunday but cron uses 1 for monday and 7 for sunday, so we add 1
-    year, month, day_of_week, day, hour, minute = td.year, td.month, td.weekday() + 1, td.day, td.hour, td.minute
-    match period:
-        case "YEARLY":
-            trigger = CronTrigger(month=month, day=day, hour=hour, minute=minute, start_date=td)
-        case "MONTHLY":
-            trigger = CronTrigger(day=day, hour=hour, minute=minute, start_date=td)
-        case "WEEKLY":
-            trigger = CronTrigger(day_of_week=day_of_week, hour=hour, minute=minute, start_date=td)
-        case "DAILY":
-            trigger = CronTrigger(hour=hour, minute=minute, start_date=td)
-        case "HOURLY":
-            trigger = CronTrigger(minute=minute, start_date=td)
-        case "MINUTELY":
-            trigger = CronTrigger(second=0, start_date=td)
-        case "ONCE":
-            trigger = CronTrigger(year=year, month=month, day=day, hour=hour, minute=minute)
-    return trigger
+import calendar
+from datetime import datetime, timedelta
+from typing import Optional
+
+PERIODS = ("YEARLY", "MONTHLY", "WEEKLY", "DAILY", "HOURLY", "MINUTELY", "ONCE")
+
+# Longest possible gap in seconds between two occurrences of each period, allowing for DST shifts, skipped month
+# days and February 29th
+PERIOD_SPANS = {
+    "YEARLY": 8 * 366 * 86400,
+    "MONTHLY": 62 * 86400,
+    "WEEKLY": 7 * 86400 + 3600,
+    "DAILY": 86400 + 3600,
+    "HOURLY": 7200,
+    "MINUTELY": 60,
+    "ONCE": 0,
+}
+
+
+def get_next_fire_time(timestamp: int, period: str, now: float) -> Optional[float]:
+    # Returns the first occurrence at or after `now` as a unix timestamp, or None if the announcement never fires
+    # again. Occurrences are computed on local wall-clock time with second=0, the same way the old CronTriggers did:
+    # recurring announcements start at `timestamp`, ONCE announcements fire on the minute of `timestamp`.
+    td = datetime.fromtimestamp(timestamp)
+    base = td.replace(second=0, microsecond=0)
+    current = datetime.fromtimestamp(now)
+    if period == "ONCE":
+        return base.timestamp() if base >= current.replace(second=0, microsecond=0) else None
+    return _next_occurrence(base, period, max(td, current)).timestamp()
+
+
+def get_next_fire_at(timestamp: int, period: str, now: float) -> Optional[int]:
+    # get_next_fire_time as stored in the next_fire_at column
+    fire_at = get_next_fire_time(timestamp, period, now)
+    return int(fire_at) if fire_at is not None else None
+
+
+def _next_occurrence(base: datetime, period: str, lower: datetime) -> datetime:
+    # First occurrence at or after `lower` of a recurring announcement starting at `base`. Only the fields of `base`
+    # that the period repeats on are read, see schedule_key.
+    match period:
+        case "YEARLY":
+            candidate = _next_yearly(base, lower)
+        case "MONTHLY":
+            candidate = _next_monthly(base, lower)
+        case "WEEKLY":
+            candidate = lower.replace(hour=base.hour, minute=base.minute, second=0, microsecond=0)
+            candidate += timedelta(days=(base.weekday() - candidate.weekday()) % 7)
+            if candidate < lower:
+                candidate += timedelta(days=7)
+        case "DAILY":
+            candidate = lower.replace(hour=base.hour, minute=base.minute, second=0, microsecond=0)
+            if candidate < lower:
+                candidate += timedelta(days=1)
+        case "HOURLY":
+            candidate = lower.replace(minute=base.minute, second=0, microsecond=0)
+            if candidate < lower:
+                candidate += timedelta(hours=1)
+        case "MINUTELY":
+            candidate = lower.replace(second=0, microsecond=0)
+            if candidate < lower:
+                candidate += timedelta(minutes=1)
+        case _:
+            raise ValueError(f"Unknown period '{period}'")
+    return candidate
+
+
+def _next_monthly(base: datetime, lower: datetime) -> datetime:
+    # Months without the requested day (e.g. the 31st) are skipped, like cron does
+    year, month = lower.year, lower.month
+    while True:
+        if base.day <= calendar.monthrange(year, month)[1]:
+            candidate = datetime(year, month, base.day, base.hour, base.minute)
+            if candidate >= lower:
+                return candidate
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _next_yearly(base: datetime, lower: datetime) -> datetime:
+    # February 29th only fires on leap years
+    year = lower.year
+    while True:
+        if base.day <= calendar.monthrange(year, base.month)[1]:
+            candidate = datetime(year, base.month, base.day, base.hour, base.minute)
+            if candidate >= lower:
+                return candidate
+        year += 1
+
+
+def schedule_key(timestamp: int, period: str) -> tuple:
+    # Announcements with the same key share every occurrence, whatever their start: DAILY ones at 09:30 all fire at
+    # the same instants, so their occurrences only have to be computed once
+    base = datetime.fromtimestamp(timestamp)
+    match period:
+        case "YEARLY":
+            return period, base.month, base.day, base.hour, base.minute
+        case "MONTHLY":
+            return period, base.day, base.hour, base.minute
+        case "WEEKLY":
+            return period, base.weekday(), base.hour, base.minute
+        case "DAILY":
+            return period, base.hour, base.minute
+        case "HOURLY":
+            return period, base.minute
+        case "MINUTELY":
+            return (period,)
+        case _:
+            raise ValueError(f"Unknown period '{period}'")
+
+
+def expand_schedule(timestamp: int, period: str, start: int, end: int) -> list[int]:
+    # Every occurrence in [start, end) of the recurring schedule that `timestamp` belongs to, in order, ignoring when
+    # the announcement itself starts. Callers cut the list at the announcement's own first occurrence.
+    base = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0)
+    lower = datetime.fromtimestamp(start)
+    occurrences = []
+    while True:
+        candidate = _next_occurrence(base, period, lower)
+        fire_at = int(candidate.timestamp())
+        if fire_at >= end:
+            return occurrences
+        occurrences.append(fire_at)
+        lower = candidate + timedelta(minutes=1)
+
+
+def get_occurrence_number(timestamp: int, period: str, occurrence: int) -> int:
+    # 1 for the announcement's first occurrence, counted on wall-clock time so DST shifts don't skew DAILY and longer
+    # periods. Occurrences skipped because the day doesn't exist in a month or year aren't counted.
+    if period == "ONCE":
+        return 1
+    base = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0)
+    first = _next_occurrence(base, period, datetime.fromtimestamp(timestamp))
+    current = datetime.fromtimestamp(occurrence)
+    match period:
+        case "YEARLY":
+            return sum(base.day <= calendar.monthrange(year, base.month)[1]
+                       for year in range(first.year, current.year + 1))
+        case "MONTHLY":
+            months = (current.year - first.year) * 12 + current.month - first.month
+            return sum(base.day <= calendar.monthrange(first.year + (first.month - 1 + n) // 12,
+                                                       (first.month - 1 + n) % 12 + 1)[1]
+                       for n in range(months + 1))
+        case "WEEKLY":
+            return (current.date() - first.date()).days // 7 + 1
+        case "DAILY":
+            return (current.date() - first.date()).days + 1
+        case "HOURLY":
+            return int((current - first).total_seconds()) // 3600 + 1
+        case "MINUTELY":
+            return int((current - first).total_seconds()) // 60 + 1
+        case _:
+            raise ValueError(f"Unknown period '{period}'")